@@ -0,0 +1,67 @@
+"""
+Benchmark DuckDBStore range scans and resampling over many symbols of
+minute bars.
+
+Usage: python benchmarks/bench_analytics.py [n_symbols] [n_days]
+"""
+import sys
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+
+from ibstract.analytics import DuckDBStore
+
+
+def gen_bars(symbol: str, n_days: int, seed: int=0) -> pd.DataFrame:
+    """Random 1-minute bars of 390 minutes per weekday from 2007-01-01."""
+    rng = np.random.RandomState(seed)
+    days = pd.bdate_range('2007-01-01', periods=n_days, tz='US/Eastern')
+    minutes = pd.to_timedelta(np.arange(390), unit='m') + pd.Timedelta('9.5h')
+    times = (days.values[:, None] + minutes.values[None, :]).ravel()
+    n = len(times)
+    closing = 100 + np.cumsum(rng.normal(0, 0.05, n))
+    return pd.DataFrame({
+        'Symbol': symbol, 'DataType': 'TRADES', 'BarSize': '1m',
+        'TickerTime': pd.DatetimeIndex(times).tz_localize('UTC'),
+        'opening': closing + rng.normal(0, 0.01, n),
+        'high': closing + 0.05, 'low': closing - 0.05, 'closing': closing,
+        'volume': rng.randint(100, 10000, n),
+        'barcount': rng.randint(1, 100, n), 'average': closing,
+    })
+
+
+async def bench(label: str, n: int, coro):
+    t = time.perf_counter()
+    await coro
+    dt = time.perf_counter() - t
+    print('{:<40s} {:>14,.0f} bars/s  ({:.3f} s)'.format(label, n / dt, dt))
+
+
+async def main(n_symbols: int=20, n_days: int=2520):
+    store = DuckDBStore()
+    symbols = ['S%03d' % i for i in range(n_symbols)]
+    start = pd.Timestamp('2000-01-01', tz='UTC')
+    end = pd.Timestamp('2030-01-01', tz='UTC')
+    n = 0
+    t = time.perf_counter()
+    for i, symbol in enumerate(symbols):
+        df = gen_bars(symbol, n_days, seed=i)
+        n += len(df)
+        await store.insert('Stock', df)
+    dt = time.perf_counter() - t
+    print('{:,d} bars of {} symbols'.format(n, n_symbols))
+    print('{:<40s} {:>14,.0f} bars/s  ({:.3f} s)'.format('insert', n / dt, dt))
+
+    await bench('resample 1m -> 1d, all symbols', n, store.resample(
+        'Stock', None, 'TRADES', '1m', '1d', start, end, tz='US/Eastern'))
+    await bench('cross-symbol daily volume', n, store.sql(
+        "SELECT time_bucket(INTERVAL '1 day', TickerTime) AS Day, "
+        'sum(volume) AS volume FROM Stock GROUP BY Day'))
+    await bench('scan 10 symbols', n * 10 // n_symbols, store.scan(
+        'Stock', symbols[:10], 'TRADES', '1m', start, end))
+    await store.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(*map(int, sys.argv[1:])))
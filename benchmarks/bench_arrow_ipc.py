@@ -0,0 +1,73 @@
+"""
+Benchmark handing a large MarketDataBlock to another process through a
+file, by pickling its DataFrame and by an Arrow IPC file read memory
+mapped.
+
+Usage: python benchmarks/bench_arrow_ipc.py [n_symbols] [rows_per_symbol]
+"""
+import os
+import sys
+import time
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+
+from ibstract.marketdata import MarketDataBlock
+from ibstract.arrowipc import write_ipc_file, read_ipc_file
+
+
+def gen_blk(n_symbols: int, rows: int) -> MarketDataBlock:
+    """Random 1-minute bars of n_symbols symbols."""
+    rng = np.random.RandomState(0)
+    times = pd.date_range('2017-01-03 14:30', periods=rows, freq='min',
+                          tz='UTC')
+    frames = []
+    for i in range(n_symbols):
+        close = 100 + rng.normal(size=rows)
+        frames.append(pd.DataFrame({
+            'Symbol': 'S{:03d}'.format(i), 'DataType': 'TRADES',
+            'BarSize': '1m', 'TickerTime': times, 'opening': close,
+            'high': close, 'low': close, 'closing': close,
+            'volume': rng.randint(1, 1000, rows),
+            'barcount': rng.randint(1, 100, rows), 'average': close}))
+    blk = MarketDataBlock(None)
+    blk.df = pd.concat(frames).set_index(
+        MarketDataBlock.data_index).sort_index()
+    return blk
+
+
+def timed(label: str, func):
+    t = time.perf_counter()
+    ret = func()
+    print('{:<28s} {:>10.1f} ms'.format(label,
+                                        (time.perf_counter() - t) * 1e3))
+    return ret
+
+
+def main(n_symbols: int=20, rows: int=100000):
+    blk = gen_blk(n_symbols, rows)
+    print('{} symbols x {:,d} rows'.format(n_symbols, rows))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path_pkl = os.path.join(tmpdir, 'bars.pkl')
+        path_arrow = os.path.join(tmpdir, 'bars.arrow')
+
+        def dump():
+            with open(path_pkl, 'wb') as f:
+                pickle.dump(blk.df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def load():
+            with open(path_pkl, 'rb') as f:
+                return pickle.load(f)
+
+        timed('pickle dump', dump)
+        timed('pickle load', load)
+        timed('arrow write_ipc_file', lambda: write_ipc_file(blk, path_arrow))
+        blk_read = timed('arrow read_ipc_file', lambda: read_ipc_file(
+            path_arrow))
+        assert blk_read.df.equals(blk.df)
+        del blk_read
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,99 @@
+"""
+Benchmark backfill throughput of BackfillJob in one process and of
+BackfillCoordinator with increasing numbers of worker processes, on
+1-minute bars of a broker generating random bars without delay, so the
+standardization, merging and storing of bars is the bottleneck. Workers
+write to their own SQLite files.
+
+Usage: python benchmarks/bench_backfill_workers.py [n_symbols] [max_workers]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import pytz
+
+from ibstract.marketdata import MarketDataBlock, hist_data_req_start_end
+from ibstract.storage import SQLiteStore
+from ibstract.backfill import BackfillJob, BackfillCoordinator
+
+
+class RandomBroker:
+    """Broker of random 1-minute bars of the regular session."""
+    async def hist_data_req_timezone(self, req):
+        return pytz.timezone('US/Eastern')
+
+    async def req_hist_data_async(self, *req_list):
+        blk_list = []
+        for req in req_list:
+            xchg_tz = await self.hist_data_req_timezone(req)
+            _, _, trd_days = hist_data_req_start_end(req, xchg_tz)
+            mins = pd.to_timedelta(np.arange(390), unit='m') + \
+                pd.Timedelta('9.5h')
+            times = (pd.DatetimeIndex(trd_days).tz_localize(None).values[
+                :, None] + mins.values[None, :]).ravel()
+            rng = np.random.RandomState(hash(req.Symbol) % 2**32)
+            closing = np.round(100 + np.cumsum(
+                rng.normal(0, 0.01, len(times))), 2)
+            df = pd.DataFrame({
+                'TickerTime': times, 'opening': closing,
+                'high': closing + 0.01, 'low': closing - 0.01,
+                'closing': closing,
+                'volume': rng.randint(0, 5000, len(times)),
+                'barcount': rng.randint(0, 50, len(times)),
+                'average': closing})
+            blk_list.append(MarketDataBlock(
+                df, symbol=req.Symbol, datatype=req.DataType,
+                barsize=req.BarSize, tz=xchg_tz))
+        return blk_list
+
+
+class OpenWorker:
+    def __init__(self, tmpdir: str):
+        self.tmpdir = tmpdir
+
+    async def __call__(self, worker_id):
+        return RandomBroker(), await SQLiteStore.open(
+            os.path.join(self.tmpdir, 'w{}.db'.format(worker_id)))
+
+
+def run(n_symbols: int, n_workers: int) -> dict:
+    universe = [('S{:03d}'.format(i), 'Stock', 'SMART', 'USD')
+                for i in range(n_symbols)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        job = BackfillJob(universe, ['1m'], '2017-01-01', '2017-03-01',
+                          os.path.join(tmpdir, 'backfill.ckpt'),
+                          concurrency=1, report_interval=600.)
+        open_worker = OpenWorker(tmpdir)
+        if n_workers == 0:
+            async def run_job():
+                broker, store = await open_worker(0)
+                stats = await job.run(broker, store)
+                await store.close()
+                return stats
+            return asyncio.new_event_loop().run_until_complete(run_job())
+        return BackfillCoordinator(job, open_worker, n_workers=n_workers,
+                                   context='fork').run()
+
+
+def main(n_symbols: int=16, max_workers: int=None):
+    logging.basicConfig(level=logging.WARNING)
+    max_workers = max_workers or os.cpu_count()
+    print('{} symbols of 1-minute bars, {} CPUs'.format(n_symbols,
+                                                       os.cpu_count()))
+    for n_workers in [0] + [n for n in (1, 2, 4, 8, 16, 32)
+                            if n <= max_workers]:
+        t = time.perf_counter()
+        stats = run(n_symbols, n_workers)
+        elapsed = time.perf_counter() - t
+        print('{:<14s} {:>10,d} bars {:>7.2f} s {:>10,.0f} bars/s'.format(
+            'job' if n_workers == 0 else '{} workers'.format(n_workers),
+            stats['bars'], elapsed, stats['bars'] / elapsed))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,50 @@
+"""
+Benchmark memory of a universe of 1-minute bars in MarketDataBlocks, with
+default and compact dtypes.
+
+Usage: python benchmarks/bench_block_memory.py [n_symbols] [rows_per_symbol]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from ibstract.marketdata import MarketDataBlock
+
+
+def gen_df(n_symbols: int, rows: int) -> pd.DataFrame:
+    """Random 1-minute OHLC bars at cent precision."""
+    rng = np.random.RandomState(0)
+    times = pd.date_range('2017-01-03 14:30', periods=rows, freq='min',
+                          tz='UTC')
+    frames = []
+    for i in range(n_symbols):
+        close = np.round(50 + rng.uniform(0, 500) +
+                         np.cumsum(rng.normal(0, 0.05, rows)), 2)
+        frames.append(pd.DataFrame({
+            'Symbol': 'S{:03d}'.format(i), 'DataType': 'TRADES',
+            'BarSize': '1m', 'TickerTime': times, 'opening': close,
+            'high': close + 0.05, 'low': close - 0.05, 'closing': close,
+            'volume': rng.randint(0, 200000, rows),
+            'barcount': rng.randint(0, 2000, rows), 'average': close}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(n_symbols: int=20, rows: int=100000):
+    df = gen_df(n_symbols, rows)
+    print('{} symbols x {:,d} rows'.format(n_symbols, rows))
+    usages = []
+    for compact in (False, True):
+        t = time.perf_counter()
+        blk = MarketDataBlock(df, compact=compact)
+        dt = time.perf_counter() - t
+        usages.append(blk.memory_usage())
+        print('compact={!s:<6s} {:>8.1f} MB, built in {:.2f} s'.format(
+            compact, usages[-1].sum() / 2**20, dt))
+    table = pd.DataFrame({'default': usages[0], 'compact': usages[1]})
+    print(table)
+    print('ratio {:.2f}'.format(usages[1].sum() / usages[0].sum()))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
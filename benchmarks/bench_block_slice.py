@@ -0,0 +1,56 @@
+"""
+Benchmark time-range slicing of a large MarketDataBlock, by MultiIndex
+.loc as get_hist_data() used to, and by MarketDataBlock.slice().
+
+Usage: python benchmarks/bench_block_slice.py [n_symbols] [rows_per_symbol]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from ibstract.marketdata import MarketDataBlock
+
+
+def gen_blk(n_symbols: int, rows: int) -> MarketDataBlock:
+    """Random 1-minute bars of n_symbols symbols."""
+    rng = np.random.RandomState(0)
+    times = pd.date_range('2017-01-03 14:30', periods=rows, freq='min',
+                          tz='UTC')
+    frames = [pd.DataFrame({
+        'Symbol': 'S{:03d}'.format(i), 'DataType': 'TRADES', 'BarSize': '1m',
+        'TickerTime': times, 'closing': 100 + rng.normal(size=rows),
+        'volume': rng.randint(1, 1000, rows)}) for i in range(n_symbols)]
+    return MarketDataBlock(pd.concat(frames, ignore_index=True))
+
+
+def bench(label: str, windows: list, func):
+    t = time.perf_counter()
+    nrows = sum(len(func(start, end)) for start, end in windows)
+    dt = time.perf_counter() - t
+    print('{:<32s} {:>10.1f} us/slice, {:,d} rows'.format(
+        label, dt / len(windows) * 1e6, nrows))
+
+
+def main(n_symbols: int=20, rows: int=100000, n_slices: int=200):
+    blk = gen_blk(n_symbols, rows)
+    times = blk.df.index.get_level_values('TickerTime').unique()
+    rng = np.random.RandomState(1)
+    windows = []
+    for i in rng.randint(0, len(times) - 390, n_slices):
+        windows.append((times[i], times[i + 389]))
+    symbol = 'S000'
+    print('{} symbols x {:,d} rows'.format(n_symbols, rows))
+    blk.slice()  # build the segment cache once
+    bench('loc, all symbols', windows,
+          lambda start, end: blk.df.loc(axis=0)[:, :, :, start:end])
+    bench('slice, all symbols', windows,
+          lambda start, end: blk.slice(start, end).df)
+    bench('loc, one symbol', windows,
+          lambda start, end: blk.df.loc(axis=0)[symbol, :, :, start:end])
+    bench('slice, one symbol', windows,
+          lambda start, end: blk.slice(start, end, [symbol]).df)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""
+Benchmark ChunkStore against SQLiteStore on 5-second bars: row count, file
+size, insert and whole-range query throughput.
+
+Usage: python benchmarks/bench_chunkdb.py [n_days]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import numpy as np
+import pandas as pd
+
+from ibstract.storage import SQLiteStore
+from ibstract.chunkdb import ChunkStore
+
+
+def gen_bars(n_days: int, seed: int=0) -> pd.DataFrame:
+    """Random 5-second bars of the regular session of weekdays."""
+    rng = np.random.RandomState(seed)
+    days = pd.bdate_range('2017-01-02', periods=n_days)
+    secs = pd.to_timedelta(np.arange(0, 23400, 5), unit='s') + \
+        pd.Timedelta('14.5h')
+    times = (days.values[:, None] + secs.values[None, :]).ravel()
+    n = len(times)
+    closing = np.round(100 + np.cumsum(rng.normal(0, 0.01, n)), 2)
+    return pd.DataFrame({
+        'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '5s',
+        'TickerTime': pd.DatetimeIndex(times).tz_localize('UTC'),
+        'opening': closing, 'high': closing + 0.01, 'low': closing - 0.01,
+        'closing': closing, 'volume': rng.randint(0, 5000, n),
+        'barcount': rng.randint(0, 50, n), 'average': closing,
+    })
+
+
+async def bench(store_cls, path: str, df: pd.DataFrame, table: str):
+    store = await store_cls.open(path)
+    t = time.perf_counter()
+    await store.insert('Stock', df)
+    t_insert = time.perf_counter() - t
+    t = time.perf_counter()
+    df_q = await store.query('Stock', 'GS', 'TRADES', '5s',
+                             df.TickerTime.iloc[0], df.TickerTime.iloc[-1])
+    t_query = time.perf_counter() - t
+    async with store.conn.execute(
+            'SELECT COUNT(*) FROM "{}"'.format(table)) as cur:
+        n_rows = (await cur.fetchone())[0]
+    await store.close()
+    assert len(df_q) == len(df)
+    print('{:<12s} {:>10,d} rows {:>8.1f} MB  insert {:>10,.0f} bars/s  '
+          'query {:>12,.0f} bars/s'.format(
+              store_cls.__name__, n_rows, os.path.getsize(path) / 2**20,
+              len(df) / t_insert, len(df) / t_query))
+
+
+def main(n_days: int=20):
+    df = gen_bars(n_days)
+    print('{:,d} bars of {} days'.format(len(df), n_days))
+    loop = asyncio.get_event_loop()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        loop.run_until_complete(bench(
+            SQLiteStore, os.path.join(tmpdir, 'rows.db'), df, 'Stock'))
+        loop.run_until_complete(bench(
+            ChunkStore, os.path.join(tmpdir, 'chunks.db'), df, 'StockChunks'))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
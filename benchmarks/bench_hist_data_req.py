@@ -0,0 +1,39 @@
+"""
+Benchmark building the requests of a universe of symbols one by one with
+HistDataReq() and in bulk with HistDataReq.from_frame(), and using them as
+set members.
+
+Usage: python benchmarks/bench_hist_data_req.py [n_symbols]
+"""
+import sys
+import time
+import pandas as pd
+
+from ibstract.utils import dtest
+from ibstract.marketdata import HistDataReq
+
+
+def main(n_symbols: int=5000):
+    symbols = ['S{:05d}'.format(i) for i in range(n_symbols)]
+    time_end = dtest(2017, 9, 16)
+    df = pd.DataFrame({'Symbol': symbols, 'SecType': 'stock'})
+
+    t = time.perf_counter()
+    reqs = [HistDataReq('stock', sym, '1 min', '5 days', time_end)
+            for sym in symbols]
+    t_init = time.perf_counter() - t
+    t = time.perf_counter()
+    reqs_bulk = HistDataReq.from_frame(df, barsize='1 min', timedur='5 days',
+                                       timeend=time_end)
+    t_bulk = time.perf_counter() - t
+    t = time.perf_counter()
+    n_unique = len(set(reqs) | set(reqs_bulk))
+    t_set = time.perf_counter() - t
+    assert reqs == reqs_bulk and n_unique == n_symbols
+    print('{:,d} requests: HistDataReq() {:.1f} ms, from_frame() {:.1f} ms, '
+          'set of both {:.1f} ms'.format(n_symbols, t_init * 1e3,
+                                         t_bulk * 1e3, t_set * 1e3))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,68 @@
+"""
+Benchmark event-loop lag while merging large MarketDataBlocks, with pandas
+transforms run inline on the loop, in a thread pool, or in a process pool.
+
+Usage: python benchmarks/bench_loop_lag.py [n_blocks] [rows_per_block]
+"""
+import sys
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+
+from ibstract.marketdata import MarketDataBlock, set_transform_executor
+
+
+def gen_blk(i: int, rows: int) -> MarketDataBlock:
+    """Random 1-minute bars, block i following block i-1 in time."""
+    rng = np.random.RandomState(i)
+    times = pd.date_range('2017-01-03 14:30', periods=rows, freq='min',
+                          tz='UTC') + pd.Timedelta(minutes=rows * i)
+    df = pd.DataFrame({
+        'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '1m',
+        'TickerTime': times, 'closing': 100 + rng.normal(size=rows),
+        'volume': rng.randint(1, 1000, rows)})
+    return MarketDataBlock(df)
+
+
+async def heartbeat(lags: list, interval: float=0.001):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - t - interval)
+
+
+async def merge(blks: list):
+    blk_ret = MarketDataBlock(None)
+    for blk in blks:
+        await blk_ret.combine_async(blk)
+        await asyncio.sleep(0)
+    return blk_ret
+
+
+async def run(blks: list):
+    lags = []
+    hb = asyncio.ensure_future(heartbeat(lags))
+    await asyncio.sleep(0.01)
+    t = time.perf_counter()
+    blk = await merge(blks)
+    dt = time.perf_counter() - t
+    hb.cancel()
+    return len(blk), dt, max(lags), np.percentile(lags, 99)
+
+
+def main(n: int=20, rows: int=100000):
+    blks = [gen_blk(i, rows) for i in range(n)]
+    print('{} blocks of {:,d} rows'.format(n, rows))
+    loop = asyncio.get_event_loop()
+    for executor in ('inline', 'thread', 'process'):
+        set_transform_executor(executor, max_workers=1)
+        nrows, dt, lag_max, lag_p99 = loop.run_until_complete(run(blks))
+        print('{:<8s} {:,d} rows in {:.2f} s, loop lag max {:.1f} ms, '
+              'p99 {:.1f} ms'.format(
+                  executor, nrows, dt, lag_max * 1e3, lag_p99 * 1e3))
+    set_transform_executor(None)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+Benchmark building a time x symbol matrix of closes from a multi-symbol
+MarketDataBlock, by unstacking the MultiIndex and by MarketDataPanel, and
+extending the panel by one new bar per symbol.
+
+Usage: python benchmarks/bench_panel.py [n_symbols] [rows_per_symbol]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from ibstract.marketdata import MarketDataBlock
+from ibstract.panel import MarketDataPanel
+
+
+def gen_blk(n_symbols: int, rows: int, start: str) -> MarketDataBlock:
+    """Random 1-minute bars, each symbol missing 5% of the bars."""
+    rng = np.random.RandomState(0)
+    times = pd.date_range(start, periods=rows, freq='min', tz='UTC')
+    frames = []
+    for i in range(n_symbols):
+        keep = rng.uniform(size=rows) > 0.05 if rows > 1 else [True]
+        frames.append(pd.DataFrame({
+            'Symbol': 'S{:03d}'.format(i), 'DataType': 'TRADES',
+            'BarSize': '1m', 'TickerTime': times[keep],
+            'closing': 100 + rng.normal(size=rows)[keep]}))
+    blk = MarketDataBlock(None)
+    blk.df = pd.concat(frames).set_index(
+        MarketDataBlock.data_index).sort_index()
+    return blk
+
+
+def timed(label: str, func):
+    t = time.perf_counter()
+    ret = func()
+    print('{:<36s} {:>10.1f} ms'.format(label,
+                                        (time.perf_counter() - t) * 1e3))
+    return ret
+
+
+def main(n_symbols: int=500, rows: int=5000):
+    blk = gen_blk(n_symbols, rows, '2017-01-03 14:30')
+    print('{} symbols x {:,d} rows'.format(n_symbols, rows))
+    timed('unstack', lambda: blk.df['closing'].unstack('Symbol'))
+    panel = timed('MarketDataPanel.from_block', lambda: MarketDataPanel.
+                  from_block(blk, fields=['closing'], fill='ffill'))
+    timed('unstack + ffill + corr', lambda: blk.df['closing'].unstack(
+        'Symbol').ffill().pct_change().corr())
+    timed('panel corr', lambda: panel.frame('closing').pct_change().corr())
+    blk_new = gen_blk(n_symbols, 1, '2017-01-10 14:30')
+    timed('extend by one bar per symbol', lambda: panel.extend(blk_new))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,74 @@
+"""
+Benchmark per-query CPU overhead of building and compiling SQLAlchemy
+statements for MySQL, with and without the caches in ibstract.storage.
+No database is needed: only statement preparation is timed, which runs on
+the event loop for each query and insert. The cached cases time a cache
+hit, i.e. the lookup of a statement built and compiled once; binding the
+parameters and executing are not timed.
+
+Usage: python benchmarks/bench_sa_statements.py [n_queries]
+"""
+import sys
+import time
+from datetime import datetime
+import pytz
+from aiomysql.sa.engine import _dialect
+from sqlalchemy.sql import and_
+
+from ibstract.storage import _gen_sa_table, _compiled_sql
+from ibstract.storage import _gen_select_stmt, _gen_insert_stmt
+
+
+def bench(label: str, n: int, func):
+    t = time.perf_counter()
+    for _ in range(n):
+        func()
+    dt = time.perf_counter() - t
+    print('{:<40s} {:>10.1f} us/query'.format(label, dt / n * 1e6))
+
+
+def main(n: int=2000):
+    start = datetime(2017, 9, 1, tzinfo=pytz.UTC)
+    end = datetime(2017, 9, 8, tzinfo=pytz.UTC)
+    records = [{
+        'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '1m',
+        'TickerTime': datetime(2017, 9, 1, 13, i % 60), 'opening': 1.0,
+        'high': 1.0, 'low': 1.0, 'closing': 1.0, 'volume': 1,
+        'barcount': 1, 'average': 1.0} for i in range(390)]
+    columns = tuple(records[0])
+
+    def select_uncached():
+        table = _gen_sa_table('Stock')
+        stmt = table.select().where(
+            and_(
+                table.c.Symbol == 'GS',
+                table.c.DataType == 'TRADES',
+                table.c.BarSize == '1m',
+                table.c.TickerTime.between(start, end)
+            )
+        )
+        compiled = stmt.compile(dialect=_dialect)
+        str(compiled), compiled.construct_params()
+
+    def select_cached():
+        _compiled_sql(('select', 'Stock'), _dialect, _gen_select_stmt,
+                      'Stock')
+
+    def insert_uncached():
+        table = _gen_sa_table('Stock')
+        stmt = table.insert().prefix_with('IGNORE').values(records)
+        compiled = stmt.compile(dialect=_dialect)
+        str(compiled), compiled.construct_params()
+
+    def insert_cached():
+        _compiled_sql(('insert', 'Stock', columns), _dialect,
+                      _gen_insert_stmt, 'Stock', columns)
+
+    bench('select, build and compile per query', n, select_uncached)
+    bench('select, cache hit', n, select_cached)
+    bench('insert 390 rows, build and compile', n // 20, insert_uncached)
+    bench('insert 390 rows, cache hit', n, insert_cached)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,57 @@
+"""
+Benchmark tick ingestion throughput and vectorized tick-to-bar conversion.
+
+Usage: python benchmarks/bench_ticks.py [n_ticks]
+"""
+import sys
+import time
+import numpy as np
+
+from ibstract.ticks import TICK_DTYPE, TickIngestor, ticks_to_bars
+
+
+def gen_ticks(n: int, seed: int=0) -> np.ndarray:
+    """Random trade ticks at ~1000 ticks per second starting 2017-09-12."""
+    rng = np.random.RandomState(seed)
+    ticks = np.empty(n, dtype=TICK_DTYPE)
+    t0 = 1505223000 * 10**9
+    ticks['time'] = t0 + np.cumsum(rng.exponential(1e6, n)).astype(np.int64)
+    ticks['ticktype'] = 4
+    ticks['price'] = 100 + np.cumsum(rng.normal(0, 0.01, n))
+    ticks['size'] = rng.randint(1, 10, n) * 100
+    return ticks
+
+
+def bench(label: str, n: int, func):
+    t = time.perf_counter()
+    func()
+    dt = time.perf_counter() - t
+    print('{:<40s} {:>12,.0f} ticks/s  ({:.3f} s)'.format(label, n / dt, dt))
+
+
+def main(n: int=1000000):
+    ticks = gen_ticks(n)
+    print('{:,d} ticks'.format(n))
+
+    def append_one_by_one():
+        ingestor = TickIngestor('1m', batch_size=50000)
+        add_tick = ingestor.add_tick
+        for t, tt, p, s in ticks.tolist():
+            add_tick('GS', t, tt, p, s)
+        ingestor.flush(final=True)
+
+    def extend_in_batches(batch: int=1000):
+        ingestor = TickIngestor('1m', batch_size=50000)
+        for i in range(0, n, batch):
+            ingestor.add_ticks('GS', ticks[i:i+batch])
+        ingestor.flush(final=True)
+
+    bench('TickIngestor.add_tick', n, append_one_by_one)
+    bench('TickIngestor.add_ticks (1000/batch)', n, extend_in_batches)
+    for barsize in ('1s', '1m'):
+        bench('ticks_to_bars %s' % barsize, n,
+              lambda: ticks_to_bars(ticks, 'GS', barsize))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -18,6 +18,17 @@ if ibver < (9, 73, 2):
 
 from .brokers import *
 from .marketdata import *
+from .ticks import *
+from .compactdb import *
+from .storage import *
+from .chunkdb import *
+from .analytics import *
+from .panel import *
+from .arrowipc import *
+from .shmcache import *
+from .gateway import *
+from .monitor import *
+from .backfill import *
 from .financedata import *
 from .trading import *
 from .ibglobals import *
@@ -26,5 +37,7 @@ from . import utils
 __version__ = '1.0.0a2'
 
 __all__ = ['utils']
-for _m in (brokers, marketdata, financedata, trading, ibglobals):
+for _m in (brokers, marketdata, ticks, compactdb, storage, chunkdb,
+           analytics, panel, arrowipc, shmcache, gateway, monitor,
+           backfill, financedata, trading, ibglobals):
     __all__ += _m.__all__
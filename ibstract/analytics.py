@@ -0,0 +1,220 @@
+"""
+Embedded columnar analytics backend for historical bars.
+
+DuckDBStore keeps the same bar data as the primary store in a DuckDB database,
+and answers multi-symbol range scans, resampling and ad-hoc aggregations with
+vectorized SQL. Keep it in sync with the primary store through the insert
+path with MirroredStore:
+
+    duck = DuckDBStore('bars.duckdb')
+    store = MirroredStore(await SQLiteStore.open('ibstract.db'), duck)
+    blk = await get_hist_data(req, broker, store=store)
+    blk_1d = await duck.resample('Stock', ['GS', 'MS'], 'TRADES', '1h', '1d',
+                                 start, end, tz='US/Eastern')
+
+Existing data is copied in with DuckDBStore.load(). Requires duckdb.
+"""
+import logging
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pandas as pd
+
+from .utils import SEC_TYPES
+from .utils import timedur_standardize
+from .marketdata import MarketDataBlock
+from .storage import HistDataStore, BAR_COLUMNS
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+_logger = logging.getLogger('ibstract.analytics')
+__all__ = ['DuckDBStore']
+
+
+INDEX_COLUMNS = ['Symbol', 'DataType', 'BarSize', 'TickerTime']
+
+_INTERVAL_UNITS = {'s': 'second', 'm': 'minute', 'h': 'hour', 'd': 'day',
+                   'W': 'week', 'M': 'month', 'Y': 'year'}
+
+
+def _utc_naive(dt: datetime) -> pd.Timestamp:
+    """Naive UTC Timestamp of dt. Naive dt is taken as UTC.
+    """
+    ts = pd.Timestamp(dt)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return ts
+
+
+def _interval(barsize: str) -> str:
+    barsize = timedur_standardize(barsize)
+    return "INTERVAL '{} {}'".format(barsize[:-1],
+                                     _INTERVAL_UNITS[barsize[-1]])
+
+
+class DuckDBStore(HistDataStore):
+    """
+    Columnar storage of bars in DuckDB, one table per sectype, with
+    TickerTime stored as naive UTC TIMESTAMP. All statements run on one
+    worker thread, off the event loop.
+
+    :param path: Database file, or ':memory:'.
+    """
+    transient_errors = ()
+
+    def __init__(self, path: str=':memory:'):
+        if duckdb is None:
+            raise ImportError('DuckDBStore requires duckdb.')
+        self.path = path
+        self.conn = duckdb.connect(path)
+        self.conn.execute("SET TimeZone = 'UTC'")
+        for sectype in SEC_TYPES:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" ('
+                'Symbol VARCHAR NOT NULL, DataType VARCHAR NOT NULL, '
+                'BarSize VARCHAR NOT NULL, TickerTime TIMESTAMP NOT NULL, '
+                'opening DOUBLE, high DOUBLE, low DOUBLE, closing DOUBLE, '
+                'volume BIGINT, barcount BIGINT, average DOUBLE)'
+                .format(sectype))
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _fetch_df(self, sql: str, params: list=None) -> pd.DataFrame:
+        return self.conn.execute(sql, params or []).df()
+
+    @staticmethod
+    def _to_blk(df: pd.DataFrame, tz: str=None) -> MarketDataBlock:
+        if df.empty:
+            return MarketDataBlock(None)
+        df['TickerTime'] = pd.DatetimeIndex(
+            df['TickerTime']).tz_localize('UTC')
+        blk = MarketDataBlock(df, tz='UTC')
+        if tz is not None:
+            blk.tz = tz
+        return blk
+
+    async def query(self, sectype, symbol, datatype, barsize, start, end):
+        sql = ('SELECT {} FROM "{}" WHERE Symbol = ? AND DataType = ? AND '
+               'BarSize = ? AND TickerTime BETWEEN ? AND ? '
+               'ORDER BY TickerTime').format(
+                   ', '.join(INDEX_COLUMNS + BAR_COLUMNS), sectype)
+        df = await self._run(self._fetch_df, sql, [
+            symbol, datatype, barsize, _utc_naive(start), _utc_naive(end)])
+        df['TickerTime'] = pd.DatetimeIndex(
+            df['TickerTime']).tz_localize('UTC')
+        return df
+
+    def _insert(self, sectype, df):
+        rows = df[INDEX_COLUMNS + [
+            col for col in BAR_COLUMNS if col in df.columns]].copy()
+        rows['TickerTime'] = pd.DatetimeIndex(
+            rows['TickerTime']).tz_convert('UTC').tz_localize(None)
+        self.conn.register('_ibstract_bars', rows)
+        try:
+            # Anti-join instead of a primary key index, which makes bulk
+            # loading several times slower.
+            self.conn.execute(
+                'INSERT INTO "{0}" ({1}) SELECT {1} FROM ('
+                'SELECT DISTINCT ON (Symbol, DataType, BarSize, TickerTime) * '
+                'FROM _ibstract_bars) AS n WHERE NOT EXISTS ('
+                'SELECT 1 FROM "{0}" AS t WHERE t.Symbol = n.Symbol AND '
+                't.DataType = n.DataType AND t.BarSize = n.BarSize AND '
+                't.TickerTime = n.TickerTime AND t.TickerTime BETWEEN ? AND ?)'
+                .format(sectype, ', '.join(rows.columns)),
+                [rows['TickerTime'].min(), rows['TickerTime'].max()])
+        finally:
+            self.conn.unregister('_ibstract_bars')
+
+    async def insert(self, sectype, df):
+        if df.empty:
+            return
+        await self._run(self._insert, sectype, df)
+
+    async def close(self):
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self._executor.shutdown(wait=False)
+            self.conn = None
+
+    async def scan(self, sectype: str, symbols: list, datatype: str,
+                   barsize: str, start: datetime, end: datetime,
+                   tz: str=None) -> MarketDataBlock:
+        """
+        Return bars of many symbols between start and end in one
+        MarketDataBlock. If symbols is None, all symbols are returned.
+        """
+        sql, params = self._where(sectype, symbols, datatype, barsize,
+                                  start, end)
+        sql = 'SELECT {} FROM {} ORDER BY Symbol, TickerTime'.format(
+            ', '.join(INDEX_COLUMNS + BAR_COLUMNS), sql)
+        return self._to_blk(await self._run(self._fetch_df, sql, params), tz)
+
+    async def resample(self, sectype: str, symbols: list, datatype: str,
+                       barsize: str, to_barsize: str, start: datetime,
+                       end: datetime, tz: str=None) -> MarketDataBlock:
+        """
+        Aggregate bars of barsize to bars of a longer to_barsize, like
+        '1h' to '1d', for many symbols. Bars of a day or longer are aligned
+        to midnight in time zone tz, UTC by default, and shorter bars to UTC.
+        'average' is the volume-weighted average.
+        """
+        to_barsize = timedur_standardize(to_barsize)
+        sql, params = self._where(sectype, symbols, datatype, barsize,
+                                  start, end)
+        if to_barsize[-1] in ('s', 'm', 'h') or tz is None:
+            bucket = 'time_bucket({}, TickerTime)'
+            ticker_time = 'Bucket'
+            tz_params = []
+        else:
+            # Bucket by local wall time, converting only bucket starts back
+            # to UTC. time_bucket() with a time zone is much slower.
+            bucket = "time_bucket({}, timezone(?, TickerTime::TIMESTAMPTZ))"
+            ticker_time = "timezone('UTC', timezone(?, Bucket))"
+            tz_params = [str(tz)]
+        sql = (
+            'SELECT Symbol, DataType, ? AS BarSize, {} AS TickerTime, '
+            'arg_min(opening, TickerTime) AS opening, max(high) AS high, '
+            'min(low) AS low, arg_max(closing, TickerTime) AS closing, '
+            'sum(volume) AS volume, sum(barcount) AS barcount, '
+            'sum(average * volume) / nullif(sum(volume), 0) AS average '
+            'FROM (SELECT *, {} AS Bucket FROM {}) '
+            'GROUP BY Symbol, DataType, Bucket '
+            'ORDER BY Symbol, TickerTime').format(
+                ticker_time, bucket.format(_interval(to_barsize)), sql)
+        params = [to_barsize] + tz_params + tz_params + params
+        return self._to_blk(await self._run(self._fetch_df, sql, params), tz)
+
+    async def sql(self, stmt: str, params: list=None) -> pd.DataFrame:
+        """
+        Run any SQL statement, e.g. a cross-symbol aggregation, and return
+        the result as a DataFrame. Tables are named by sectype.
+        """
+        return await self._run(self._fetch_df, stmt, params)
+
+    async def load(self, store: HistDataStore, sectype: str, symbols: list,
+                   datatype: str, barsize: str, start: datetime,
+                   end: datetime):
+        """Copy bars already in another store, e.g. MySQLStore.
+        """
+        for symbol in symbols:
+            await self.insert(sectype, await store.query(
+                sectype, symbol, datatype, barsize, start, end))
+
+    @staticmethod
+    def _where(sectype, symbols, datatype, barsize, start, end):
+        sql = ('"{}" WHERE DataType = ? AND BarSize = ? '
+               'AND TickerTime BETWEEN ? AND ?').format(sectype)
+        params = [datatype, timedur_standardize(barsize),
+                  _utc_naive(start), _utc_naive(end)]
+        if symbols is not None:
+            if isinstance(symbols, str):
+                symbols = [symbols]
+            sql += ' AND Symbol IN ({})'.format(', '.join('?' * len(symbols)))
+            params += list(symbols)
+        return sql, params
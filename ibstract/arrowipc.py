@@ -0,0 +1,101 @@
+"""
+Arrow IPC streams and files of MarketDataBlocks, to hand bars to other
+processes or keep them on disk without pickling.
+
+Blocks are written as record batches of the stable schema of
+MarketDataBlock.to_arrow(). A file is read memory mapped, so the bar
+columns of the returned block are backed by the file pages without copying:
+
+    write_ipc_file([blk_gs, blk_ms], 'bars.arrow')
+    blk = read_ipc_file('bars.arrow')
+
+    # Producer process
+    with open(fifo_path, 'wb') as sink:
+        write_ipc_stream([blk], sink)
+    # Consumer process
+    with open(fifo_path, 'rb') as source:
+        for blk in iter_ipc_stream(source):
+            ...
+
+Requires pyarrow.
+"""
+import logging
+
+from .marketdata import MarketDataBlock, ARROW_SCHEMA
+from .marketdata import pa
+
+
+_logger = logging.getLogger('ibstract.arrowipc')
+__all__ = ['write_ipc_stream', 'read_ipc_stream', 'iter_ipc_stream',
+           'write_ipc_file', 'read_ipc_file']
+
+
+def _blocks_table(blocks: list):
+    """One table of blocks, with unified Symbol, DataType and BarSize
+    dictionaries as the IPC file format requires.
+    """
+    if pa is None:
+        raise ImportError('Arrow IPC requires pyarrow.')
+    if isinstance(blocks, MarketDataBlock):
+        blocks = [blocks]
+    tables = [blk.to_arrow() for blk in blocks]
+    if not tables:
+        return ARROW_SCHEMA.with_metadata({'tz': 'UTC'}).empty_table()
+    schema = tables[0].schema
+    table = pa.concat_tables([table.replace_schema_metadata(schema.metadata)
+                              for table in tables])
+    return table.unify_dictionaries()
+
+
+def write_ipc_stream(blocks: list, sink, max_chunksize: int=None):
+    """
+    Write blocks to an Arrow IPC stream.
+    :param blocks: A MarketDataBlock or a list of them. The time zone of
+                   the first one is kept in the schema.
+    :param sink: Path or writable file object.
+    :param max_chunksize: Max rows of a record batch. None: a batch per
+                          block.
+    """
+    table = _blocks_table(blocks)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize)
+
+
+def iter_ipc_stream(source, tz: str=None):
+    """Yield a MarketDataBlock of each record batch of an Arrow IPC stream.
+    :param source: Path, readable file object or buffer.
+    """
+    with pa.ipc.open_stream(source) as reader:
+        if tz is None:
+            tz = (reader.schema.metadata or {}).get(b'tz', b'UTC').decode()
+        for batch in reader:
+            yield MarketDataBlock.from_arrow(batch, tz=tz)
+
+
+def read_ipc_stream(source, tz: str=None) -> MarketDataBlock:
+    """Read a whole Arrow IPC stream to a MarketDataBlock.
+    """
+    with pa.ipc.open_stream(source) as reader:
+        return MarketDataBlock.from_arrow(reader.read_all(), tz=tz)
+
+
+def write_ipc_file(blocks: list, path: str, max_chunksize: int=None):
+    """Write blocks to an Arrow IPC file, see write_ipc_stream().
+    """
+    table = _blocks_table(blocks)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize)
+
+
+def read_ipc_file(path: str, tz: str=None,
+                  memory_map: bool=True) -> MarketDataBlock:
+    """
+    Read an Arrow IPC file to a MarketDataBlock. With memory_map, bar
+    columns of a file of one record batch are read-only views of the
+    mapped file.
+    """
+    source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+    with source:
+        return MarketDataBlock.from_arrow(
+            pa.ipc.open_file(source).read_all(), tz=tz)
@@ -0,0 +1,587 @@
+"""
+Resumable backfill of historical data for a universe of symbols.
+
+The whole job is planned up front as chunks of one symbol, bar size and
+calendar period each. Chunks are run by get_hist_data() with bounded
+concurrency, and each completed chunk is appended to a checkpoint file, so
+a restarted job skips the chunks already done. Progress and throughput are
+logged while the job runs.
+
+BackfillCoordinator runs a job by worker processes, each with its own event
+loop, IB client id and database connections, on the symbols of a partition
+of the universe. Workers take requests from a PacingBudget shared by all of
+them, and report completed chunks to the coordinator, which writes the
+checkpoint and logs the progress of the whole job.
+
+    python -m ibstract.backfill universe.txt --barsize 1d --barsize 1h \
+        --start 2015-01-01 --end 2018-01-01 --sqlite ibstract.db \
+        --checkpoint backfill.ckpt --workers 4 --max-requests 60
+
+A universe file lists one symbol per line as 'Symbol[,SecType[,Exchange
+[,Currency]]]'. Empty lines and lines starting with '#' are skipped.
+"""
+import logging
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from queue import Empty
+from datetime import datetime
+import pytz
+import pandas as pd
+
+from .utils import timedur_standardize, trading_days
+from .marketdata import HistDataReq, get_hist_data
+from .storage import MySQLStore, SQLiteStore
+from .brokers import IB
+from .ibglobals import IB_DEFAULT_HOST, IB_DEFAULT_PORT
+
+
+_logger = logging.getLogger('ibstract.backfill')
+__all__ = ['BackfillJob', 'BackfillCoordinator', 'PacingBudget',
+           'read_universe']
+
+
+BackfillChunk = namedtuple('BackfillChunk', 'key req')
+
+# Calendar period of a chunk by bar size unit.
+CHUNK_FREQS = {'s': 'W-MON', 'm': 'MS', 'h': 'MS', 'd': 'AS', 'W': 'AS',
+               'M': 'AS'}
+
+
+def read_universe(path: str) -> list:
+    """
+    Read a universe file to a list of (Symbol, SecType, Exchange, Currency).
+    """
+    defaults = ('', 'Stock', 'SMART', 'USD')
+    universe = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [s.strip() for s in line.split(',')]
+            universe.append(tuple(fields) + defaults[len(fields):])
+    return universe
+
+
+class _CountingBroker:
+    """Broker proxy counting historical data requests and bars.
+    """
+    def __init__(self, broker: object):
+        self._broker = broker
+        self.n_requests = 0
+        self.n_bars = 0
+
+    def __getattr__(self, name):
+        return getattr(self._broker, name)
+
+    async def req_hist_data_async(self, *req_list):
+        blk_list = await self._broker.req_hist_data_async(*req_list)
+        self.n_requests += len(req_list)
+        self.n_bars += sum(len(blk) for blk in blk_list)
+        return blk_list
+
+
+class PacingBudget:
+    """
+    Budget of max_requests historical data requests in any period seconds,
+    shared by the processes started after it is created with the same
+    multiprocessing start method, context.
+
+    The grant times of the last max_requests requests are kept in a ring in
+    shared memory, and a request is granted once the oldest of them is
+    period seconds old.
+    """
+    def __init__(self, max_requests: int=60, period: float=600.,
+                 context: str=None):
+        ctx = multiprocessing.get_context(context)
+        self.context = ctx.get_start_method()
+        self.max_requests = max_requests
+        self.period = period
+        self._times = ctx.RawArray('d', max_requests)
+        self._next = ctx.RawValue('i', 0)
+        self._lock = ctx.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Take a request from the budget if available.
+        :returns: 0 if taken, or seconds until one is available.
+        """
+        with self._lock:
+            now = time.time()
+            i = self._next.value
+            wait = self._times[i] + self.period - now
+            if wait > 0:
+                return wait
+            self._times[i] = now
+            self._next.value = (i + 1) % self.max_requests
+            return 0.
+
+    async def acquire_async(self, n: int=1):
+        """Wait until n requests are taken from the budget.
+        """
+        for _ in range(n):
+            wait = self.try_acquire()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.try_acquire()
+
+
+class _PacedBroker:
+    """Broker proxy taking historical data requests from a PacingBudget.
+    """
+    def __init__(self, broker: object, pacing: PacingBudget):
+        self._broker = broker
+        self._pacing = pacing
+
+    def __getattr__(self, name):
+        return getattr(self._broker, name)
+
+    async def req_hist_data_async(self, *req_list):
+        await self._pacing.acquire_async(len(req_list))
+        return await self._broker.req_hist_data_async(*req_list)
+
+
+class BackfillJob:
+    """
+    Backfill of historical data for a universe, resumable from a checkpoint
+    file.
+
+    :param universe: [(Symbol, SecType, Exchange, Currency)], see
+                     read_universe().
+    :param barsizes: Bar sizes to backfill for each symbol.
+    :param start, end: Date range to backfill, end excluded.
+    :param checkpoint: Path of the checkpoint file, appended with one JSON
+                       line per completed chunk.
+    :param tz: Time zone of chunk boundaries.
+    :param concurrency: Max number of chunks run at the same time.
+    :param report_interval: Seconds between progress logs.
+    :param pacing: Optional PacingBudget of the downloads.
+    """
+    def __init__(self, universe: list, barsizes: list, start: datetime,
+                 end: datetime, checkpoint: str, datatype: str='TRADES',
+                 tz: str='US/Eastern', concurrency: int=4,
+                 report_interval: float=10., pacing: PacingBudget=None):
+        self.universe = universe
+        self.barsizes = [timedur_standardize(bs) for bs in barsizes]
+        self.tz = pytz.timezone(tz)
+        self.start = pd.Timestamp(start).tz_localize(None)
+        self.end = pd.Timestamp(end).tz_localize(None)
+        self.checkpoint = checkpoint
+        self.datatype = datatype
+        self.concurrency = concurrency
+        self.report_interval = report_interval
+        self.pacing = pacing
+        self.failed = []
+        self.n_done = 0
+        self.n_chunk_bars = 0
+
+    def plan(self) -> list:
+        """
+        Return all the chunks of the job, in the order of symbols, bar sizes
+        and time.
+        """
+        chunks = []
+        for symbol, sectype, exchange, currency in self.universe:
+            for barsize in self.barsizes:
+                for period_start, period_end in self._periods(barsize):
+                    time_end = self.tz.localize(period_end.to_pydatetime())
+                    n_days = len(trading_days(
+                        time_end, time_start=self.tz.localize(
+                            period_start.to_pydatetime())))
+                    if n_days == 0:
+                        continue
+                    req = HistDataReq(sectype, symbol, barsize,
+                                      '{}d'.format(n_days), time_end,
+                                      self.datatype, exchange, currency)
+                    key = '{}:{}:{}:{}:{}:{:%Y%m%d}'.format(
+                        sectype, symbol, exchange, self.datatype, barsize,
+                        period_end)
+                    chunks.append(BackfillChunk(key, req))
+        return chunks
+
+    def _periods(self, barsize: str) -> list:
+        bounds = pd.date_range(self.start, self.end,
+                               freq=CHUNK_FREQS[barsize[-1]])
+        bounds = sorted(set([self.start, *bounds, self.end]))
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def completed(self) -> set:
+        """Keys of the chunks completed in the checkpoint file.
+        """
+        if not os.path.exists(self.checkpoint):
+            return set()
+        keys = set()
+        with open(self.checkpoint) as f:
+            for line in f:
+                try:
+                    keys.add(json.loads(line)['chunk'])
+                except (ValueError, KeyError):
+                    pass  # line torn by a crash
+        return keys
+
+    def _save_checkpoint(self, chunk: BackfillChunk, n_bars: int,
+                         seconds: float):
+        with open(self.checkpoint, 'a') as f:
+            f.write(json.dumps({'chunk': chunk.key, 'bars': n_bars,
+                                'seconds': round(seconds, 3)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def run(self, broker: object, store: object) -> dict:
+        """
+        Run the chunks not completed yet. Failed chunks are logged and kept
+        in self.failed, to be retried by the next run.
+        :param store: HistDataStore the data is cached in. It is left open.
+        :returns: Job statistics of this run.
+        """
+        chunks = self.plan()
+        done = self.completed()
+        pending = [chunk for chunk in chunks if chunk.key not in done]
+        _logger.info('Backfill planned %d chunks, %d completed, %d to run.',
+                     len(chunks), len(chunks) - len(pending), len(pending))
+        if self.pacing is not None:
+            broker = _PacedBroker(broker, self.pacing)
+        broker = _CountingBroker(broker)
+        queue = asyncio.Queue()
+        for chunk in pending:
+            queue.put_nowait(chunk)
+        self.failed = []
+        self.n_done = 0
+        self.n_chunk_bars = 0
+        t_start = time.monotonic()
+        reporter = asyncio.ensure_future(
+            self._report(broker, len(pending), t_start))
+        workers = [asyncio.ensure_future(self._work(queue, broker, store))
+                   for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+        stats = self._stats(broker, len(pending), t_start)
+        _logger.info('Backfill finished: %s', self._format_stats(stats))
+        return stats
+
+    async def _work(self, queue: asyncio.Queue, broker: object,
+                    store: object):
+        while not queue.empty():
+            chunk = queue.get_nowait()
+            t = time.monotonic()
+            try:
+                blk = await get_hist_data(chunk.req, broker, store=store)
+            except Exception as e:
+                _logger.error('Backfill chunk %s failed: %r', chunk.key, e)
+                self.failed.append((chunk, e))
+                continue
+            self._save_checkpoint(chunk, len(blk), time.monotonic() - t)
+            self.n_done += 1
+            self.n_chunk_bars += len(blk)
+
+    def _stats(self, broker: object, n_pending: int, t_start: float) -> dict:
+        elapsed = time.monotonic() - t_start
+        return {
+            'chunks': n_pending, 'done': self.n_done,
+            'failed': len(self.failed), 'bars': self.n_chunk_bars,
+            'downloaded_bars': broker.n_bars,
+            'requests': broker.n_requests, 'seconds': elapsed,
+            'bars_per_sec': self.n_chunk_bars / elapsed if elapsed else 0.,
+            'requests_per_min':
+                broker.n_requests * 60 / elapsed if elapsed else 0.,
+        }
+
+    @staticmethod
+    def _format_stats(stats: dict) -> str:
+        return ('{done}/{chunks} chunks, {failed} failed, {bars:,d} bars, '
+                '{bars_per_sec:,.0f} bars/s, {requests} requests '
+                '({requests_per_min:.1f}/min), {seconds:.0f} s'.format(
+                    **stats))
+
+    async def _report(self, broker: object, n_pending: int, t_start: float):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            _logger.info('Backfill progress: %s', self._format_stats(
+                self._stats(broker, n_pending, t_start)))
+
+
+class _WorkerJob(BackfillJob):
+    """
+    Chunks of the symbols of a partition of a BackfillJob, run by a worker
+    process and reported to the coordinator instead of the checkpoint file.
+    """
+    def __init__(self, job: BackfillJob, universe: list, worker_id: int,
+                 reports: object):
+        vars(self).update(vars(job))
+        self.universe = universe
+        self.worker_id = worker_id
+        self.reports = reports
+        self.counter = None
+        self._completed = set()
+
+    def completed(self) -> set:
+        return self._completed
+
+    def _save_checkpoint(self, chunk: BackfillChunk, n_bars: int,
+                         seconds: float):
+        self.reports.put(('done', self.worker_id, chunk.key, n_bars, seconds,
+                          self.counter.n_requests, self.counter.n_bars))
+
+    async def _report(self, broker: object, n_pending: int, t_start: float):
+        pass  # logged by the coordinator
+
+
+async def _run_partition(job: _WorkerJob, open_worker):
+    broker, store = await open_worker(job.worker_id)
+    job.counter = _CountingBroker(broker)
+    try:
+        await job.run(job.counter, store)
+    finally:
+        if hasattr(broker, 'disconnect'):
+            broker.disconnect()
+        if store is not None:
+            await store.close()
+
+
+def _run_worker(job: _WorkerJob, n_workers: int, open_worker):
+    """Entry of a worker process of BackfillCoordinator.
+    """
+    # Disjoint IB client ids of workers.
+    IB.clientid_baskets = set(
+        sorted(IB.clientid_baskets)[job.worker_id::n_workers])
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    error = None
+    try:
+        loop.run_until_complete(_run_partition(job, open_worker))
+    except Exception as e:
+        _logger.exception('Backfill worker %d failed.', job.worker_id)
+        error = repr(e)
+    finally:
+        loop.close()
+    counter = job.counter or _CountingBroker(None)
+    job.reports.put(('exit', job.worker_id,
+                     [(chunk.key, repr(e)) for chunk, e in job.failed],
+                     error, counter.n_requests, counter.n_bars))
+
+
+class BackfillCoordinator:
+    """
+    Run of a BackfillJob by worker processes, to scale the standardization
+    and merging of downloaded bars across CPU cores.
+
+    The universe is partitioned by symbol, and each worker runs the chunks
+    of its symbols with its own event loop, IB client id and database
+    connections, and job.concurrency. Workers share the PacingBudget of the
+    job, if any, and report completed chunks to the coordinator, which
+    alone writes the checkpoint file and logs progress.
+
+    :param job: The BackfillJob.
+    :param open_worker: Picklable coroutine function open_worker(worker_id)
+                        returning a connected (broker, store) of a worker.
+                        The broker is disconnected and the store closed
+                        when the worker is done.
+    :param n_workers: Number of worker processes. None: number of CPUs.
+                      At most one per IB client id of IB.clientid_baskets.
+    :param context: multiprocessing start method, e.g. 'spawn'. None: the
+                    default one. It must be the one of job.pacing.
+    """
+    def __init__(self, job: BackfillJob, open_worker, n_workers: int=None,
+                 context: str=None):
+        start_method = multiprocessing.get_context(context).get_start_method()
+        if job.pacing is not None and job.pacing.context != start_method:
+            raise ValueError(
+                'PacingBudget of start method {!r} cannot be shared by {!r} '
+                'workers.'.format(job.pacing.context, start_method))
+        self.job = job
+        self.open_worker = open_worker
+        self.n_workers = n_workers or os.cpu_count() or 1
+        if self.n_workers > len(IB.clientid_baskets):
+            _logger.warning('Backfill capped to %d workers, one per IB '
+                            'client id, instead of %d.',
+                            len(IB.clientid_baskets), self.n_workers)
+            self.n_workers = len(IB.clientid_baskets)
+        self.context = context
+        self.failed = []
+        self.failed_workers = []
+        self.n_done = 0
+        self.n_chunk_bars = 0
+        self._counts = {}  # worker id: (requests, downloaded bars)
+
+    def partition(self) -> list:
+        """Universes of workers, taking symbols round robin.
+        """
+        n_workers = max(min(self.n_workers, len(self.job.universe)), 1)
+        return [self.job.universe[i::n_workers] for i in range(n_workers)]
+
+    def run(self) -> dict:
+        """
+        Run the chunks not completed yet by worker processes, and wait for
+        them. Failed chunks are kept in self.failed as (chunk, error repr),
+        and workers that failed or died in self.failed_workers.
+        :returns: Job statistics of this run, as BackfillJob.run().
+        """
+        chunks = {chunk.key: chunk for chunk in self.job.plan()}
+        done = self.job.completed()
+        n_pending = len(chunks.keys() - done)
+        _logger.info('Backfill planned %d chunks, %d completed, %d to run.',
+                     len(chunks), len(chunks) - n_pending, n_pending)
+        ctx = multiprocessing.get_context(self.context)
+        reports = ctx.Queue()
+        partitions = self.partition()
+        procs = {}
+        for worker_id, universe in enumerate(partitions):
+            job = _WorkerJob(self.job, universe, worker_id, reports)
+            job._completed = done.intersection(
+                chunk.key for chunk in job.plan())
+            procs[worker_id] = ctx.Process(
+                target=_run_worker,
+                args=(job, len(partitions), self.open_worker),
+                name='ibstract-backfill-{}'.format(worker_id), daemon=True)
+        self.failed = []
+        self.failed_workers = []
+        self.n_done = 0
+        self.n_chunk_bars = 0
+        self._counts = {worker_id: (0, 0) for worker_id in procs}
+        t_start = time.monotonic()
+        t_report = t_start + self.job.report_interval
+        for proc in procs.values():
+            proc.start()
+        running = set(procs)
+        while running:
+            try:
+                self._handle_report(reports.get(timeout=1.), chunks, running)
+            except Empty:
+                pass
+            for worker_id in list(running):
+                if not procs[worker_id].is_alive() and reports.empty():
+                    _logger.error('Backfill worker %d died, exit code %s.',
+                                  worker_id, procs[worker_id].exitcode)
+                    self.failed_workers.append(worker_id)
+                    running.discard(worker_id)
+            if time.monotonic() >= t_report:
+                t_report += self.job.report_interval
+                _logger.info('Backfill progress: %s',
+                             BackfillJob._format_stats(
+                                 self._stats(n_pending, t_start)))
+        for proc in procs.values():
+            proc.join()
+        stats = self._stats(n_pending, t_start)
+        _logger.info('Backfill finished by %d workers: %s', len(procs),
+                     BackfillJob._format_stats(stats))
+        return stats
+
+    def _handle_report(self, report: tuple, chunks: dict, running: set):
+        if report[0] == 'done':
+            _, worker_id, key, n_bars, seconds, n_requests, n_dl_bars = report
+            self.job._save_checkpoint(chunks[key], n_bars, seconds)
+            self.n_done += 1
+            self.n_chunk_bars += n_bars
+        else:  # 'exit'
+            _, worker_id, failed, error, n_requests, n_dl_bars = report
+            for key, chunk_error in failed:
+                _logger.error('Backfill chunk %s failed: %s', key,
+                              chunk_error)
+                self.failed.append((chunks[key], chunk_error))
+            if error is not None:
+                self.failed_workers.append(worker_id)
+            running.discard(worker_id)
+        self._counts[worker_id] = (n_requests, n_dl_bars)
+
+    def _stats(self, n_pending: int, t_start: float) -> dict:
+        elapsed = time.monotonic() - t_start
+        n_requests = sum(n for n, _ in self._counts.values())
+        return {
+            'chunks': n_pending, 'done': self.n_done,
+            'failed': len(self.failed), 'bars': self.n_chunk_bars,
+            'downloaded_bars': sum(n for _, n in self._counts.values()),
+            'requests': n_requests, 'seconds': elapsed,
+            'bars_per_sec': self.n_chunk_bars / elapsed if elapsed else 0.,
+            'requests_per_min': n_requests * 60 / elapsed if elapsed else 0.,
+            'workers': len(self._counts),
+            'failed_workers': len(self.failed_workers),
+        }
+
+
+async def _open_broker_store(args, loop: asyncio.AbstractEventLoop) -> tuple:
+    if args.sqlite:
+        store = await SQLiteStore.open(args.sqlite)
+    else:
+        store = await MySQLStore.create({
+            'host': args.host, 'user': args.user, 'password': args.password,
+            'db': args.db, 'loop': loop})
+    broker = IB()
+    await broker.connect_async(args.ib_host, args.ib_port)
+    return broker, store
+
+
+class _OpenWorker:
+    """open_worker of BackfillCoordinator from command line arguments.
+    """
+    def __init__(self, args):
+        self.args = args
+
+    async def __call__(self, worker_id: int) -> tuple:
+        return await _open_broker_store(self.args, asyncio.get_event_loop())
+
+
+async def _run_backfill(job: BackfillJob, args,
+                        loop: asyncio.AbstractEventLoop):
+    broker, store = await _open_broker_store(args, loop)
+    try:
+        return await job.run(broker, store)
+    finally:
+        broker.disconnect()
+        await store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Backfill historical data for a universe of symbols.')
+    parser.add_argument('universe', help='Universe file.')
+    parser.add_argument('--barsize', action='append', required=True)
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end', default=datetime.now().strftime('%Y-%m-%d'),
+                        help='YYYY-MM-DD, excluded. Default: today.')
+    parser.add_argument('--checkpoint', default='backfill.ckpt')
+    parser.add_argument('--datatype', default='TRADES')
+    parser.add_argument('--tz', default='US/Eastern')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--report-interval', type=float, default=10.)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes, 0 for one per CPU.')
+    parser.add_argument('--max-requests', type=int,
+                        help='Pace downloads of all workers to at most '
+                        'max-requests in pacing-period seconds.')
+    parser.add_argument('--pacing-period', type=float, default=600.)
+    parser.add_argument('--sqlite', help='SQLite file instead of MySQL.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db', default='ibstract')
+    parser.add_argument('--ib-host', default=IB_DEFAULT_HOST)
+    parser.add_argument('--ib-port', type=int, default=IB_DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    pacing = None if args.max_requests is None else \
+        PacingBudget(args.max_requests, args.pacing_period)
+    job = BackfillJob(
+        read_universe(args.universe), args.barsize, args.start, args.end,
+        args.checkpoint, datatype=args.datatype, tz=args.tz,
+        concurrency=args.concurrency, report_interval=args.report_interval,
+        pacing=pacing)
+    if args.workers != 1:
+        coordinator = BackfillCoordinator(job, _OpenWorker(args),
+                                          n_workers=args.workers or None)
+        stats = coordinator.run()
+        return 1 if stats['failed'] or stats['failed_workers'] else 0
+    loop = asyncio.get_event_loop()
+    stats = loop.run_until_complete(_run_backfill(job, args, loop))
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -11,7 +11,10 @@ from .utils import timedur_to_IB, barsize_to_IB
 from .utils import timezone_abbrv
 from .ibglobals import IB_HIST_DATA_TYPES
 from .ibglobals import IB_HIST_DATA_STEPS
+from .ibglobals import IB_RETRYABLE_ERRORS
 from .marketdata import MarketDataBlock
+from .marketdata import TRANSIENT_ERRORS
+from .marketdata import run_transform
 
 
 _logger = logging.getLogger('ibstract.broker')
@@ -21,6 +24,14 @@ __all__ = ['IB']
 class Broker(abc.ABC):
     """Common interface for broker objects.
     """
+    # Exceptions worth retrying a request for.
+    transient_errors = TRANSIENT_ERRORS
+
+    def is_transient_error(self, exc: Exception) -> bool:
+        """Whether a request failed by exc is worth retrying.
+        """
+        return isinstance(exc, self.transient_errors)
+
     @abc.abstractmethod
     def connect(self, host, port, timeout):
         raise NotImplementedError
@@ -46,6 +57,22 @@ class Broker(abc.ABC):
         raise NotImplementedError
 
 
+def _bars_to_blk(bars: list, symbol: str, datatype: str, barsize: str,
+                 xchg_tz: pytz.tzinfo) -> MarketDataBlock:
+    """Convert a list of IB BarData to a MarketDataBlock in xchg_tz.
+    """
+    df = ib_insync.util.df(bars)
+    _logger.debug(df.iloc[:3])
+    if barsize[-1] in ('d', 'W', 'M'):  # not intraday
+        dl_tz = xchg_tz  # dates without timezone, init with xchg_tz.
+    else:
+        dl_tz = pytz.UTC
+    blk = MarketDataBlock(df, symbol=symbol, datatype=datatype,
+                          barsize=barsize, tz=dl_tz)
+    blk.tz_convert(xchg_tz)
+    return blk
+
+
 class IB(ib_insync.IB, Broker):
     """
     Coroutine methods support async operations with Interactive Brokers API.
@@ -63,9 +90,14 @@ class IB(ib_insync.IB, Broker):
         'WARRANT': ib_insync.Warrant
     }
     hist_data_steps = IB_HIST_DATA_STEPS
+    hist_data_timeout = 60  # seconds
 
     def __init__(self, host: str=None, port: int=None, timeout: int=2):
         super().__init__()
+        # Raise ib_insync.RequestError for failed requests, instead of
+        # returning empty results.
+        self.RaiseRequestErrors = True
+        self._tick_callbacks = {}
         if host and port and host.strip():
             self.connect(host.strip(), port, timeout)
 
@@ -88,6 +120,17 @@ class IB(ib_insync.IB, Broker):
     def connected(self):
         return self.client.isConnected()
 
+    def is_transient_error(self, exc: Exception) -> bool:
+        """
+        Whether a request failed by exc is worth retrying, by IB error codes
+        of IB_RETRYABLE_ERRORS.
+        """
+        if isinstance(exc, ib_insync.RequestError):
+            if exc.code == 162 and 'returned no data' in exc.message:
+                return False  # no data, not a pacing violation
+            return exc.code in IB_RETRYABLE_ERRORS
+        return super().is_transient_error(exc)
+
     def _hist_data_req_to_contract(self, req: object):
         """Convert marketdata.HistDataReq to IB contract.
         """
@@ -135,24 +178,21 @@ class IB(ib_insync.IB, Broker):
         Concurrently downloads historical market data for multiple requests.
         """
         ibparms_list = (self._hist_data_req_to_args(req) for req in req_list)
+        # Time out here, as reqHistoricalDataAsync() returns no bars on
+        # timeout.
         bars_list = await asyncio.gather(*(
-            self.reqHistoricalDataAsync(*ibparms)
+            asyncio.wait_for(self.reqHistoricalDataAsync(*ibparms, timeout=0),
+                             self.hist_data_timeout)
             for ibparms in ibparms_list))
-        df_list = [ib_insync.util.df(bars) for bars in bars_list]
         xchg_tz_list = await asyncio.gather(*(
             self.hist_data_req_timezone(req) for req in req_list))
-        blk_list = []
-        for req, df, xchg_tz in zip(req_list, df_list, xchg_tz_list):
-            _logger.debug(df.iloc[:3])
-            if req.BarSize[-1] in ('d', 'W', 'M'):  # not intraday
-                dl_tz = xchg_tz  # dates without timezone, init with xchg_tz.
-            else:
-                dl_tz = pytz.UTC
-            blk = MarketDataBlock(df, symbol=req.Symbol, datatype=req.DataType,
-                                  barsize=req.BarSize, tz=dl_tz)
-            blk.tz_convert(xchg_tz)
-            blk_list.append(blk)
-        return blk_list
+        # Convert bars to MarketDataBlocks off the event loop.
+        blk_list = await asyncio.gather(*(
+            run_transform(_bars_to_blk, list(bars), req.Symbol,
+                          req.DataType, req.BarSize, xchg_tz)
+            for req, bars, xchg_tz in zip(
+                req_list, bars_list, xchg_tz_list)))
+        return list(blk_list)
 
     def req_hist_data(self, *req_list: [object]):
         """
@@ -160,6 +200,32 @@ class IB(ib_insync.IB, Broker):
         """
         return self.run(self.req_hist_data_async(*req_list))
 
+    def req_ticks(self, req: object, callback):
+        """
+        Subscribe streaming market data ticks for the contract of a request.
+        callback(symbol, ticks) is called with each list of new TickData.
+        """
+        if not self._tick_callbacks:
+            self.setCallback('pendingTickers', self._on_pending_tickers)
+        contract = self._hist_data_req_to_contract(req)
+        ticker = self.reqMktData(contract, '', False, False)
+        self._tick_callbacks[id(ticker)] = callback
+        return ticker
+
+    def cancel_ticks(self, ticker: object):
+        """Cancel a tick subscription made by req_ticks().
+        """
+        self._tick_callbacks.pop(id(ticker), None)
+        self.cancelMktData(ticker.contract)
+        if not self._tick_callbacks:
+            self.setCallback('pendingTickers', None)
+
+    def _on_pending_tickers(self, tickers: set):
+        for ticker in tickers:
+            callback = self._tick_callbacks.get(id(ticker))
+            if callback is not None and ticker.ticks:
+                callback(ticker.contract.symbol, ticker.ticks)
+
     def disconnect(self):
         if self.client.isConnected():
             super().disconnect()
@@ -0,0 +1,243 @@
+"""
+Chunked archive schema for historical bars.
+
+Each row of table '<SecType>Chunks' holds all the bars of one (Symbol,
+DataType, BarSize, UTC day) as a compressed columnar blob, so a symbol's
+history of second bars takes thousands of rows instead of millions, and a
+whole day is read by a single row fetch.
+
+Chunk format, zlib compressed:
+    uint32 header length, JSON header {'n': n_bars, 'cols': [[name, kind,
+    scale], ...]}, then n int64 TickerTime deltas in epoch seconds, and n
+    8-byte values for each column in header order.
+A column is stored as int64 deltas of round(value * 10**scale), if that is
+lossless for some scale in CHUNK_SCALES, otherwise as raw float64. The
+bytes of each array are shuffled by significance before compression.
+"""
+import logging
+import asyncio
+import json
+import struct
+import zlib
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from .utils import SEC_TYPES
+from .storage import HistDataStore, BAR_COLUMNS
+from .storage import aiosqlite
+from .storage import SQLITE_CONTRACTS_DDL
+from .storage import sqlite_query_contract_tz, sqlite_insert_contract_tz
+
+
+_logger = logging.getLogger('ibstract.chunkdb')
+__all__ = ['ChunkStore', 'encode_chunk', 'decode_chunk']
+
+
+CHUNK_SCALES = (0, 2, 4, 6)
+SECONDS_PER_DAY = 86400
+
+
+def chunks_table_name(sectype: str) -> str:
+    return sectype + 'Chunks'
+
+
+def _shuffle(arr: np.ndarray) -> bytes:
+    return arr.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def _unshuffle(buf: bytes, n: int, dtype) -> np.ndarray:
+    return np.frombuffer(buf, np.uint8).reshape(8, n).T.copy().view(
+        dtype).ravel()
+
+
+def _encode_column(values: np.ndarray):
+    """Return (scale, bytes) of a column. scale -1: raw float64.
+    """
+    values = values.astype(np.float64)
+    if np.isfinite(values).all():
+        for scale in CHUNK_SCALES:
+            ints = np.round(values * 10**scale)
+            if np.abs(ints).max() < 2**53 and \
+               (ints / 10**scale == values).all():
+                ints = ints.astype(np.int64)
+                return scale, _shuffle(np.diff(ints, prepend=np.int64(0)))
+    return -1, _shuffle(values)
+
+
+def _decode_column(buf: bytes, n: int, kind: str, scale: int) -> np.ndarray:
+    if scale < 0:
+        return _unshuffle(buf, n, np.float64)
+    ints = np.cumsum(_unshuffle(buf, n, np.int64))
+    if scale == 0 and kind in 'iu':
+        return ints
+    return ints / 10**scale
+
+
+def encode_chunk(epochs: np.ndarray, df: pd.DataFrame,
+                 level: int=6) -> bytes:
+    """
+    Encode bars to a chunk.
+    :param epochs: Sorted int64 TickerTime in UTC epoch seconds.
+    :param df: Bar columns of the same length as epochs.
+    """
+    cols, bufs = [], [_shuffle(np.diff(epochs.astype(np.int64),
+                                       prepend=np.int64(0)))]
+    for col in df.columns:
+        values = df[col].values
+        scale, buf = _encode_column(values)
+        cols.append([col, values.dtype.kind, scale])
+        bufs.append(buf)
+    header = json.dumps({'n': len(epochs), 'cols': cols}).encode()
+    return zlib.compress(
+        struct.pack('<I', len(header)) + header + b''.join(bufs), level)
+
+
+def decode_chunk(chunk: bytes):
+    """Decode a chunk to (epochs, DataFrame of bar columns).
+    """
+    payload = zlib.decompress(chunk)
+    header_len = struct.unpack_from('<I', payload)[0]
+    header = json.loads(payload[4:4 + header_len].decode())
+    n = header['n']
+    pos = 4 + header_len
+    epochs = np.cumsum(_unshuffle(payload[pos:pos + n * 8], n, np.int64))
+    pos += n * 8
+    data = {}
+    for col, kind, scale in header['cols']:
+        data[col] = _decode_column(payload[pos:pos + n * 8], n, kind, scale)
+        pos += n * 8
+    return epochs, pd.DataFrame(data)
+
+
+class ChunkStore(HistDataStore):
+    """
+    Embedded SQLite storage of bars in per-day compressed chunks. Inserting
+    bars of a stored day merges them into its chunk, ignoring existing
+    bars, under a lock so concurrent inserts into a chunk are not lost.
+    Requires aiosqlite.
+
+    Usage:
+        store = await ChunkStore.open('ibstract_chunks.db')
+        blk = await get_hist_data(req, broker, store=store)
+        await store.close()
+    """
+    transient_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path: str, level: int=6):
+        if aiosqlite is None:
+            raise ImportError('ChunkStore requires aiosqlite.')
+        self.path = path
+        self.level = level
+        self.conn = None
+        self._insert_lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, path: str, level: int=6):
+        """Open or create a database file, and create tables if not exist.
+        :param level: zlib compression level of chunks.
+        """
+        store = cls(path, level)
+        store.conn = await aiosqlite.connect(path)
+        await store.conn.execute('PRAGMA journal_mode=WAL')
+        await store.conn.execute('PRAGMA synchronous=NORMAL')
+        for sectype in SEC_TYPES:
+            await store.conn.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" ('
+                'Symbol TEXT NOT NULL, DataType TEXT NOT NULL, '
+                'BarSize TEXT NOT NULL, Day INTEGER NOT NULL, '
+                'NBars INTEGER NOT NULL, Data BLOB NOT NULL, '
+                'PRIMARY KEY (Symbol, DataType, BarSize, Day)'
+                ')'.format(chunks_table_name(sectype)))
+        await store.conn.execute(SQLITE_CONTRACTS_DDL)
+        await store.conn.commit()
+        return store
+
+    async def query_contract_tz(self, sectype, symbol, exchange, currency):
+        return await sqlite_query_contract_tz(
+            self.conn, sectype, symbol, exchange, currency)
+
+    async def insert_contract_tz(self, sectype, symbol, exchange, currency,
+                                 tz):
+        await sqlite_insert_contract_tz(
+            self.conn, sectype, symbol, exchange, currency, tz)
+
+    async def _fetch_chunks(self, sectype, symbol, datatype, barsize,
+                            day_start, day_end) -> list:
+        sql = ('SELECT Day, Data FROM "{}" WHERE Symbol=? AND DataType=? '
+               'AND BarSize=? AND Day BETWEEN ? AND ? ORDER BY Day').format(
+                   chunks_table_name(sectype))
+        async with self.conn.execute(sql, (
+                symbol, datatype, barsize, day_start, day_end)) as cur:
+            return await cur.fetchall()
+
+    async def query(self, sectype, symbol, datatype, barsize, start, end):
+        # Clamp to datetime range of pandas.Timestamp.
+        start_epoch = max(int(start.timestamp()), -2**33)
+        end_epoch = min(int(end.timestamp()), 2**33)
+        rows = await self._fetch_chunks(
+            sectype, symbol, datatype, barsize,
+            start_epoch // SECONDS_PER_DAY, end_epoch // SECONDS_PER_DAY)
+        frames = []
+        for _, chunk in rows:
+            epochs, df = decode_chunk(chunk)
+            df.insert(0, 'TickerTime', epochs)
+            frames.append(df)
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+            df = df.loc[df['TickerTime'].between(start_epoch, end_epoch)]
+            df = df.reindex(columns=['TickerTime'] + BAR_COLUMNS)
+            df.reset_index(drop=True, inplace=True)
+        else:
+            df = pd.DataFrame(columns=['TickerTime'] + BAR_COLUMNS)
+        df['TickerTime'] = pd.to_datetime(
+            df['TickerTime'].astype(np.int64), unit='s', utc=True)
+        df.insert(0, 'BarSize', barsize)
+        df.insert(0, 'DataType', datatype)
+        df.insert(0, 'Symbol', symbol)
+        return df
+
+    async def insert(self, sectype, df):
+        if df.empty:
+            return
+        # Read, merge and write chunks of a day by one insert at a time.
+        async with self._insert_lock:
+            await self._insert(sectype, df)
+
+    async def _insert(self, sectype, df):
+        cols = [col for col in BAR_COLUMNS if col in df.columns]
+        bars = df[cols].copy()
+        bars.insert(0, 'TickerTime',
+                    pd.DatetimeIndex(df['TickerTime']).asi8 // 10**9)
+        days = bars['TickerTime'] // SECONDS_PER_DAY
+        records = []
+        for (symbol, datatype, barsize), grp in bars.groupby(
+                [df['Symbol'], df['DataType'], df['BarSize']]):
+            grp_days = days.loc[grp.index]
+            stored = dict(await self._fetch_chunks(
+                sectype, symbol, datatype, barsize,
+                int(grp_days.min()), int(grp_days.max())))
+            for day, day_bars in grp.groupby(grp_days):
+                if day in stored:
+                    # Existing bars take precedence, as INSERT IGNORE.
+                    epochs, stored_bars = decode_chunk(stored[day])
+                    stored_bars.insert(0, 'TickerTime', epochs)
+                    day_bars = pd.concat([stored_bars, day_bars],
+                                         ignore_index=True)
+                day_bars = day_bars.drop_duplicates('TickerTime')
+                day_bars = day_bars.sort_values('TickerTime')
+                chunk = encode_chunk(
+                    day_bars['TickerTime'].values,
+                    day_bars.drop(columns='TickerTime'), self.level)
+                records.append((symbol, datatype, barsize, int(day),
+                                len(day_bars), chunk))
+        sql = ('INSERT OR REPLACE INTO "{}" (Symbol, DataType, BarSize, '
+               'Day, NBars, Data) VALUES (?, ?, ?, ?, ?, ?)').format(
+                   chunks_table_name(sectype))
+        await self.conn.executemany(sql, records)
+        await self.conn.commit()
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
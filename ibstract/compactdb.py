@@ -0,0 +1,317 @@
+"""
+Compact normalized MySQL schema for historical bars.
+
+Symbol, DataType and BarSize are dictionary-encoded to small integer ids in
+lookup tables, and TickerTime is stored as UTC epoch seconds. Each sectype
+has a bar table '<SecType>Bars' with a 10-byte primary key
+(SymbolId, DataTypeId, BarSizeId, EpochTime), partitioned by year on
+EpochTime.
+
+Convert existing tables with:
+    python -m ibstract.compactdb --host 127.0.0.1 --user root \
+        --password ibstract --db ibstract
+"""
+import logging
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy import Table, Column, MetaData
+from sqlalchemy import String, Float
+from sqlalchemy.dialects.mysql import INTEGER as mysqlINTEGER
+from sqlalchemy.dialects.mysql import TINYINT as mysqlTINYINT
+from sqlalchemy.dialects.mysql import VARCHAR as mysqlVARCHAR
+from sqlalchemy.sql import select, and_
+
+from .utils import SEC_TYPES, HIST_DATA_TYPES
+from .ibglobals import IB_HIST_DATA_STEPS
+
+
+_logger = logging.getLogger('ibstract.compactdb')
+__all__ = ['init_compact_db', 'migrate_to_compact_db']
+
+
+# Static ids of DataType and BarSize. Never reorder, only append.
+DATATYPE_IDS = {dt: i + 1 for i, dt in enumerate(HIST_DATA_TYPES)}
+BARSIZE_IDS = {bs: i + 1 for i, bs in enumerate(IB_HIST_DATA_STEPS)}
+DATATYPE_NAMES = {i: dt for dt, i in DATATYPE_IDS.items()}
+BARSIZE_NAMES = {i: bs for bs, i in BARSIZE_IDS.items()}
+
+EPOCH_MAX = 2**32 - 1  # INTEGER UNSIGNED
+
+BAR_COLUMNS = ['opening', 'high', 'low', 'closing', 'volume', 'barcount',
+               'average']
+
+
+def bars_table_name(sectype: str) -> str:
+    return sectype + 'Bars'
+
+
+def _gen_sa_label_tables(metadata: MetaData):
+    """Generate SQLAlchemy Table objects of Symbol, DataType, BarSize ids.
+    """
+    symbols = Table(
+        'Symbols', metadata,
+        Column('id', mysqlINTEGER(unsigned=True), primary_key=True,
+               autoincrement=True),
+        Column('Symbol', String(20), nullable=False, unique=True),
+    )
+    datatypes = Table(
+        'DataTypes', metadata,
+        Column('id', mysqlTINYINT(unsigned=True), primary_key=True,
+               autoincrement=False),
+        Column('DataType', String(20), nullable=False, unique=True),
+    )
+    barsizes = Table(
+        'BarSizes', metadata,
+        Column('id', mysqlTINYINT(unsigned=True), primary_key=True,
+               autoincrement=False),
+        Column('BarSize', mysqlVARCHAR(10, binary=True), nullable=False,
+               unique=True),
+    )
+    return symbols, datatypes, barsizes
+
+
+def gen_sa_bars_table(sectype: str, metadata: MetaData=None):
+    """Generate SQLAlchemy Table object of compact bars by sectype.
+    """
+    if metadata is None:
+        metadata = MetaData()
+    table = Table(
+        bars_table_name(sectype), metadata,
+        Column('SymbolId', mysqlINTEGER(unsigned=True), primary_key=True,
+               autoincrement=False),
+        Column('DataTypeId', mysqlTINYINT(unsigned=True), primary_key=True,
+               autoincrement=False),
+        Column('BarSizeId', mysqlTINYINT(unsigned=True), primary_key=True,
+               autoincrement=False),
+        Column('EpochTime', mysqlINTEGER(unsigned=True), primary_key=True,
+               autoincrement=False),
+        Column('opening', Float(10, 2)),
+        Column('high', Float(10, 2)),
+        Column('low', Float(10, 2)),
+        Column('closing', Float(10, 2)),
+        Column('volume', mysqlINTEGER(unsigned=True)),
+        Column('barcount', mysqlINTEGER(unsigned=True)),
+        Column('average', Float(10, 2))
+    )
+    return table
+
+
+# Cached Table objects used by queries and inserts.
+_sa_metadata = MetaData()
+_sa_symbols = _gen_sa_label_tables(_sa_metadata)[0]
+_sa_bars_tables = {}
+
+
+def _bars_table(sectype: str) -> Table:
+    try:
+        return _sa_bars_tables[sectype]
+    except KeyError:
+        table = gen_sa_bars_table(sectype, metadata=_sa_metadata)
+        _sa_bars_tables[sectype] = table
+        return table
+
+
+def _binary_barsize_ddl(table: Table) -> str:
+    """
+    DDL making the BarSize column of a reflected table case-sensitive, as
+    tables created before '1M' month bars were cached compare it
+    case-insensitively with '1m'. None if it is case-sensitive already.
+    """
+    coltype = table.c.BarSize.type
+    if getattr(coltype, 'binary', False) or \
+            (getattr(coltype, 'collation', None) or '').endswith('_bin'):
+        return None
+    return 'ALTER TABLE `{}` MODIFY BarSize VARCHAR(10) BINARY NOT NULL' \
+        .format(table.name)
+
+
+def _partition_ddl(table_name: str, first_year: int, last_year: int) -> str:
+    """DDL partitioning a bars table by year of EpochTime.
+    """
+    epoch = datetime(1970, 1, 1)
+    parts = ['PARTITION p{0} VALUES LESS THAN ({1})'.format(
+        yr, int((datetime(yr + 1, 1, 1) - epoch).total_seconds()))
+        for yr in range(first_year, last_year + 1)]
+    parts.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+    return 'ALTER TABLE `{}` PARTITION BY RANGE (EpochTime) ({})'.format(
+        table_name, ', '.join(parts))
+
+
+def init_compact_db(db_info: dict, first_year: int=2000,
+                    last_year: int=None):
+    """
+    Create lookup tables and partitioned compact bars tables, if not exist.
+    Bars tables get one partition per year from first_year to last_year,
+    plus one for all later times.
+    """
+    if last_year is None:
+        last_year = datetime.now().year + 5
+    db_conn = "mysql+pymysql://{0}:{1}@{2}/{3}".format(
+        db_info['user'], db_info['password'], db_info['host'], db_info['db'])
+    engine = create_engine(db_conn, echo=False)
+    metadata = MetaData(engine, reflect=True)
+    existing = set(metadata.tables.keys())
+    if 'BarSizes' in existing:
+        ddl = _binary_barsize_ddl(metadata.tables['BarSizes'])
+        if ddl is not None:
+            engine.execute(ddl)
+
+    symbols, datatypes, barsizes = _gen_sa_label_tables(metadata)
+    for table in (symbols, datatypes, barsizes):
+        table.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(datatypes.insert().prefix_with('IGNORE'), [
+            {'id': i, 'DataType': dt} for dt, i in DATATYPE_IDS.items()])
+        conn.execute(barsizes.insert().prefix_with('IGNORE'), [
+            {'id': i, 'BarSize': bs} for bs, i in BARSIZE_IDS.items()])
+
+    for sectype in SEC_TYPES:
+        name = bars_table_name(sectype)
+        if name not in existing:
+            table = gen_sa_bars_table(sectype, metadata=metadata)
+            table.create(engine, checkfirst=True)
+            engine.execute(_partition_ddl(name, first_year, last_year))
+    engine.dispose()
+
+
+async def symbol_ids(conn: object, symbols: list, create: bool=False) -> dict:
+    """
+    Look up ids of symbols on an aiomysql.sa connection. Missing symbols are
+    assigned new ids if create is True, and omitted otherwise.
+    """
+    table = _sa_symbols
+    symbols = list(symbols)
+    if create:
+        await conn.execute(table.insert().prefix_with('IGNORE').values(
+            [{'Symbol': sym} for sym in symbols]))
+    result = await conn.execute(
+        select([table.c.id, table.c.Symbol]).where(
+            table.c.Symbol.in_(symbols)))
+    return {row[1]: row[0] for row in await result.fetchall()}
+
+
+async def query_compact(
+        engine: object, sectype: str, symbol: str, datatype: str,
+        barsize: str, start_epoch: int, end_epoch: int) -> pd.DataFrame:
+    """
+    Query compact bars table. Returns a DataFrame with columns Symbol,
+    DataType, BarSize, TickerTime (tz-aware UTC) and bar columns.
+    """
+    table = _bars_table(sectype)
+    columns = ['Symbol', 'DataType', 'BarSize', 'TickerTime'] + BAR_COLUMNS
+    async with engine.acquire() as conn:
+        ids = await symbol_ids(conn, [symbol])
+        if symbol not in ids:
+            return pd.DataFrame(columns=columns)
+        stmt = select(
+            [table.c.EpochTime] + [table.c[col] for col in BAR_COLUMNS]
+        ).where(and_(
+            table.c.SymbolId == ids[symbol],
+            table.c.DataTypeId == DATATYPE_IDS[datatype],
+            table.c.BarSizeId == BARSIZE_IDS[barsize],
+            table.c.EpochTime.between(
+                max(start_epoch, 0), min(end_epoch, EPOCH_MAX))
+        ))
+        result = await conn.execute(stmt)
+        rows = await result.fetchall()
+    df = pd.DataFrame([tuple(r) for r in rows],
+                      columns=['EpochTime'] + BAR_COLUMNS)
+    df.insert(0, 'TickerTime', pd.to_datetime(
+        df.pop('EpochTime').astype(np.int64), unit='s', utc=True))
+    df.insert(0, 'BarSize', barsize)
+    df.insert(0, 'DataType', datatype)
+    df.insert(0, 'Symbol', symbol)
+    return df[columns]
+
+
+async def insert_compact(engine: object, sectype: str, df: pd.DataFrame):
+    """
+    Insert a DataFrame of bars with Symbol, DataType, BarSize, and tz-aware
+    TickerTime columns to the compact bars table.
+    """
+    if df.empty:
+        return
+    table = _bars_table(sectype)
+    times = pd.DatetimeIndex(df['TickerTime']).tz_convert('UTC')
+    rows = pd.DataFrame({
+        'DataTypeId': df['DataType'].map(DATATYPE_IDS).values,
+        'BarSizeId': df['BarSize'].map(BARSIZE_IDS).values,
+        'EpochTime': times.asi8 // 10**9,
+    })
+    for col in BAR_COLUMNS:
+        if col in df.columns:
+            rows[col] = df[col].values
+    async with engine.acquire() as conn:
+        ids = await symbol_ids(conn, df['Symbol'].unique(), create=True)
+        rows.insert(0, 'SymbolId', df['Symbol'].map(ids).values)
+        await conn.execute(table.insert().prefix_with('IGNORE').values(
+            rows.to_dict('records')))
+        await conn.execute('commit')  # github.com/aio-libs/aiomysql/issues/70
+
+
+def migrate_to_compact_db(db_info: dict, sectypes: tuple=SEC_TYPES,
+                          first_year: int=2000, last_year: int=None):
+    """
+    Copy bars from the original per-sectype tables to the compact tables.
+    Rows are converted on the server with INSERT ... SELECT, one symbol per
+    transaction, so a migration can be interrupted and rerun.
+    """
+    init_compact_db(db_info, first_year, last_year)
+    db_conn = "mysql+pymysql://{0}:{1}@{2}/{3}".format(
+        db_info['user'], db_info['password'], db_info['host'], db_info['db'])
+    engine = create_engine(db_conn, echo=False)
+    metadata = MetaData(engine, reflect=True)
+    cols = ', '.join(BAR_COLUMNS)
+    t_cols = ', '.join('t.' + col for col in BAR_COLUMNS)
+    for sectype in sectypes:
+        if sectype not in metadata.tables:
+            continue
+        name = bars_table_name(sectype)
+        with engine.begin() as conn:
+            conn.execute(
+                'INSERT IGNORE INTO Symbols (Symbol) '
+                'SELECT DISTINCT Symbol FROM `{}`'.format(sectype))
+            symbols = [row[0] for row in conn.execute(
+                'SELECT DISTINCT Symbol FROM `{}`'.format(sectype))]
+        for symbol in symbols:
+            with engine.begin() as conn:
+                conn.execute("SET time_zone = '+00:00'")
+                result = conn.execute(
+                    'INSERT IGNORE INTO `{name}` (SymbolId, DataTypeId, '
+                    'BarSizeId, EpochTime, {cols}) '
+                    'SELECT s.id, d.id, b.id, UNIX_TIMESTAMP(t.TickerTime), '
+                    '{t_cols} FROM `{sectype}` t '
+                    'JOIN Symbols s ON s.Symbol = t.Symbol '
+                    'JOIN DataTypes d ON d.DataType = t.DataType '
+                    'JOIN BarSizes b ON b.BarSize = t.BarSize '
+                    'WHERE t.Symbol = %s'.format(
+                        name=name, cols=cols, t_cols=t_cols, sectype=sectype),
+                    (symbol,))
+            _logger.info('Migrated %s %s: %d rows.',
+                         sectype, symbol, result.rowcount)
+    engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Migrate ibstract MySQL bar tables to compact schema.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--sectype', action='append', choices=SEC_TYPES,
+                        help='Sectype to migrate. Default: all.')
+    parser.add_argument('--first-year', type=int, default=2000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    db_info = {'host': args.host, 'user': args.user,
+               'password': args.password, 'db': args.db}
+    migrate_to_compact_db(db_info, tuple(args.sectype or SEC_TYPES),
+                          first_year=args.first_year)
+
+
+if __name__ == '__main__':
+    main()
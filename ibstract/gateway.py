@@ -0,0 +1,542 @@
+"""
+Local market data gateway.
+
+GatewayServer owns the broker connection, the database store and the bar
+caches of a host, and serves historical data requests of many local
+processes over a socket, so they share one IB client id, one pacing state
+and one cache. Identical requests in flight are coalesced into one.
+GatewayClient implements the broker interface and get_hist_data():
+
+    python -m ibstract.gateway --sqlite ibstract.db --shm-cache ibstract \
+        --max-requests 60
+
+    client = GatewayClient()
+    await client.connect_async()
+    blk = await client.get_hist_data(req)
+    blk = await get_hist_data(req, client, store=store)  # as a broker
+
+Wire format: each message is a frame of uint32 frame length, uint32 header
+length, a JSON header, and a payload of raw little-endian arrays listed in
+the header. A MarketDataBlock is sent as its MultiIndex levels and codes
+and its column arrays, so neither side converts rows.
+"""
+import logging
+import argparse
+import asyncio
+import builtins
+import json
+import os
+import struct
+import tempfile
+import pytz
+import numpy as np
+import pandas as pd
+import ib_insync
+
+from .marketdata import MarketDataBlock, HistDataReq
+from .marketdata import HistDataIncomplete, FailedRange
+from .marketdata import get_hist_data, hist_data_req_xchg_tz
+from .marketdata import _is_transient_error
+from .brokers import Broker, IB
+from .ibglobals import IB_DEFAULT_HOST, IB_DEFAULT_PORT
+from .storage import MySQLStore, SQLiteStore
+from .shmcache import SharedBarCache
+from .backfill import PacingBudget, _PacedBroker
+
+
+_logger = logging.getLogger('ibstract.gateway')
+__all__ = ['GatewayServer', 'GatewayClient', 'GatewayError']
+
+
+DEFAULT_GATEWAY_ADDRESS = os.path.join(tempfile.gettempdir(),
+                                       'ibstract-gateway.sock')
+FRAME_HEADER = struct.Struct('<II')
+# get_hist_data() keyword arguments a client may pass.
+HIST_DATA_KWARGS = ('tail_sync', 'min_fill', 'max_retries', 'retry_delay')
+
+
+class GatewayError(Exception):
+    """
+    An error of a gateway request, raised by the server as type.
+    :attr transient: Whether the server broker deems it worth retrying.
+    """
+    def __init__(self, type: str, message: str, transient: bool=False):
+        self.type = type
+        self.transient = transient
+        super().__init__('{}: {}'.format(type, message))
+
+
+def _req_to_wire(req: HistDataReq) -> list:
+    return [req.SecType, req.Symbol, req.BarSize, req.TimeDur,
+            pd.Timestamp(req.TimeEnd).tz_convert('UTC').isoformat(),
+            req.DataType, req.Exchange, req.Currency]
+
+
+def _req_from_wire(fields: list) -> HistDataReq:
+    fields = list(fields)
+    fields[4] = pd.Timestamp(fields[4]).to_pydatetime().astimezone(pytz.UTC)
+    return HistDataReq(*fields)
+
+
+def _from_tree(tree):
+    """Inverse of ib_insync.util.tree(), of ib_insync objects.
+    """
+    if isinstance(tree, list):
+        return [_from_tree(item) for item in tree]
+    if isinstance(tree, dict):
+        if len(tree) == 1:
+            (name, fields), = tree.items()
+            cls = getattr(ib_insync, name, None)
+            if isinstance(cls, type) and isinstance(fields, dict):
+                fields = {k: _from_tree(v) for k, v in fields.items()}
+                if issubclass(cls, ib_insync.Contract):
+                    # Stock etc. take no secType, create() picks the class.
+                    return ib_insync.Contract.create(**fields)
+                return cls(**fields)
+        return {k: _from_tree(v) for k, v in tree.items()}
+    return tree
+
+
+def _blocks_to_wire(blocks: list) -> tuple:
+    """Return ([block header], [array]) of MarketDataBlocks.
+    """
+    headers, arrays = [], []
+
+    def add(values: np.ndarray) -> list:
+        values = np.ascontiguousarray(values)
+        if values.dtype.byteorder == '>':
+            values = values.astype(values.dtype.newbyteorder('<'))
+        arrays.append(values)
+        return [values.dtype.str, values.nbytes]
+
+    for blk in blocks:
+        if blk.df.empty:
+            headers.append({'n': 0})
+            continue
+        index = blk.df.index
+        dtlevel = MarketDataBlock.dtlevel
+        headers.append({
+            'n': len(blk.df), 'tz': str(blk.tz),
+            'labels': [list(index.levels[level])
+                       for level in range(dtlevel)],
+            'times': add(index.levels[dtlevel].asi8),
+            'codes': [add(codes) for codes in index.codes],
+            'cols': [[col] + add(blk.df[col].values)
+                     for col in blk.df.columns]})
+    return headers, arrays
+
+
+def _blocks_from_wire(headers: list, payload: bytearray) -> list:
+    pos = 0
+
+    def take(spec: list) -> np.ndarray:
+        nonlocal pos
+        dtype, nbytes = spec
+        values = np.frombuffer(payload, np.dtype(dtype), offset=pos,
+                               count=nbytes // np.dtype(dtype).itemsize)
+        pos += nbytes
+        return values
+
+    blocks = []
+    for header in headers:
+        blk = MarketDataBlock(None)
+        blocks.append(blk)
+        if header['n'] == 0:
+            continue
+        times = pd.DatetimeIndex(pd.arrays.DatetimeArray(
+            take(header['times']).view('M8[ns]'),
+            dtype=pd.DatetimeTZDtype(tz=pytz.timezone(header['tz']))))
+        codes = [take(spec) for spec in header['codes']]
+        index = pd.MultiIndex(levels=header['labels'] + [times], codes=codes,
+                              names=MarketDataBlock.data_index,
+                              verify_integrity=False)
+        blk.df = pd.DataFrame({col: take(spec)
+                               for col, *spec in header['cols']},
+                              index=index, copy=False)
+    return blocks
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple:
+    """Return (header, payload) of a frame, or None at EOF.
+    """
+    try:
+        prefix = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    frame_len, header_len = FRAME_HEADER.unpack(prefix)
+    body = bytearray(await reader.readexactly(frame_len))
+    header = json.loads(body[:header_len].decode())
+    return header, memoryview(body)[header_len:]
+
+
+def _write_frame(writer: asyncio.StreamWriter, header: dict,
+                 blocks: list=()):
+    block_headers, arrays = _blocks_to_wire(blocks)
+    if block_headers:
+        header['blocks'] = block_headers
+    header_bytes = json.dumps(header).encode()
+    writer.write(FRAME_HEADER.pack(
+        len(header_bytes) + sum(arr.nbytes for arr in arrays),
+        len(header_bytes)) + header_bytes)
+    for arr in arrays:
+        if arr.nbytes:
+            writer.write(memoryview(arr).cast('B'))
+
+
+def _error_to_wire(exc: Exception, is_transient) -> dict:
+    error = {'type': type(exc).__name__, 'message': str(exc),
+             'transient': bool(is_transient(exc))}
+    if isinstance(exc, HistDataIncomplete):
+        error['failed'] = [
+            [pd.Timestamp(f.start).isoformat(),
+             pd.Timestamp(f.end).isoformat(), _req_to_wire(f.req),
+             _error_to_wire(f.error, is_transient)]
+            for f in exc.failed]
+    return error
+
+
+def _error_from_wire(error: dict, blk: MarketDataBlock=None) -> Exception:
+    if error['type'] == 'HistDataIncomplete':
+        return HistDataIncomplete(blk, [
+            FailedRange(pd.Timestamp(start), pd.Timestamp(end),
+                        _req_from_wire(req), _error_from_wire(err))
+            for start, end, req, err in error['failed']])
+    if error['type'] == 'TimeoutError':
+        return asyncio.TimeoutError(error['message'])
+    exc_type = getattr(builtins, error['type'], None)
+    if isinstance(exc_type, type) and issubclass(exc_type, Exception):
+        return exc_type(error['message'])
+    return GatewayError(error['type'], error['message'], error['transient'])
+
+
+class GatewayServer:
+    """
+    Gateway serving historical data requests of local clients.
+
+    :param broker: Connected broker, e.g. IB. None to serve only stored
+                   data.
+    :param store: HistDataStore of get_hist_data(). None to download all.
+    :param cache: Optional SharedBarCache the served bars are kept in.
+    :param address: Unix socket path, or (host, port) to listen on TCP.
+    :param pacing: Optional PacingBudget all the downloads of the served
+                   clients take requests from.
+    """
+    def __init__(self, broker: object, store: object=None,
+                 cache: SharedBarCache=None,
+                 address=DEFAULT_GATEWAY_ADDRESS,
+                 pacing: PacingBudget=None):
+        if broker is not None and pacing is not None:
+            broker = _PacedBroker(broker, pacing)
+        self.broker = broker
+        self.store = store
+        self.cache = cache
+        self.address = address
+        self.pacing = pacing
+        self.n_requests = 0
+        self._server = None
+        self._closed = None
+        self._inflight = {}  # request key: future
+        self._clients = {}  # client writer: future done with its handler
+
+    async def start(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._server = await asyncio.start_unix_server(
+                self._serve_client, self.address)
+        else:
+            self._server = await asyncio.start_server(
+                self._serve_client, *self.address)
+        _logger.info('Gateway listening on %s', self.address)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in self._clients:
+                writer.close()
+            if self._clients:
+                await asyncio.wait(list(self._clients.values()))
+            await self._server.wait_closed()
+            self._server = None
+            if self._closed is not None and not self._closed.done():
+                self._closed.set_result(None)
+            if isinstance(self.address, str) and \
+               os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def is_transient_error(self, exc: Exception) -> bool:
+        """Whether a failed request is worth retrying by the client.
+        """
+        return _is_transient_error(self.broker, self.store, exc)
+
+    async def serve_forever(self):
+        """Serve until close().
+        """
+        self._closed = asyncio.get_event_loop().create_future()
+        await self.start()
+        await self._closed
+
+    async def _serve_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter):
+        tasks = set()
+        self._clients[writer] = asyncio.get_event_loop().create_future()
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                if frame is None:
+                    break
+                task = asyncio.ensure_future(self._respond(frame[0], writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            self._clients.pop(writer).set_result(None)
+
+    async def _respond(self, header: dict, writer: asyncio.StreamWriter):
+        self.n_requests += 1
+        response, blocks = {'id': header['id']}, []
+        try:
+            key = json.dumps([header['method'], header.get('reqs'),
+                              header.get('kwargs')])
+            fut = self._inflight.get(key)
+            if fut is None:
+                fut = asyncio.ensure_future(self._call(header))
+                self._inflight[key] = fut
+                fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+            result, blocks = await asyncio.shield(fut)
+            response['result'] = result
+        except Exception as e:
+            _logger.warning('Gateway request %s failed: %r',
+                            header.get('method'), e)
+            response['error'] = _error_to_wire(e, self.is_transient_error)
+            if isinstance(e, HistDataIncomplete):
+                blocks = [e.blk]
+        try:
+            _write_frame(writer, response, blocks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _call(self, header: dict) -> tuple:
+        """Run a request, and return (JSON result, [MarketDataBlock]).
+        """
+        method = header['method']
+        reqs = [_req_from_wire(fields) for fields in header['reqs']]
+        if method == 'get_hist_data':
+            kwargs = {k: v for k, v in header.get('kwargs', {}).items()
+                      if k in HIST_DATA_KWARGS}
+            if self.cache is not None:
+                blk = await self.cache.get_hist_data(
+                    reqs[0], self.broker, store=self.store, **kwargs)
+            else:
+                blk = await get_hist_data(reqs[0], self.broker,
+                                          store=self.store, **kwargs)
+            return None, [blk]
+        elif method == 'hist_data_req_timezone':
+            if self.store is not None:
+                xchg_tz = await hist_data_req_xchg_tz(
+                    reqs[0], self.broker, self.store)
+            elif self.broker is None:
+                raise ConnectionError('Gateway has no broker.')
+            else:
+                xchg_tz = await self.broker.hist_data_req_timezone(reqs[0])
+            return xchg_tz.zone, []
+        elif method == 'hist_data_req_contract_details':
+            if self.broker is None:
+                raise ConnectionError('Gateway has no broker.')
+            details_list = await self.broker.hist_data_req_contract_details(
+                reqs[0])
+            return [ib_insync.util.tree(details)
+                    for details in details_list], []
+        elif method == 'req_hist_data':
+            if self.broker is None:
+                raise ConnectionError('Gateway has no broker.')
+            return None, await self.broker.req_hist_data_async(*reqs)
+        raise ValueError('Unknown gateway method: {}'.format(method))
+
+
+class GatewayClient(Broker):
+    """
+    Client of a GatewayServer, usable as a broker object.
+
+    :param address: Unix socket path, or (host, port) of the server.
+    """
+    def __init__(self, address=DEFAULT_GATEWAY_ADDRESS):
+        self.address = address
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connecting = None
+        self._pending = {}  # request id: future
+        self._next_id = 0
+
+    async def connect_async(self):
+        if self.connected:
+            return
+        # Concurrent first requests share one connection.
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._open())
+        try:
+            await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+
+    async def _open(self):
+        if isinstance(self.address, str):
+            reader, writer = await asyncio.open_unix_connection(self.address)
+        else:
+            reader, writer = await asyncio.open_connection(*self.address)
+        self._reader, self._writer = reader, writer
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    def connect(self, *args):
+        asyncio.get_event_loop().run_until_complete(self.connect_async())
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    def disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending(ConnectionError('Gateway client disconnected.'))
+
+    def _fail_pending(self, exc: Exception):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self._pending.clear()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                frame = await _read_frame(self._reader)
+                if frame is None:
+                    break
+                header, payload = frame
+                fut = self._pending.pop(header['id'], None)
+                if fut is not None and not fut.done():
+                    fut.set_result((header, _blocks_from_wire(
+                        header.get('blocks', []), payload)))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        self._writer = None
+        self._fail_pending(ConnectionError('Gateway connection lost.'))
+
+    async def _call(self, method: str, reqs: list, **kwargs) -> tuple:
+        if not self.connected:
+            await self.connect_async()
+        self._next_id += 1
+        header = {'id': self._next_id, 'method': method,
+                  'reqs': [_req_to_wire(req) for req in reqs]}
+        if kwargs:
+            header['kwargs'] = kwargs
+        fut = asyncio.get_event_loop().create_future()
+        self._pending[self._next_id] = fut
+        _write_frame(self._writer, header)
+        await self._writer.drain()
+        header, blocks = await fut
+        if 'error' in header:
+            raise _error_from_wire(header['error'],
+                                   blocks[0] if blocks else None)
+        return header.get('result'), blocks
+
+    def is_transient_error(self, exc: Exception) -> bool:
+        if isinstance(exc, GatewayError):
+            return exc.transient
+        return super().is_transient_error(exc)
+
+    async def get_hist_data(self, req: HistDataReq, tail_sync: bool=False,
+                            min_fill: float=None, max_retries: int=3,
+                            retry_delay: float=1.) -> MarketDataBlock:
+        """get_hist_data() served by the gateway, with its store and cache.
+        """
+        _, blocks = await self._call(
+            'get_hist_data', [req], tail_sync=tail_sync, min_fill=min_fill,
+            max_retries=max_retries, retry_delay=retry_delay)
+        return blocks[0]
+
+    async def hist_data_req_contract_details(self, req: HistDataReq):
+        trees, _ = await self._call('hist_data_req_contract_details', [req])
+        return [_from_tree(tree) for tree in trees]
+
+    async def hist_data_req_timezone(self, req: HistDataReq):
+        zone, _ = await self._call('hist_data_req_timezone', [req])
+        return pytz.timezone(zone)
+
+    async def req_hist_data_async(self, *req_list: [HistDataReq]):
+        _, blocks = await self._call('req_hist_data', list(req_list))
+        return blocks
+
+    def req_hist_data(self, *req_list: [HistDataReq]):
+        return asyncio.get_event_loop().run_until_complete(
+            self.req_hist_data_async(*req_list))
+
+
+async def _run_gateway(args, loop: asyncio.AbstractEventLoop):
+    if args.sqlite:
+        store = await SQLiteStore.open(args.sqlite)
+    elif args.db:
+        store = await MySQLStore.create({
+            'host': args.host, 'user': args.user, 'password': args.password,
+            'db': args.db, 'loop': loop})
+    else:
+        store = None
+    broker = IB()
+    await broker.connect_async(args.ib_host, args.ib_port)
+    cache = SharedBarCache(args.shm_cache) if args.shm_cache else None
+    address = args.socket if args.port is None else (args.bind, args.port)
+    pacing = None if args.max_requests is None else PacingBudget(
+        args.max_requests, args.pacing_period)
+    server = GatewayServer(broker, store=store, cache=cache, address=address,
+                           pacing=pacing)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        broker.disconnect()
+        if store is not None:
+            await store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve historical data to local ibstract clients.')
+    parser.add_argument('--socket', default=DEFAULT_GATEWAY_ADDRESS,
+                        help='Unix socket path.')
+    parser.add_argument('--port', type=int,
+                        help='Listen on TCP port instead of a Unix socket.')
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--shm-cache', help='SharedBarCache name.')
+    parser.add_argument('--sqlite', help='SQLite file instead of MySQL.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db', help='MySQL database.')
+    parser.add_argument('--ib-host', default=IB_DEFAULT_HOST)
+    parser.add_argument('--ib-port', type=int, default=IB_DEFAULT_PORT)
+    parser.add_argument('--max-requests', type=int,
+                        help='Historical data requests allowed to IB in any '
+                             '--pacing-period seconds.')
+    parser.add_argument('--pacing-period', type=float, default=600.)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(_run_gateway(args, loop))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -9,8 +9,8 @@ from datetime import timedelta
 
 
 __all__ = ['IB_DEFAULT_HOST', 'IB_DEFAULT_PORT', 'IB_HIST_DATA_TYPES',
-           'IB_ERRORS', 'IB_REQ_TICK_TYPES', 'IB_TICK_TYPES',
-           'IBInvalidReqTickTypeName']
+           'IB_ERRORS', 'IB_RETRYABLE_ERRORS', 'IB_REQ_TICK_TYPES',
+           'IB_TICK_TYPES', 'IBInvalidReqTickTypeName']
 
 
 # --- Global settings for IB API ---
@@ -62,6 +62,14 @@ IB_HIST_DATA_STEPS = {  # BarSize: MaxAllowedDuration
 IB_ERRORS = [201, 103, 502, 504, 509, 200, 162, 420, 2105,
              1100, 478, 201, 399]
 
+# IB errors of historical data requests worth retrying
+#   162: pacing violation, or HMDS query failure
+#   420: invalid real-time query, e.g. pacing
+#   502, 504, 1100, 2105: connectivity to TWS or data farm lost
+#   509: exception while processing the request
+# Others (e.g. 200: no security definition) fail the same when retried.
+IB_RETRYABLE_ERRORS = (162, 420, 502, 504, 509, 1100, 2105)
+
 
 # Generic tick type names and IDs to request market data
 # Note: names are defined here from the descriptions in IB API reference.
@@ -5,31 +5,110 @@ Market data management.
 - Streaming market data in real time.
 """
 import logging
+import random
+import sys
+import weakref
+from collections import namedtuple
+from functools import lru_cache
 from datetime import datetime, timezone
 import pytz
 from tzlocal import get_localzone
 import numpy as np
 import pandas as pd
 import asyncio
-from aiomysql.sa import create_engine as aio_create_engine
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from sqlalchemy import create_engine
-from sqlalchemy import Table, Column, MetaData
-from sqlalchemy import String, Float, DateTime
-from sqlalchemy.dialects.mysql import INTEGER as mysqlINTEGER
-from sqlalchemy.sql import and_
+from sqlalchemy import MetaData
 
 from .utils import SEC_TYPES, HIST_DATA_TYPES
 from .utils import MarketDataBlock_col_rename as col_rename
 from .utils import tzcomb, tzmax, tzmin
 from .utils import timedur_standardize
 from .utils import timedur_to_reldelta
+from .utils import timedur_to_timedelta
 from .utils import trading_days
+from .utils import expected_bar_times
+from .ibglobals import IB_HIST_DATA_STEPS
+from .compactdb import init_compact_db, _binary_barsize_ddl
+from .storage import HistDataStore, MySQLStore
+from .storage import as_hist_data_store, _gen_sa_table
+from .storage import _gen_sa_contracts_table
+from .storage import BAR_COLUMNS
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
 
 
 _logger = logging.getLogger('ibstract.marketdata')
 __all__ = ['MarketDataBlock', 'HistDataReq', 'init_db', 'query_hist_data',
            'insert_hist_data', 'hist_data_req_start_end', 'get_hist_data',
-           'download_insert_hist_data', 'query_hist_data_split_req']
+           'download_insert_hist_data', 'query_hist_data_split_req',
+           'HistDataWriter', 'iter_hist_data', 'set_transform_executor',
+           'FailedRange', 'HistDataIncomplete', 'hist_data_req_xchg_tz']
+
+
+# Exceptions of any broker worth retrying a request for.
+TRANSIENT_ERRORS = (asyncio.TimeoutError, ConnectionError)
+
+
+# Stable Arrow schema of MarketDataBlock.to_arrow().
+if pa is not None:
+    ARROW_SCHEMA = pa.schema(
+        [pa.field(name, pa.dictionary(pa.int32(), pa.string()),
+                  nullable=False)
+         for name in ('Symbol', 'DataType', 'BarSize')] +
+        [pa.field('TickerTime', pa.timestamp('ns', tz='UTC'),
+                  nullable=False)] +
+        [pa.field(col, pa.int64() if col in ('volume', 'barcount')
+                  else pa.float64()) for col in BAR_COLUMNS])
+else:
+    ARROW_SCHEMA = None
+
+
+# Executor of CPU-bound pandas transforms: None for the default executor of
+# the event loop, or 'inline' to run on the event loop.
+_transform_executor = None
+_own_transform_executor = False
+
+
+def set_transform_executor(executor='thread', max_workers: int=None):
+    """
+    Set where CPU-bound pandas transforms of data blocks run, like
+    standardizing downloaded bars, merging, sorting and tz conversion, so
+    that they do not block socket reads on the event loop.
+    :param executor: 'thread': A thread pool. DataFrames are shared with
+                               the pool without copying.
+                     'process': A process pool, for merges of large blocks
+                                that would hold the GIL. DataFrames are
+                                pickled to and from workers.
+                     'inline': Run on the event loop.
+                     A concurrent.futures.Executor object.
+                     None: The default executor of the event loop.
+    """
+    global _transform_executor, _own_transform_executor
+    if _own_transform_executor:
+        _transform_executor.shutdown(wait=False)
+    _own_transform_executor = executor in ('thread', 'process')
+    if executor == 'thread':
+        executor = ThreadPoolExecutor(max_workers)
+    elif executor == 'process':
+        executor = ProcessPoolExecutor(max_workers)
+    elif not (executor is None or executor == 'inline' or
+              isinstance(executor, Executor)):
+        raise ValueError('Invalid transform executor: {}'.format(executor))
+    _transform_executor = executor
+
+
+async def run_transform(func, *args):
+    """Run func(*args) by the transform executor, and return the result.
+    func and args must be picklable for a process pool.
+    """
+    if _transform_executor == 'inline':
+        return func(*args)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_transform_executor, func, *args)
 
 
 class MarketDataBlock:
@@ -47,14 +126,21 @@ class MarketDataBlock:
         - 'Symbol': string
         - 'BarSize': pandas Timedelta
         - 'TickerTime': pandas DatetimeIndex
+
+    With compact=True, data columns are kept in compact dtypes after each
+    update, see compact_dtypes().
     """
 
     data_index = ['Symbol', 'DataType', 'BarSize', 'TickerTime']
     dtlevel = data_index.index('TickerTime')
+    price_columns = ['opening', 'high', 'low', 'closing', 'average']
+    count_columns = ['volume', 'barcount']
 
     def __init__(self, df: pd.DataFrame, symbol: str=None, datatype: str=None,
-                 barsize: str=None, tz: str=None):
+                 barsize: str=None, tz: str=None, compact: bool=False):
         self.df = pd.DataFrame()
+        self.compact = compact
+        self._segments_cache = None
         if df is not None:
             self.update(
                 df, symbol=symbol, datatype=datatype, barsize=barsize, tz=tz)
@@ -171,14 +257,146 @@ class MarketDataBlock:
             self.df = df_in.sort_index()
         else:
             df_in = df_in.tz_convert(self.tzinfo, level=self.__class__.dtlevel)
-            self.df = df_in.combine_first(self.df).sort_index()
+            self.df = _combine_first(df_in, self.df)
 
         # Post-combination processing
         # Fill NaN, and enforce barcount and volume columns dtype to int64
         self.df.fillna(-1, inplace=True)
         for col in self.df.columns:
-            if col.lower() in ('barcount', 'volume'):
+            if col.lower() in self.__class__.count_columns:
                 self.df[col] = self.df[col].astype(np.int64)
+        if self.compact:
+            self.compact_dtypes()
+
+    def compact_dtypes(self, price_decimals: int=2):
+        """
+        Convert self.df to compact dtypes in place:
+        - Price columns to float32, if the float32 values round to the same
+          price_decimals decimals, the precision prices are stored at.
+        - Volume and barcount columns to the narrowest signed int holding
+          their values.
+        - Index levels of labels no longer used are dropped. Symbol,
+          DataType and BarSize are already stored as int8 codes of their
+          unique labels by the MultiIndex.
+        """
+        if self.df.empty:
+            return
+        # A shallow copy, so a sliced view is converted without touching
+        # the block it was sliced from.
+        df = self.df.copy(deep=False)
+        tol = 0.5 * 10**-price_decimals
+        for col in df.columns:
+            values = df[col].values
+            if col in self.__class__.price_columns and \
+               values.dtype == np.float64:
+                values32 = values.astype(np.float32)
+                err = np.abs(values32 - values)
+                if not (err[~np.isnan(err)] >= tol).any():
+                    df[col] = values32
+            elif col in self.__class__.count_columns and \
+                    values.dtype.kind == 'i':
+                lo, hi = values.min(), values.max()
+                for dtype in (np.int8, np.int16, np.int32):
+                    if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+                        if dtype != values.dtype:
+                            df[col] = values.astype(dtype)
+                        break
+        df.index = df.index.remove_unused_levels()
+        self.df = df
+
+    def memory_usage(self) -> pd.Series:
+        """
+        Bytes of self.df by index level and column. The total is its sum().
+        """
+        usage = {}
+        if not self.df.empty:
+            index = self.df.index
+            for name, level, codes in zip(index.names, index.levels,
+                                          index.codes):
+                usage[name] = codes.nbytes + level.memory_usage(deep=True)
+            for col in self.df.columns:
+                usage[col] = self.df[col].memory_usage(index=False, deep=True)
+        return pd.Series(usage, dtype=np.int64)
+
+    def to_arrow(self):
+        """
+        Return self.df as a pyarrow.Table of ARROW_SCHEMA, with the time zone
+        in schema metadata 'tz'. Symbol, DataType and BarSize are dictionary
+        encoded by their MultiIndex codes, and bar columns of the schema
+        dtype are shared without copying. Missing bar columns are -1, and
+        other columns are dropped. Requires pyarrow.
+        """
+        if pa is None:
+            raise ImportError('MarketDataBlock.to_arrow() requires pyarrow.')
+        schema = ARROW_SCHEMA.with_metadata({'tz': str(self.tz or 'UTC')})
+        if self.df.empty:
+            return schema.empty_table()
+        index = self.df.index
+        dtlevel = self.__class__.dtlevel
+        arrays = [pa.DictionaryArray.from_arrays(
+            index.codes[level].astype(np.int32),
+            pa.array(list(index.levels[level]), pa.string()))
+            for level in range(dtlevel)]
+        arrays.append(pa.array(index.get_level_values(dtlevel).asi8,
+                               schema.field('TickerTime').type))
+        for col in BAR_COLUMNS:
+            dtype = schema.field(col).type.to_pandas_dtype()
+            if col in self.df.columns:
+                values = self.df[col].values.astype(dtype, copy=False)
+            else:
+                values = np.full(len(self.df), -1, dtype=dtype)
+            arrays.append(pa.array(values))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    @classmethod
+    def from_arrow(cls, table, tz: str=None):
+        """
+        Return a MarketDataBlock of a pyarrow.Table or RecordBatch with the
+        columns of ARROW_SCHEMA, e.g. from to_arrow(). Dictionary indices
+        become the MultiIndex codes, and bar columns without nulls are
+        shared without copying, read-only if the table is memory mapped.
+        Null bar values are -1.
+        :param tz: Time zone of TickerTime. None: schema metadata 'tz', or
+                   UTC if absent.
+        """
+        if pa is None:
+            raise ImportError('MarketDataBlock.from_arrow() requires pyarrow.')
+        if isinstance(table, pa.RecordBatch):
+            table = pa.Table.from_batches([table])
+        if tz is None:
+            tz = (table.schema.metadata or {}).get(b'tz', b'UTC').decode()
+        blk = cls(None)
+        if table.num_rows == 0:
+            return blk
+        if any(col.num_chunks > 1 for col in table.columns):
+            table = table.unify_dictionaries().combine_chunks()
+        levels, codes = [], []
+        for name in cls.data_index[:cls.dtlevel]:
+            arr = table.column(name).chunk(0)
+            if not pa.types.is_dictionary(arr.type):
+                arr = arr.dictionary_encode()
+            levels.append(arr.dictionary.to_pylist())
+            codes.append(arr.indices.to_numpy())
+        times = table.column('TickerTime').chunk(0).cast(
+            pa.timestamp('ns', tz='UTC')).cast(pa.int64()).to_numpy()
+        time_codes, time_level = pd.factorize(times, sort=True)
+        levels.append(pd.DatetimeIndex(time_level, tz='UTC').tz_convert(tz))
+        codes.append(time_codes)
+        index = pd.MultiIndex(levels=levels, codes=codes,
+                              names=cls.data_index, verify_integrity=False)
+        data = {}
+        for name in table.column_names:
+            if name in cls.data_index:
+                continue
+            arr = table.column(name).chunk(0)
+            if arr.null_count:
+                arr = arr.fill_null(-1)
+            data[name] = arr.to_numpy(zero_copy_only=False)
+        df = pd.DataFrame(data, index=index, copy=False)
+        if not index.is_monotonic_increasing:
+            df = df.sort_index()
+        blk.df = df
+        return blk
 
     def combine(self, blk):
         """Combine with another MarketDataBlock object.
@@ -187,6 +405,166 @@ class MarketDataBlock:
             raise TypeError("Parameter is not a MarketDataBlock instance.")
         self.update(blk.df, standardize_index=False)
 
+    async def combine_async(self, blk):
+        """Coroutine version of combine(), run by the transform executor.
+        """
+        if not isinstance(blk, MarketDataBlock):
+            raise TypeError("Parameter is not a MarketDataBlock instance.")
+        self.df = await run_transform(
+            _combine_df, self.df, blk.df, self.compact)
+
+    def _time_segments(self):
+        """
+        Return (times, segments) of self.df, cached until its index changes.
+        times: TickerTime as int64 UTC nanoseconds.
+        segments: [(Symbol, first row, last row + 1)] of the runs of rows of
+                  the same Symbol, DataType and BarSize, or None if self.df
+                  is not sorted.
+        """
+        index = self.df.index
+        cache = getattr(self, '_segments_cache', None)
+        if cache is not None and cache[0] is index:
+            return cache[1], cache[2]
+        dtlevel = self.__class__.dtlevel
+        times = index.get_level_values(dtlevel).asi8
+        if index.is_monotonic_increasing:
+            codes = np.column_stack(index.codes[:dtlevel])
+            bounds = np.concatenate((
+                [0], np.flatnonzero((codes[1:] != codes[:-1]).any(axis=1)) + 1,
+                [len(index)]))
+            symbols = index.levels[0][codes[bounds[:-1], 0]]
+            segments = list(zip(symbols, bounds[:-1], bounds[1:]))
+        else:
+            segments = None
+        self._segments_cache = (index, times, segments)
+        return times, segments
+
+    def slice(self, start: datetime=None, end: datetime=None,
+              symbols: list=None):
+        """
+        Return a MarketDataBlock of rows with TickerTime between start and
+        end, both included, and Symbol in symbols. None means unbounded.
+
+        Rows are found by binary search on the time axis of each Symbol,
+        DataType and BarSize. If they are one run of rows, e.g. from a
+        block of a single symbol, the returned block is a view sharing the
+        column arrays of this block, and must not be modified in place.
+        """
+        ret = MarketDataBlock(None, compact=self.compact)
+        if self.df.empty:
+            return ret
+        times, segments = self._time_segments()
+        lo_ns = -2**63 if start is None else self._time_ns(start)
+        hi_ns = 2**63 - 1 if end is None else self._time_ns(end)
+        if symbols is not None:
+            symbols = set([symbols] if isinstance(symbols, str) else symbols)
+        if segments is None:  # unsorted, select by mask
+            mask = (times >= lo_ns) & (times <= hi_ns)
+            if symbols is not None:
+                mask &= self.df.index.get_level_values(0).isin(symbols)
+            ret.df = self.df[mask]
+            return ret
+        ranges = []
+        for symbol, first, last in segments:
+            if symbols is not None and symbol not in symbols:
+                continue
+            seg_times = times[first:last]
+            lo = first + seg_times.searchsorted(lo_ns, 'left')
+            hi = first + seg_times.searchsorted(hi_ns, 'right')
+            if lo >= hi:
+                continue
+            if ranges and ranges[-1][1] == lo:
+                ranges[-1] = (ranges[-1][0], hi)
+            else:
+                ranges.append((lo, hi))
+        if len(ranges) == 1:
+            ret.df = self.df.iloc[ranges[0][0]:ranges[0][1]]
+        elif ranges:
+            ret.df = self.df.iloc[np.concatenate(
+                [np.arange(lo, hi) for lo, hi in ranges])]
+        else:
+            ret.df = self.df.iloc[0:0]
+        return ret
+
+    def _time_ns(self, dt: datetime) -> int:
+        ts = pd.Timestamp(dt)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize(self.tz)
+        return ts.value
+
+
+def _combine_df(df: pd.DataFrame, df_in: pd.DataFrame,
+                compact: bool=False) -> pd.DataFrame:
+    blk = MarketDataBlock(None, compact=compact)
+    blk.df = df
+    blk.update(df_in, standardize_index=False)
+    return blk.df
+
+
+def _combine_first(df: pd.DataFrame, df_other: pd.DataFrame) -> pd.DataFrame:
+    """
+    Same as df.combine_first(df_other).sort_index(), without the outer join
+    of MultiIndex which materializes index tuples. Rows are concatenated,
+    and only duplicated index entries are reduced to their first non-null
+    values.
+    """
+    columns = df.columns
+    if not columns.equals(df_other.columns):
+        columns = columns.union(df_other.columns)
+    df = pd.concat([df, df_other])
+    if df.index.has_duplicates:
+        df = df.groupby(level=list(range(df.index.nlevels))).first()
+    else:
+        df = df.sort_index()
+    return df[columns]
+
+
+@lru_cache(maxsize=None)
+def _req_sectype(sectype: str) -> str:
+    if sectype.upper() == 'CFD':
+        sectype = 'CFD'
+    elif sectype.upper() == 'FUTURESOPTION':
+        sectype = 'FuturesOption'
+    elif sectype.upper() == 'MUTUALFUND':
+        sectype = 'MutualFund'
+    else:
+        sectype = sectype.title()
+    if sectype not in SEC_TYPES:
+        raise TypeError('Invalid req.SecType.')
+    return sys.intern(sectype)
+
+
+@lru_cache(maxsize=None)
+def _req_timedur(timedur: str) -> str:
+    return sys.intern(timedur_standardize(timedur))
+
+
+@lru_cache(maxsize=None)
+def _req_datatype(datatype: str) -> str:
+    if datatype not in HIST_DATA_TYPES:
+        raise TypeError('Invalid req.DataType.')
+    return sys.intern(datatype.upper())
+
+
+def _req_upper(code: str) -> str:
+    return sys.intern(code.upper())
+
+
+def _req_timeend(timeend: datetime) -> datetime:
+    if timeend is None:
+        return datetime.now(tz=pytz.utc)
+    elif not isinstance(timeend, datetime):
+        raise TypeError("req.TimeEnd must be a datetime.datetime object.")
+    # Always use timezone-aware datetime.
+    if timeend.tzinfo is None:
+        _logger.warning('Naive HistDataReq.TimeEnd. '
+                        'Assumeing system local time zone.')
+        tz_system = get_localzone()
+        timeend = tz_system.localize(timeend)
+    if isinstance(timeend, pd.Timestamp):
+        timeend = timeend.to_pydatetime()
+    return timeend
+
 
 class HistDataReq:
     """
@@ -196,20 +574,84 @@ class HistDataReq:
     24hours/day, not actual trading hours.
     A user should use h/m/s time_dur only for intraday data (BarSize in h/m/s).
     TimeEnd should be in DateTime format.
+
+    A request is immutable and hashable, usable as a dict or cache key. Its
+    fields are normalized and interned, and equal requests have equal key
+    tuples in the order of the constructor arguments.
     """
-    __slots__ = ('_sectype', '_symbol', '_barsize', '_timedur', '_timeend',
-                 '_datatype', '_exchange', '_currency')
+    __slots__ = ('_key', '_hash')
+    # Normalizer of each field, in the order of _key.
+    _fields = (('SecType', _req_sectype), ('Symbol', _req_upper),
+               ('BarSize', _req_timedur), ('TimeDur', _req_timedur),
+               ('TimeEnd', _req_timeend), ('DataType', _req_datatype),
+               ('Exchange', _req_upper), ('Currency', _req_upper))
 
     def __init__(self, sectype, symbol, barsize, timedur, timeend=None,
                  datatype='TRADES', exchange='SMART', currency='USD'):
-        self.SecType = sectype
-        self.Symbol = symbol
-        self.BarSize = barsize
-        self.TimeDur = timedur
-        self.TimeEnd = timeend
-        self.DataType = datatype
-        self.Exchange = exchange
-        self.Currency = currency
+        key = (_req_sectype(sectype), _req_upper(symbol),
+               _req_timedur(barsize), _req_timedur(timedur),
+               _req_timeend(timeend), _req_datatype(datatype),
+               _req_upper(exchange), _req_upper(currency))
+        object.__setattr__(self, '_key', key)
+        object.__setattr__(self, '_hash', hash(key))
+
+    @classmethod
+    def _from_key(cls, key: tuple):
+        req = object.__new__(cls)
+        object.__setattr__(req, '_key', key)
+        object.__setattr__(req, '_hash', hash(key))
+        return req
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, **defaults) -> list:
+        """
+        Build requests of the rows of a DataFrame, validating and
+        normalizing each distinct value of a column once.
+
+            reqs = HistDataReq.from_frame(universe_df, barsize='1 min',
+                                          timedur='5d', timeend=dt)
+
+        :param df: Columns named as the request attributes, e.g. 'Symbol'
+                   and 'BarSize'.
+        :param defaults: Values of the fields not in df, by constructor
+                         argument names, e.g. barsize='1m'. Fields in
+                         neither take the constructor defaults.
+        :returns: List of HistDataReq of the rows.
+        """
+        init_defaults = {'timeend': None, 'datatype': 'TRADES',
+                         'exchange': 'SMART', 'currency': 'USD'}
+        init_defaults.update(defaults)
+        n = len(df)
+        columns = []
+        for field, normalize in cls._fields:
+            if field in df.columns:
+                codes, uniques = pd.factorize(df[field])
+                values = [normalize(value) for value in uniques]
+                if (codes < 0).any():
+                    if field != 'TimeEnd':
+                        raise TypeError('Missing req.{}.'.format(field))
+                    values.append(normalize(None))  # at code -1
+                columns.append(np.array(values, dtype=object)[codes])
+            elif field.lower() in init_defaults:
+                columns.append([normalize(init_defaults[field.lower()])] * n)
+            else:
+                raise TypeError('Missing req.{}.'.format(field))
+        return [cls._from_key(key) for key in zip(*columns)]
+
+    @property
+    def key(self) -> tuple:
+        """(SecType, Symbol, BarSize, TimeDur, TimeEnd, DataType, Exchange,
+        Currency)"""
+        return self._key
+
+    def __setattr__(self, name, value):
+        raise AttributeError('HistDataReq is immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('HistDataReq is immutable.')
+
+    def __reduce__(self):
+        return self.__class__._from_key, (self._key,)
 
     def __repr__(self):
         return ("{}({}, {}, {}, {}, {}, {}, {}, {})".format(
@@ -218,120 +660,52 @@ class HistDataReq:
             self.TimeEnd, self.DataType, self.Exchange, self.Currency))
 
     def __eq__(self, req):
-        return all(getattr(self, attr) == getattr(req, attr)
-                   for attr in HistDataReq.__slots__)
+        if not isinstance(req, HistDataReq):
+            return NotImplemented
+        return self._hash == req._hash and self._key == req._key
+
+    def __hash__(self):
+        return self._hash
 
     @property
     def SecType(self):
-        return self._sectype
-
-    @SecType.setter
-    def SecType(self, sectype):
-        if sectype.upper() == 'CFD':
-            sectype = 'CFD'
-        elif sectype.upper() == 'FUTURESOPTION':
-            sectype = 'FuturesOption'
-        elif sectype.upper() == 'MUTUALFUND':
-            sectype = 'MutualFund'
-        else:
-            sectype = sectype.title()
-        if sectype not in SEC_TYPES:
-            raise TypeError('Invalid req.SecType.')
-        self._sectype = sectype
+        return self._key[0]
 
     @property
     def Symbol(self):
-        return self._symbol
-
-    @Symbol.setter
-    def Symbol(self, symbol):
-        self._symbol = symbol.upper()
+        return self._key[1]
 
     @property
     def BarSize(self):
-        return self._barsize
-
-    @BarSize.setter
-    def BarSize(self, barsize):
-        self._barsize = timedur_standardize(barsize)
+        return self._key[2]
 
     @property
     def TimeDur(self):
-        return self._timedur
-
-    @TimeDur.setter
-    def TimeDur(self, timedur):
-        self._timedur = timedur_standardize(timedur)
+        return self._key[3]
 
     @property
     def TimeEnd(self):
-        return self._timeend
-
-    @TimeEnd.setter
-    def TimeEnd(self, timeend):
-        if timeend is None:
-            self._timeend = datetime.now(tz=pytz.utc)
-        elif not isinstance(timeend, datetime):
-            raise TypeError("req.TimeEnd must be a datetime.datetime object.")
-        else:
-            # Always use timezone-aware datetime.
-            if timeend.tzinfo is None:
-                _logger.warning('Naive HistDataReq.TimeEnd. '
-                                'Assumeing system local time zone.')
-                tz_system = get_localzone()
-                timeend = tz_system.localize(timeend)
-            self._timeend = timeend
+        return self._key[4]
 
     @property
     def DataType(self):
-        return self._datatype
-
-    @DataType.setter
-    def DataType(self, datatype):
-        if datatype not in HIST_DATA_TYPES:
-            raise TypeError('Invalid req.DataType.')
-        self._datatype = datatype.upper()
+        return self._key[5]
 
     @property
     def Exchange(self):
-        return self._exchange
-
-    @Exchange.setter
-    def Exchange(self, exchange):
-        self._exchange = exchange.upper()
+        return self._key[6]
 
     @property
     def Currency(self):
-        return self._currency
-
-    @Currency.setter
-    def Currency(self, currency):
-        self._currency = currency.upper()
-
-
-def _gen_sa_table(sectype, metadata=None):
-    """Generate SQLAlchemy Table object by sectype.
-    """
-    if metadata is None:
-        metadata = MetaData()
-    table = Table(
-        sectype, metadata,
-        Column('Symbol', String(20), primary_key=True),
-        Column('DataType', String(20), primary_key=True),
-        Column('BarSize', String(10), primary_key=True),
-        Column('TickerTime', DateTime(), primary_key=True),
-        Column('opening', Float(10, 2)),
-        Column('high', Float(10, 2)),
-        Column('low', Float(10, 2)),
-        Column('closing', Float(10, 2)),
-        Column('volume', mysqlINTEGER(unsigned=True)),
-        Column('barcount', mysqlINTEGER(unsigned=True)),
-        Column('average', Float(10, 2))
-    )
-    return table
-
-
-def init_db(db_info):
+        return self._key[7]
+
+
+def init_db(db_info, compact: bool=False):
+    """
+    Create tables for all sectypes if not exist, and make the BarSize column
+    of existing ones case-sensitive. If compact is True, create the compact
+    schema of ibstract.compactdb as well.
+    """
     db_conn = "mysql+pymysql://{0}:{1}@{2}/{3}".format(
         db_info['user'], db_info['password'], db_info['host'], db_info['db'])
     engine = create_engine(db_conn, echo=False)
@@ -344,63 +718,240 @@ def init_db(db_info):
         if sectype not in metadata.tables.keys():
             table = _gen_sa_table(sectype, metadata=metadata)
             table.create(engine, checkfirst=True)
+        else:
+            ddl = _binary_barsize_ddl(metadata.tables[sectype])
+            if ddl is not None:
+                engine.execute(ddl)
+    if 'Contracts' not in metadata.tables.keys():
+        _gen_sa_contracts_table(metadata).create(engine, checkfirst=True)
     engine.dispose()
+    if compact:
+        init_compact_db(db_info)
 
 
 async def query_hist_data(
         engine: object, sectype: str, symbol: str, datatype: str, barsize: str,
-        start: datetime=None, end: datetime=None) -> MarketDataBlock:
+        start: datetime=None, end: datetime=None,
+        compact: bool=False) -> MarketDataBlock:
     """Query database on conditions.
+    :param engine: aiomysql.sa engine, or a HistDataStore.
+    :param compact: Query the compact schema of ibstract.compactdb.
     """
     if start is None:
         start = pytz.UTC.localize(datetime(1, 1, 1))
     if end is None:
         end = pytz.UTC.localize(datetime(9999, 12, 31, 23, 59, 59))
-    table = _gen_sa_table(sectype)
-    stmt = table.select().where(
-        and_(
-            table.c.Symbol == symbol,
-            table.c.DataType == datatype,
-            table.c.BarSize == barsize,
-            table.c.TickerTime.between(
-                start.astimezone(pytz.UTC), end.astimezone(pytz.UTC))
-        )
-    )
-    async with engine.acquire() as conn:
-        result = await conn.execute(stmt)
-    df = pd.DataFrame(list(result), columns=table.columns.keys())
+    store = as_hist_data_store(engine, compact)
+    df = await store.query(sectype, symbol, datatype, barsize, start, end)
+    return await run_transform(_query_result_blk, df, start.tzinfo)
+
+
+def _query_result_blk(df: pd.DataFrame, tzinfo) -> MarketDataBlock:
     blk = MarketDataBlock(df, tz='UTC')
-    blk.tz_convert(start.tzinfo)
+    blk.tz_convert(tzinfo)
     return blk
 
 
-async def insert_hist_data(engine: object, sectype: str, blk: MarketDataBlock):
-    records = blk.df.reset_index().to_dict('records')
-    for r in records:
-        r['TickerTime'] = r['TickerTime'].to_pydatetime().astimezone(pytz.UTC)
-    table = _gen_sa_table(sectype)
-    async with engine.acquire() as conn:
-        await conn.execute(
-            table.insert().prefix_with('IGNORE').values(records))
-        await conn.execute('commit')  # github.com/aio-libs/aiomysql/issues/70
+def _hist_data_frame(blk: MarketDataBlock) -> pd.DataFrame:
+    """Flatten a MarketDataBlock to a DataFrame in UTC for insertion.
+    """
+    df = blk.df.reset_index()
+    df['TickerTime'] = df['TickerTime'].dt.tz_convert(pytz.UTC)
+    return df
+
+
+def _hist_data_frames(blks: list) -> pd.DataFrame:
+    return pd.concat([_hist_data_frame(blk) for blk in blks],
+                     ignore_index=True)
+
+
+async def insert_hist_data(engine: object, sectype: str, blk: MarketDataBlock,
+                           compact: bool=False):
+    """Insert a MarketDataBlock to database, ignoring existing rows.
+    :param engine: aiomysql.sa engine, or a HistDataStore.
+    :param compact: Insert to the compact schema of ibstract.compactdb.
+    """
+    if blk.df.empty:
+        return
+    store = as_hist_data_store(engine, compact)
+    await store.insert(sectype, await run_transform(_hist_data_frame, blk))
+
+
+class HistDataWriter:
+    """
+    Write-behind queue inserting MarketDataBlocks to database in background.
+
+    put() returns as soon as a block is queued, and waits only when maxsize
+    blocks are pending (backpressure). A background task coalesces queued
+    blocks of the same sectype into batched inserts of up to batch_rows rows,
+    and retries transient database errors with exponential backoff. Blocks
+    still failing after max_retries are logged and kept in self.failed.
+    Call flush() to wait for pending inserts, and close() on shutdown.
+
+    :param engine: aiomysql.sa engine, or a HistDataStore.
+    :param compact: Insert to the compact schema of ibstract.compactdb.
+    """
+    def __init__(self, engine: object, maxsize: int=64, batch_rows: int=10000,
+                 max_retries: int=5, retry_delay: float=0.5,
+                 compact: bool=False, loop=None):
+        self.store = as_hist_data_store(engine, compact)
+        self.batch_rows = batch_rows
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.failed = []
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._worker = None
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    async def put(self, sectype: str, blk: MarketDataBlock):
+        """Queue a block for insertion, waiting if the queue is full.
+        """
+        if self._worker is None:
+            loop = self._loop or asyncio.get_event_loop()
+            self._worker = loop.create_task(self._run())
+        if not blk.df.empty:
+            await self._queue.put((sectype, blk))
+
+    async def flush(self):
+        """Wait until all queued blocks are inserted or failed.
+        """
+        await self._queue.join()
+
+    drain = flush
+
+    async def close(self):
+        """Flush queued blocks and stop the background task.
+        """
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            items = [await self._queue.get()]
+            rows = len(items[0][1])
+            while rows < self.batch_rows and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+                rows += len(items[-1][1])
+            try:
+                by_sectype = {}
+                for sectype, blk in items:
+                    by_sectype.setdefault(sectype, []).append(blk)
+                for sectype, blks in by_sectype.items():
+                    df = await run_transform(_hist_data_frames, blks)
+                    for i in range(0, len(df), self.batch_rows):
+                        await self._insert_retry(
+                            sectype, df.iloc[i:i+self.batch_rows])
+            except Exception as e:
+                _logger.error('HistDataWriter: insertion failed: %r', e)
+                self.failed.extend(items)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    async def _insert_retry(self, sectype: str, df: pd.DataFrame):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.store.insert(sectype, df)
+            except self.store.transient_errors as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                _logger.warning('HistDataWriter: %r, retry in %.1fs.',
+                                e, delay)
+                await asyncio.sleep(delay)
 
 
 async def download_insert_hist_data(
         req: HistDataReq, broker: object, engine: object,
-        insert_limit: tuple=None) -> MarketDataBlock:
+        insert_limit: tuple=None, writer: HistDataWriter=None,
+        compact: bool=False) -> MarketDataBlock:
     """
     Download historical data for a single request, and insert data to database.
+    If a HistDataWriter is given, data is queued to it for insertion in the
+    background instead.
     """
     blk_list = await broker.req_hist_data_async(req)
-    blk = MarketDataBlock(blk_list[0].df.copy())
+    blk = blk_list[0]
     if insert_limit is not None:
-        start = insert_limit[0].astimezone(pytz.UTC)
-        end = insert_limit[1].astimezone(pytz.UTC)
-        blk.df = blk.df.loc(axis=0)[:, :, :, start:end]
-    await insert_hist_data(engine, req.SecType, blk)
+        blk = blk.slice(*insert_limit)
+    if writer is not None:
+        await writer.put(req.SecType, blk)
+    else:
+        await insert_hist_data(engine, req.SecType, blk, compact=compact)
     return blk_list[0]
 
 
+FailedRange = namedtuple('FailedRange', 'start end req error')
+
+
+class HistDataIncomplete(Exception):
+    """
+    Raised by get_hist_data() and iter_hist_data() after the downloads of
+    some ranges failed. The data of all other ranges has been stored.
+
+    :attr blk: MarketDataBlock of the data got, or None from iter_hist_data().
+    :attr failed: [FailedRange(start, end, req, error)] in time order.
+    """
+    def __init__(self, blk: MarketDataBlock, failed: list):
+        self.blk = blk
+        self.failed = sorted(failed, key=lambda f: f.start)
+        super().__init__('{} download(s) failed: {}'.format(
+            len(failed), ', '.join('{} - {}: {!r}'.format(
+                f.start, f.end, f.error) for f in self.failed)))
+
+
+def _is_transient_error(broker: object, store: HistDataStore,
+                        exc: Exception) -> bool:
+    is_transient = getattr(broker, 'is_transient_error', None)
+    if is_transient is not None and is_transient(exc):
+        return True
+    store_errors = () if store is None else tuple(store.transient_errors)
+    return isinstance(exc, TRANSIENT_ERRORS + store_errors)
+
+
+async def _download_insert_or_fail(
+        req: HistDataReq, broker: object, store: HistDataStore,
+        insert_limit: tuple, writer: HistDataWriter, failed: list,
+        max_retries: int, retry_delay: float) -> MarketDataBlock:
+    """
+    download_insert_hist_data(), retrying transient errors with jittered
+    exponential backoff. Return None and append a FailedRange to failed, if
+    the download fails permanently or after max_retries retries.
+    """
+    if broker is None:
+        failed.append(FailedRange(*insert_limit, req, ConnectionError(
+            'No broker to download from.')))
+        return None
+    attempt = 0
+    while True:
+        try:
+            return await download_insert_hist_data(
+                req, broker, store, insert_limit, writer)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt < max_retries and \
+               _is_transient_error(broker, store, e):
+                delay = retry_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+                attempt += 1
+                _logger.warning('Download %s failed: %r. Retry %d in %.1f s.',
+                                req, e, attempt, delay)
+                await asyncio.sleep(delay)
+                continue
+            _logger.error('Download %s failed: %r', req, e)
+            failed.append(FailedRange(*insert_limit, req, e))
+            return None
+
+
 def hist_data_req_start_end(req: HistDataReq, xchg_tz: pytz.tzinfo):
     """
     Calculate start and end datetime for a historical data request.
@@ -413,7 +964,7 @@ def hist_data_req_start_end(req: HistDataReq, xchg_tz: pytz.tzinfo):
     if time_dur[-1] in ('W', 'M', 'Y'):
         start_dt = xchg_tz.normalize(end_dt - timedur_to_reldelta(time_dur))
         trd_days = trading_days(end_dt, time_start=start_dt)
-    elif time_dur[-1] is 'd':
+    elif time_dur[-1] == 'd':
         # trd_days is a DateTimeIndex, with consecutive integer index.
         trd_days = trading_days(end_dt, time_dur)
         _logger.debug('trd_days: \n%s', trd_days)
@@ -422,7 +973,7 @@ def hist_data_req_start_end(req: HistDataReq, xchg_tz: pytz.tzinfo):
     else:  # TimeDur in h/m/s.
         trd_days = trading_days(end_dt, time_dur)
         _logger.debug('trd_days: \n%s', trd_days)
-        if req.BarSize[-1] is 'd':
+        if req.BarSize[-1] == 'd':
             # BarSize in d. Start time set to 00:00:00 of start date.
             start_date = trd_days.iloc[0].to_pydatetime()
             start_dt = tzmin(start_date, tz=xchg_tz)
@@ -439,24 +990,35 @@ def hist_data_req_start_end(req: HistDataReq, xchg_tz: pytz.tzinfo):
 
 
 async def query_hist_data_split_req(
-        req: HistDataReq, xchg_tz: pytz.tzinfo, engine: object):
+        req: HistDataReq, xchg_tz: pytz.tzinfo, engine: object,
+        compact: bool=False, tail_sync: bool=False, min_fill: float=None):
     """
     Query historical data from database, based on which downloading requests
     are generated.
-    For req.BarSize < 1 day, download step is 1 day; otherwise 1 year.
-    Consecutive trading days are grouped to one request.
+    For req.BarSize < 1 day, consecutive trading days are grouped to one
+    request of at most the IB_HIST_DATA_STEPS duration of req.BarSize, and
+    days of second bars are split to requests of that duration in seconds.
+    Otherwise download step is 1 year.
     :param xchg_tz: Time zone info of the security exchange for req.
+    :param compact: Query the compact schema of ibstract.compactdb.
+    :param tail_sync: Download from the last stored bar onward, instead of
+                      the whole current year for BarSize >= 1 day. For
+                      BarSize < 1 day, the rest of the last stored trading
+                      day is downloaded too.
+    :param min_fill: For BarSize < 1 day, a stored trading day having fewer
+                     than min_fill of its expected regular session bars is
+                     partial, and the window from its first to its last
+                     missing bar is downloaded. None: Any stored bar makes a
+                     day complete, except for second bars, of which the
+                     requested range before the first and after the last
+                     stored bar of a day is downloaded.
     """
-    # Support BarSize in 'd', 'h', 'm' so far.
-    if timedur_standardize(req.BarSize)[-1] in ('s', 'W', 'M'):
-        raise NotImplementedError
-
     start_dt, end_dt, trd_days = hist_data_req_start_end(req, xchg_tz)
 
     # Query from database between start_dt and end_dt
     blk_db = await query_hist_data(
         engine, req.SecType, req.Symbol, req.DataType, req.BarSize,
-        start_dt, end_dt)
+        start_dt, end_dt, compact=compact)
     if not blk_db.df.empty:
         blk_db.tz = xchg_tz
         blk_db_dates = blk_db.df.index.levels[blk_db.__class__.dtlevel].date
@@ -465,9 +1027,9 @@ async def query_hist_data_split_req(
 
     # Logic to find datetime gaps in database for the request.
     # Convention: Download step = 1 year for BarSize >= 1 day.
-    #             Download step = 1 day  for BarSize 'h' or 'm'.
+    #             Download step = IB_HIST_DATA_STEPS for BarSize 'h/m/s'.
     if req.BarSize[-1] in ('d', 'W', 'M', 'Y'):
-        if req.TimeDur[-1] is 'd':
+        if req.TimeDur[-1] == 'd':
             # count back by trading days, if req.TimeDur in days
             trd_years = set(dt.year for dt in trd_days)
         else:
@@ -475,7 +1037,14 @@ async def query_hist_data_split_req(
             trd_years = set(range(start_dt.year, end_dt.year+1))
         _logger.debug('trd_years: %s', trd_years)
         blk_db_years = set(dt.year for dt in blk_db_dates)
-        if datetime.now(tz=xchg_tz).year in blk_db_years:
+        tail = None
+        if tail_sync and blk_db_years:
+            # Years from the last stored bar onward are covered by the tail.
+            tail = _tail_download(blk_db, end_dt, xchg_tz, daily=True)
+            last_year = max(blk_db_years)
+            trd_years = set(yr for yr in trd_years if yr < last_year)
+            blk_db_years.remove(last_year)
+        elif datetime.now(tz=xchg_tz).year in blk_db_years:
             # always download current year
             blk_db_years.remove(datetime.now(tz=xchg_tz).year)
         trd_year_gap = sorted(trd_years ^ blk_db_years)
@@ -488,6 +1057,9 @@ async def query_hist_data_split_req(
                 xchg_tz.localize(datetime(yr, 1, 1)),
                 tzmax(datetime(yr+1, 12, 31), tz=xchg_tz)
             ) for yr in trd_year_gap]
+        if tail is not None:
+            timedur_timeend_download.append(tail[0])
+            insert_limit.append(tail[1])
     else:  # Download step is 1 day for BarSize < 1 day (1min~8hours).
         # Find trading day gaps in the data from database
         trd_dates = [tday.date() for tday in trd_days]
@@ -497,18 +1069,61 @@ async def query_hist_data_split_req(
                            for d in trd_day_gap]
         _logger.debug('trd_day_gap: %s', trd_day_gap)
         _logger.debug('trd_day_gap_idx: %s', trd_day_gap_idx)
-        # Group consecutive trading days in the gaps
+        # Group consecutive trading days in the gaps, up to the max
+        # duration of a request.
+        dl_step = IB_HIST_DATA_STEPS.get(req.BarSize, '1d')
+        if dl_step[-1] in ('s', 'm', 'h'):
+            day_step, sec_step = timedur_to_reldelta('1d'), dl_step
+        else:
+            day_step, sec_step = timedur_to_reldelta(dl_step), None
+        groups = []
+        for idx in trd_day_gap_idx:
+            if groups and idx == groups[-1][-1] + 1 and \
+               trd_days[groups[-1][0]] + day_step > trd_days[idx]:
+                groups[-1].append(idx)
+            else:
+                groups.append([idx])
         timedur_timeend_download, insert_limit = [], []
-        dur_days = 1
-        for i, idx in enumerate(trd_day_gap_idx):
-            if i == len(trd_day_gap_idx) - 1 or trd_day_gap_idx[i+1] > idx + 1:
-                dl_start = tzmin(trd_days[idx-dur_days+1], tz=xchg_tz)
-                dl_end = tzmax(trd_days[idx], tz=xchg_tz)
-                timedur_timeend_download.append((str(dur_days) + 'd', dl_end))
+        for group in groups:
+            dl_start = tzmin(trd_days[group[0]], tz=xchg_tz)
+            dl_end = tzmax(trd_days[group[-1]], tz=xchg_tz)
+            if sec_step is None:
+                timedur_timeend_download.append(
+                    (str(len(group)) + 'd', dl_end))
                 insert_limit.append((dl_start, dl_end))
-                dur_days = 1
             else:
-                dur_days += 1
+                # Second bars are only downloaded in the requested range.
+                dl_start = max(dl_start, start_dt)
+                dl_end = min(dl_end, end_dt, datetime.now(tz=xchg_tz))
+                for dl in _seconds_downloads(dl_start, dl_end, sec_step):
+                    timedur_timeend_download.append(dl[0])
+                    insert_limit.append(dl[1])
+        windows = []
+        if min_fill is not None and len(blk_db_dates):
+            windows = _partial_day_windows(
+                blk_db, sorted(set(trd_dates) & set(blk_db_dates)),
+                req.BarSize, xchg_tz, min_fill, start_dt, end_dt)
+        if sec_step is not None and len(blk_db_dates):
+            # Stored days of second bars may cover part of the range only.
+            windows += _uncovered_windows(
+                blk_db, sorted(set(trd_dates) & set(blk_db_dates)),
+                req.BarSize, xchg_tz, start_dt, end_dt)
+        if tail_sync and len(blk_db_dates):
+            # The last stored day may be partial.
+            tail = _tail_download(blk_db, end_dt, xchg_tz, daily=False,
+                                  barsize=req.BarSize)
+            if tail is not None:
+                # Extend the tail to cover a missing window of the same day.
+                tail_start, tail_end = tail[1]
+                for win in [w for w in windows
+                            if w[0].date() == tail_start.date()]:
+                    windows.remove(win)
+                    tail_start = min(tail_start, win[0])
+                windows.append((tail_start, tail_end))
+        for dl_start, dl_end in _merge_windows(windows):
+            for dl in _seconds_downloads(dl_start, dl_end, sec_step):
+                timedur_timeend_download.append(dl[0])
+                insert_limit.append(dl[1])
     _logger.debug('timedur_timeend_download: %s', timedur_timeend_download)
     # Build HistDataReq list
     download_reqs = []
@@ -522,13 +1137,188 @@ async def query_hist_data_split_req(
     return download_reqs, insert_limit, blk_db, start_dt, end_dt
 
 
+def _tail_download(blk_db: MarketDataBlock, end_dt: datetime,
+                   xchg_tz: pytz.tzinfo, daily: bool, barsize: str=None):
+    """
+    Return ((TimeDur, TimeEnd), (start, end)) of a download from the last
+    bar in blk_db to end_dt, or None if nothing is left to download.
+    Daily bars are downloaded from the date of the last bar, which may have
+    been in progress when stored. Intraday bars of barsize are downloaded
+    from the last bar to the end of its trading day, the following days
+    being gaps, unless no regular session bar of the day is left.
+    """
+    last_dt = blk_db.df.index.get_level_values(blk_db.dtlevel).max()
+    last_dt = last_dt.to_pydatetime().astimezone(xchg_tz)
+    now = datetime.now(tz=xchg_tz)
+    if daily:
+        dl_start = tzmin(last_dt, tz=xchg_tz)
+        dl_end = min(end_dt, tzmax(now, tz=xchg_tz))
+        n_days = len(trading_days(dl_end, time_start=dl_start))
+        if n_days == 0:
+            return None
+        if n_days > 250:  # IB limits durations in days to one year.
+            timedur = '{}Y'.format(dl_end.year - dl_start.year + 1)
+        else:
+            timedur = '{}d'.format(n_days)
+    else:
+        dl_start = last_dt
+        dl_end = min(end_dt, tzmax(last_dt, tz=xchg_tz), now)
+        if dl_end <= dl_start:
+            return None
+        expected = expected_bar_times(last_dt.date(), barsize, xchg_tz)
+        if not ((expected > last_dt) & (expected < dl_end)).any():
+            return None  # the session of the last day is complete
+        return _seconds_download(dl_start, dl_end)
+    return (timedur, dl_end), (dl_start, dl_end)
+
+
+def _seconds_download(dl_start: datetime, dl_end: datetime):
+    """((TimeDur, TimeEnd), (start, end)) of a download in seconds.
+    """
+    timedur = '{}s'.format(int((dl_end - dl_start).total_seconds()))
+    return (timedur, dl_end), (dl_start, dl_end)
+
+
+def _seconds_downloads(dl_start: datetime, dl_end: datetime,
+                       step: str=None) -> list:
+    """
+    Split a download from dl_start to dl_end in seconds to downloads of at
+    most step duration each. step None: No split.
+    """
+    if step is None:
+        return [_seconds_download(dl_start, dl_end)]
+    step = timedur_to_timedelta(step)
+    downloads = []
+    while dl_start < dl_end:
+        downloads.append(
+            _seconds_download(dl_start, min(dl_start + step, dl_end)))
+        dl_start += step
+    return downloads
+
+
+def _partial_day_windows(blk_db: MarketDataBlock, dates: list, barsize: str,
+                         xchg_tz: pytz.tzinfo, min_fill: float,
+                         start_dt: datetime, end_dt: datetime) -> list:
+    """
+    Return [(start, end)] windows from the first to the last missing
+    regular session bar, of days in dates having fewer than min_fill of the
+    expected bars in blk_db. Only bars between start_dt and end_dt, and
+    started by now, are expected.
+    """
+    times = blk_db.df.index.get_level_values(blk_db.dtlevel)
+    bar = timedur_to_timedelta(barsize)
+    upto = min(end_dt, datetime.now(tz=xchg_tz))
+    windows = []
+    for day in dates:
+        expected = expected_bar_times(day, barsize, xchg_tz)
+        expected = expected[(expected >= start_dt) & (expected < upto)]
+        if len(expected) == 0:
+            continue
+        stored = times[times.searchsorted(tzmin(day, tz=xchg_tz)):
+                       times.searchsorted(tzmax(day, tz=xchg_tz))]
+        missing = expected.difference(stored)
+        if len(expected) - len(missing) >= min_fill * len(expected):
+            continue
+        _logger.debug('Partial day %s: %d of %d bars.', day,
+                      len(expected) - len(missing), len(expected))
+        windows.append((missing[0].to_pydatetime(),
+                        (missing[-1] + bar).to_pydatetime()))
+    return windows
+
+
+def _uncovered_windows(blk_db: MarketDataBlock, dates: list, barsize: str,
+                       xchg_tz: pytz.tzinfo, start_dt: datetime,
+                       end_dt: datetime) -> list:
+    """
+    Return [(start, end)] windows of expected regular session bars of days
+    in dates before the first and after the last bar in blk_db within the
+    expected bars. Only bars between start_dt and end_dt, and started by
+    now, are expected.
+    """
+    times = blk_db.df.index.get_level_values(blk_db.dtlevel)
+    bar = timedur_to_timedelta(barsize)
+    upto = min(end_dt, datetime.now(tz=xchg_tz))
+    windows = []
+    for day in dates:
+        expected = expected_bar_times(day, barsize, xchg_tz)
+        expected = expected[(expected >= start_dt) & (expected < upto)]
+        if len(expected) == 0:
+            continue
+        first, last = expected[0], expected[-1]
+        stored = times[times.searchsorted(first):
+                       times.searchsorted(last, side='right')]
+        if len(stored) == 0:
+            windows.append((first, last + bar))
+            continue
+        if stored[0] > first:
+            windows.append((first, stored[0]))
+        if stored[-1] < last:
+            windows.append((stored[-1] + bar, last + bar))
+    _logger.debug('Uncovered windows: %s', windows)
+    return [(start.to_pydatetime(),
+             pd.Timestamp(min(end, upto)).to_pydatetime())
+            for start, end in windows]
+
+
+def _merge_windows(windows: list) -> list:
+    """Sorted union of overlapping (start, end) windows.
+    """
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Exchange time zones by store, then (SecType, Symbol, Exchange, Currency).
+_xchg_tz_cache = weakref.WeakKeyDictionary()
+
+
+async def hist_data_req_xchg_tz(req: HistDataReq, broker: object,
+                                store: HistDataStore) -> pytz.tzinfo:
+    """
+    Return the exchange time zone of a request, from the contract metadata
+    in store, cached in memory, or else from the broker and saved to store.
+    """
+    key = (req.SecType, req.Symbol, req.Exchange, req.Currency)
+    cache = _xchg_tz_cache.setdefault(store, {})
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    tz_name = None
+    try:
+        tz_name = await store.query_contract_tz(*key)
+    except Exception as e:
+        _logger.warning('Contract metadata query failed: %r', e)
+    if tz_name is not None:
+        xchg_tz = pytz.timezone(tz_name)
+    elif broker is None:
+        raise ValueError(
+            'Exchange time zone of {} is not stored, and no broker is '
+            'given.'.format(req))
+    else:
+        xchg_tz = await broker.hist_data_req_timezone(req)
+        try:
+            await store.insert_contract_tz(*key, xchg_tz.zone)
+        except Exception as e:
+            _logger.warning('Contract metadata insert failed: %r', e)
+    cache[key] = xchg_tz
+    return xchg_tz
+
+
 async def get_hist_data(
-        req: HistDataReq, broker: object, mysql: dict=None) -> MarketDataBlock:
+        req: HistDataReq, broker: object, mysql: dict=None,
+        writer: HistDataWriter=None, store: HistDataStore=None,
+        tail_sync: bool=False, min_fill: float=None, max_retries: int=3,
+        retry_delay: float=1.) -> MarketDataBlock:
     """
     Return a MarketDataBlock object containing historical market data for a
     user request. All the involved operations are asynchronously
     concurrent, including downloading data, merging data in memory, and query
-    and saving data with a MySQL database.
+    and saving data with a MySQL database, or any other HistDataStore.
 
     The function will first determine which parts of the requested data exist
     in the MySQL database. The parts of requested data not in the database will
@@ -539,46 +1329,201 @@ async def get_hist_data(
     The downloaded data for any single request will be immediately combined to
     a MarketDataBlock object, while other requested data are still being
     downloaded. The downloaded data will also be asynchronously inserted to the
-    database.
+    database. If a long-lived HistDataWriter is given, insertion is queued to
+    it, and the function returns without waiting for database writes.
+
+    The exchange time zone of req is looked up in the contract metadata of the
+    database, and asked from the broker only the first time. So a request
+    fully covered by the database needs no broker calls, and broker may be
+    None. Gaps then fail to download, see below.
+
+    A download failing by a transient error, e.g. a timeout or an IB pacing
+    violation, is retried. A failed download does not stop the others: after
+    all downloads are done, HistDataIncomplete is raised, carrying the data
+    got and the failed ranges.
 
     :param mysql: {'host': str, 'user': str, 'password': str, 'db': str,
-                   'loop': asyncio.BaseEventLoop}
+                   'loop': asyncio.BaseEventLoop, 'compact': bool(optional)}
+    :param writer: Optional HistDataWriter for write-behind insertion.
+    :param store: Optional HistDataStore used instead of mysql. It is left
+                  open for reuse.
+    :param tail_sync: Download only from the last stored bar onward, instead
+                      of the whole current year of daily bars. See
+                      query_hist_data_split_req().
+    :param min_fill: Re-download missing bars of stored trading days having
+                     fewer than min_fill of their expected bars. See
+                     query_hist_data_split_req().
+    :param max_retries: Max number of retries of a download.
+    :param retry_delay: Mean delay in seconds before the first retry, doubled
+                        for each following retry.
     """
-    xchg_tz = await broker.hist_data_req_timezone(req)
-
-    # All data will be downloaded from broker if database is unavailable
-    # or requested BarSize not in database.
-    if mysql is None or timedur_standardize(req.BarSize)[-1] is 's':
+    # All data will be downloaded from broker if database is unavailable.
+    if mysql is None and store is None:
+        xchg_tz = await broker.hist_data_req_timezone(req)
         blk_list = await broker.req_hist_data_async(req)
         blk = blk_list[0]
         blk.tz_convert(xchg_tz)
         return blk
 
     # init database
-    engine = await aio_create_engine(
-        host=mysql['host'], user=mysql['user'], password=mysql['password'],
-        db=mysql['db'], loop=mysql['loop'])
+    own_store = store is None
+    if own_store:
+        store = await MySQLStore.create(mysql)
+    try:
+        xchg_tz = await hist_data_req_xchg_tz(req, broker, store)
+    except Exception:
+        if own_store:
+            await store.close()
+        raise
 
     # Query database first, and split req for downloading
     (dl_reqs, insert_limit, blk_ret,
-     start_dt, end_dt) = await query_hist_data_split_req(req, xchg_tz, engine)
+     start_dt, end_dt) = await query_hist_data_split_req(
+         req, xchg_tz, store, tail_sync=tail_sync,
+         min_fill=min_fill)
     _logger.debug('blk_ret head:\n%s', blk_ret.df.iloc[:3])
     _logger.debug('start_dt: %s', start_dt)
     _logger.debug('end_dt: %s', end_dt)
 
-    # Download data and insert to db concurrently
+    # Download data and insert to db concurrently. Each downloaded block is
+    # combined in completion order, while the others are still downloading.
+    failed = []
     if dl_reqs is not None:
-        blk_dl_list = await asyncio.gather(*(
-            download_insert_hist_data(req_i, broker, engine, inslim)
-            for req_i, inslim in zip(dl_reqs, insert_limit)))
-        for blk_dl in blk_dl_list:
-            _logger.debug('blk_dl head:\n%s', blk_dl.df.iloc[:3])
-            blk_ret.combine(blk_dl)
-            _logger.debug('Combined blk_ret head:\n%s', blk_ret.df.iloc[:3])
+        dl_tasks = [
+            asyncio.ensure_future(_download_insert_or_fail(
+                req_i, broker, store, inslim, writer, failed, max_retries,
+                retry_delay))
+            for req_i, inslim in zip(dl_reqs, insert_limit)]
+        try:
+            for dl_next in asyncio.as_completed(dl_tasks):
+                blk_dl = await dl_next
+                if blk_dl is None:
+                    continue
+                _logger.debug('blk_dl head:\n%s', blk_dl.df.iloc[:3])
+                await blk_ret.combine_async(blk_dl)
+                _logger.debug('Combined blk_ret head:\n%s',
+                              blk_ret.df.iloc[:3])
+        finally:
+            for task in dl_tasks:
+                task.cancel()
         # Limit time range according to req
-        blk_ret.df = blk_ret.df.loc(axis=0)[:, :, :, start_dt:end_dt]
+        blk_ret = blk_ret.slice(start_dt, end_dt)
 
     # wrap up
-    engine.close()
-    await engine.wait_closed()
+    if own_store:
+        await store.close()
+    if failed:
+        raise HistDataIncomplete(blk_ret, failed)
     return blk_ret
+
+
+def _blk_time_between(blk: MarketDataBlock, after: datetime=None,
+                      since: datetime=None, before: datetime=None,
+                      upto: datetime=None):
+    """
+    Return a MarketDataBlock of rows in blk with TickerTime later than after,
+    not earlier than since, earlier than before, and not later than upto.
+    None means unbounded.
+    """
+    ret = MarketDataBlock(None)
+    if blk.df.empty:
+        return ret
+    t = blk.df.index.get_level_values(MarketDataBlock.dtlevel)
+    mask = np.ones(len(t), dtype=bool)
+    if after is not None:
+        mask &= t > after
+    if since is not None:
+        mask &= t >= since
+    if before is not None:
+        mask &= t < before
+    if upto is not None:
+        mask &= t <= upto
+    ret.df = blk.df[mask]
+    return ret
+
+
+async def iter_hist_data(
+        req: HistDataReq, broker: object, mysql: dict=None,
+        writer: HistDataWriter=None, store: HistDataStore=None,
+        prefetch: int=8, tail_sync: bool=False, min_fill: float=None,
+        max_retries: int=3, retry_delay: float=1.):
+    """
+    Async generator version of get_hist_data(). MarketDataBlock chunks are
+    yielded in time order as soon as they are available: data found in the
+    database is yielded immediately, and the gaps are yielded as their
+    downloads complete. At most prefetch downloads run ahead of the consumer,
+    so the downloaded part of the range is never held in memory at once.
+    The stored part is not streamed: the gaps to download are planned from
+    the bars stored in the whole range, which are queried before the first
+    chunk is yielded and held until the last. If some downloads failed,
+    HistDataIncomplete is raised after the last chunk.
+
+    Usage:
+        async for blk in iter_hist_data(req, broker, mysql):
+            ...
+
+    :param mysql, writer, store, tail_sync, min_fill, max_retries,
+           retry_delay: See get_hist_data().
+    """
+    if mysql is None and store is None:
+        xchg_tz = await broker.hist_data_req_timezone(req)
+        blk_list = await broker.req_hist_data_async(req)
+        blk = blk_list[0]
+        blk.tz_convert(xchg_tz)
+        yield blk
+        return
+
+    own_store = store is None
+    if own_store:
+        store = await MySQLStore.create(mysql)
+    dl_tasks = []
+    failed = []
+    try:
+        xchg_tz = await hist_data_req_xchg_tz(req, broker, store)
+        (dl_reqs, insert_limit, blk_db,
+         start_dt, end_dt) = await query_hist_data_split_req(
+             req, xchg_tz, store, tail_sync=tail_sync,
+             min_fill=min_fill)
+        dl_windows = sorted(zip(insert_limit, dl_reqs), key=lambda x: x[0][0])
+
+        def schedule_downloads():
+            while (len(dl_tasks) < len(dl_windows) and
+                   len(dl_tasks) - i_dl < prefetch):
+                inslim, req_i = dl_windows[len(dl_tasks)]
+                dl_tasks.append(asyncio.ensure_future(
+                    _download_insert_or_fail(
+                        req_i, broker, store, inslim, writer, failed,
+                        max_retries, retry_delay)))
+
+        last_dt = None  # TickerTime of the last yielded bar
+        for i_dl, ((dl_start, dl_end), _) in enumerate(dl_windows):
+            schedule_downloads()
+            # Database data before the next gap.
+            blk = _blk_time_between(blk_db, after=last_dt, before=dl_start)
+            if not blk.df.empty:
+                last_dt = blk.df.index.get_level_values(blk.dtlevel)[-1]
+                yield blk
+            # Downloaded data filling the gap.
+            blk_dl = await dl_tasks[i_dl]
+            dl_tasks[i_dl] = None
+            if blk_dl is None:
+                continue
+            blk_dl.tz_convert(xchg_tz)
+            blk = _blk_time_between(blk_dl, after=last_dt, since=start_dt,
+                                    upto=min(dl_end, end_dt))
+            del blk_dl
+            if not blk.df.empty:
+                last_dt = blk.df.index.get_level_values(blk.dtlevel)[-1]
+                yield blk
+        # Database data after the last gap.
+        blk = _blk_time_between(blk_db, after=last_dt)
+        if not blk.df.empty:
+            yield blk
+        if failed:
+            raise HistDataIncomplete(None, failed)
+    finally:
+        for task in dl_tasks:
+            if task is not None:
+                task.cancel()
+        if own_store:
+            await store.close()
@@ -0,0 +1,153 @@
+"""
+Event loop stall detection.
+
+StallMonitor measures the lag of an asyncio event loop with a heartbeat
+callback. A watchdog thread samples the stack of the loop thread while the
+heartbeat is overdue, so each stall is attributed to the code that blocked
+the loop, e.g. 'ibstract.marketdata.get_hist_data >
+ibstract.marketdata._combine_first'.
+
+    monitor = StallMonitor(threshold=0.05)
+    monitor.start()
+    blk = await get_hist_data(req, broker, store=store)
+    print(monitor.format_report())
+    monitor.stop()
+"""
+import logging
+import sys
+import time
+import threading
+import asyncio
+from collections import deque, Counter
+
+
+_logger = logging.getLogger('ibstract.monitor')
+__all__ = ['StallMonitor']
+
+
+class StallMonitor:
+    """
+    Opt-in monitor of event loop stalls.
+
+    :param threshold: Report stalls longer than threshold seconds.
+    :param interval: Heartbeat and watchdog sampling interval in seconds.
+    :param history: Number of recent stalls kept for the report.
+    :param package: Stack frames in modules of this package are preferred
+                    as stall sources.
+    """
+    def __init__(self, threshold: float=0.05, interval: float=0.01,
+                 history: int=1000, package: str='ibstract'):
+        self.threshold = threshold
+        self.interval = interval
+        self.package = package
+        self.stalls = deque(maxlen=history)  # (time, duration, source)
+        self.max_lag = 0.
+        self._loop = None
+        self._loop_thread_id = None
+        self._handle = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._last_beat = None
+        self._samples = Counter()
+
+    def start(self, loop: asyncio.AbstractEventLoop=None):
+        """Start monitoring loop. Must be called in the loop thread.
+        """
+        self._loop = loop or asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        self._watchdog = threading.Thread(
+            target=self._watch, name='ibstract-stall-monitor', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        """Stop monitoring. Recorded stalls are kept.
+        """
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _beat(self):
+        now = time.monotonic()
+        lag = now - self._last_beat - self.interval
+        self._last_beat = now
+        with self._lock:
+            samples, self._samples = self._samples, Counter()
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if lag > self.threshold:
+            if samples:
+                source = samples.most_common(1)[0][0]
+            else:
+                source = '<unknown>'
+            self.stalls.append((time.time(), lag, source))
+            _logger.warning('Event loop stalled %.0f ms in %s.',
+                            lag * 1e3, source)
+        if not self._stopped.is_set():
+            self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() - self._last_beat < \
+                    self.interval + self.threshold / 2:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                source = self._frame_source(frame)
+                with self._lock:
+                    self._samples[source] += 1
+
+    def _frame_source(self, frame) -> str:
+        """
+        Describe the stack of the running task or callback by its outermost
+        and innermost frames in package, or by its innermost frame if no
+        frame is in package.
+        """
+        inner = outer = None
+        innermost = frame
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module == 'asyncio' or module.startswith('asyncio.'):
+                break  # event loop machinery running the task
+            if module == self.package or \
+               module.startswith(self.package + '.'):
+                name = '{}.{}'.format(module, frame.f_code.co_name)
+                if inner is None:
+                    inner = name
+                outer = name
+            frame = frame.f_back
+        if inner is None:
+            return '{}.{}'.format(
+                innermost.f_globals.get('__name__', '?'),
+                innermost.f_code.co_name)
+        if inner == outer:
+            return inner
+        return '{} > {}'.format(outer, inner)
+
+    def report(self, n: int=10) -> list:
+        """
+        Top n stall sources among recent stalls by total stalled time, as
+        [(source, count, total seconds, max seconds)].
+        """
+        stats = {}
+        for _, duration, source in self.stalls:
+            count, total, longest = stats.get(source, (0, 0., 0.))
+            stats[source] = (count + 1, total + duration,
+                             max(longest, duration))
+        top = sorted(stats.items(), key=lambda kv: kv[1][1], reverse=True)
+        return [(source,) + stat for source, stat in top[:n]]
+
+    def format_report(self, n: int=10) -> str:
+        lines = ['Event loop stalls > {:.0f} ms: {}, max lag {:.0f} ms'.format(
+            self.threshold * 1e3, len(self.stalls), self.max_lag * 1e3)]
+        for source, count, total, longest in self.report(n):
+            lines.append('{:>6d} {:>10.0f} ms {:>8.0f} ms max  {}'.format(
+                count, total * 1e3, longest * 1e3, source))
+        return '\n'.join(lines)
@@ -0,0 +1,252 @@
+"""
+Wide panel view of bars of many symbols.
+
+MarketDataPanel holds each bar field of one DataType and BarSize as a 2-D
+array of time x symbol on one time axis shared by all symbols, for
+cross-sectional computations:
+
+    panel = MarketDataPanel.from_block(blk, fields=['closing'], fill='ffill')
+    corr = panel.frame('closing').pct_change().corr()
+    panel.extend(blk_new_bars)
+
+A block is laid into the arrays by binary search of its times on the union
+time axis and a scatter of its column values, without unstacking the
+MultiIndex. Rows are allocated with spare capacity, so extending by bars
+after the end of the time axis costs O(new bars).
+"""
+import logging
+import numpy as np
+import pandas as pd
+
+from .utils import timedur_standardize
+from .marketdata import MarketDataBlock
+
+
+_logger = logging.getLogger('ibstract.panel')
+__all__ = ['MarketDataPanel']
+
+
+def _ffill(arr: np.ndarray, observed: np.ndarray, prev: np.ndarray=None):
+    """
+    Fill arr in place where not observed, with the last observed value
+    above in the same column, or prev (NaN if None) if there is none.
+    """
+    nrows, ncols = arr.shape
+    if nrows == 0:
+        return
+    last = np.where(observed, np.arange(nrows)[:, None], -1)
+    np.maximum.accumulate(last, axis=0, out=last)
+    filled = arr[np.maximum(last, 0), np.arange(ncols)]
+    filled[last < 0] = np.nan
+    if prev is not None:
+        filled = np.where(last < 0, prev[None, :], filled)
+    arr[:] = filled
+
+
+class MarketDataPanel:
+    """
+    Time x symbol arrays of bar fields of one DataType and BarSize.
+
+    :param fields: Bar columns to keep, e.g. ['closing', 'volume'].
+    :param datatype, barsize: Bars of other DataType or BarSize in extended
+                              blocks are ignored. None: taken from the
+                              first block, which must then have only one.
+    :param tz: Time zone of the time axis. None: taken from the first block.
+    :param fill: Value of missing bars: None for NaN, 'ffill' for the last
+                 bar of the symbol, or a number. Values -1, which
+                 MarketDataBlock fills missing data with, are missing.
+    """
+    def __init__(self, fields: list, datatype: str=None, barsize: str=None,
+                 tz: str=None, fill=None):
+        if fill is not None and fill != 'ffill' and \
+           not isinstance(fill, (int, float)):
+            raise ValueError("fill must be None, 'ffill' or a number.")
+        self.fields = list(fields)
+        self.datatype = datatype
+        self.barsize = None if barsize is None else \
+            timedur_standardize(barsize)
+        self.tz = tz
+        self.fill = fill
+        self.symbols = []
+        self._columns = {}  # symbol: column
+        self._nrows = 0
+        self._times = np.empty(0, dtype=np.int64)  # UTC ns, with capacity
+        self._values = {}  # field: array with row capacity
+        self._dtypes = {}  # field: float32 if so in the first block
+        self._observed = {}  # field: bool array, for fill='ffill'
+
+    @classmethod
+    def from_block(cls, blk: MarketDataBlock, fields: list=None,
+                   datatype: str=None, barsize: str=None, fill=None):
+        """Build a panel from the bars of a multi-symbol block.
+        :param fields: None: all columns of blk.
+        """
+        if fields is None:
+            fields = list(blk.df.columns)
+        panel = cls(fields, datatype=datatype, barsize=barsize, tz=blk.tz,
+                    fill=fill)
+        return panel.extend(blk)
+
+    def __len__(self):
+        return self._nrows
+
+    @property
+    def shape(self) -> tuple:
+        return self._nrows, len(self.symbols)
+
+    @property
+    def times(self) -> pd.DatetimeIndex:
+        times = pd.DatetimeIndex(self._times[:self._nrows], tz='UTC')
+        return times if self.tz is None else times.tz_convert(self.tz)
+
+    def values(self, field: str) -> np.ndarray:
+        """Time x symbol array of field. A view, valid until next extend().
+        """
+        return self._values[field][:self._nrows]
+
+    def frame(self, field: str) -> pd.DataFrame:
+        """Time x symbol DataFrame of field, on a view of the panel array.
+        """
+        return pd.DataFrame(self.values(field), index=self.times,
+                            columns=pd.Index(self.symbols, name='Symbol'),
+                            copy=False)
+
+    @staticmethod
+    def _only_label(index: pd.MultiIndex, level: int) -> str:
+        labels = index.levels[level][np.unique(index.codes[level])]
+        if len(labels) != 1:
+            raise ValueError('Block has {} {} labels {}, specify one.'.format(
+                len(labels), index.names[level], list(labels)))
+        return labels[0]
+
+    def extend(self, blk: MarketDataBlock):
+        """
+        Add the bars of blk. New symbols are added as columns, and values
+        of an existing time and symbol are overwritten, except by -1.
+        """
+        if blk.df.empty:
+            return self
+        index = blk.df.index
+        if self.datatype is None:
+            self.datatype = self._only_label(index, 1)
+        if self.barsize is None:
+            self.barsize = self._only_label(index, 2)
+        if self.tz is None:
+            self.tz = blk.tz
+        for field in self.fields:
+            if field in blk.df.columns and field not in self._dtypes:
+                self._dtypes[field] = np.float32 \
+                    if blk.df[field].dtype == np.float32 else np.float64
+        mask = np.ones(len(index), dtype=bool)
+        for level, label in ((1, self.datatype), (2, self.barsize)):
+            code = index.levels[level].get_indexer([label])[0]
+            mask &= index.codes[level] == code
+        if not mask.any():
+            return self
+        times = index.get_level_values(MarketDataBlock.dtlevel).asi8[mask]
+
+        # Columns of symbols
+        sym_codes = index.codes[0][mask]
+        new_symbols = [sym for sym in index.levels[0][np.unique(sym_codes)]
+                       if sym not in self._columns]
+        if new_symbols:
+            self._add_columns(new_symbols)
+        level_cols = np.array([self._columns.get(sym, -1)
+                               for sym in index.levels[0]], dtype=np.intp)
+        cols = level_cols[sym_codes]
+
+        # Rows on the union time axis
+        new_times = np.unique(times)
+        old_times = self._times[:self._nrows]
+        if self._nrows == 0 or new_times[0] > old_times[-1]:
+            first_row = self._nrows
+            self._reserve(self._nrows + len(new_times))
+            self._times[self._nrows:self._nrows + len(new_times)] = new_times
+            self._nrows += len(new_times)
+        else:
+            first_row = int(old_times.searchsorted(new_times[0]))
+            union = np.union1d(old_times, new_times)
+            if len(union) > self._nrows:
+                self._relayout(union)
+        rows = self._times[:self._nrows].searchsorted(times)
+
+        for field in self.fields:
+            if field not in blk.df.columns:
+                continue
+            vals = blk.df[field].values[mask]
+            observed = vals != -1
+            arr = self._values[field]
+            arr[rows[observed], cols[observed]] = vals[observed]
+            if self.fill == 'ffill':
+                self._observed[field][rows[observed], cols[observed]] = True
+                prev = arr[first_row - 1] if first_row > 0 else None
+                _ffill(arr[first_row:self._nrows],
+                       self._observed[field][first_row:self._nrows], prev)
+        return self
+
+    @property
+    def _missing(self) -> float:
+        return self.fill if isinstance(self.fill, (int, float)) else np.nan
+
+    def _new_array(self, nrows: int, ncols: int, field: str) -> np.ndarray:
+        return np.full((nrows, ncols), self._missing,
+                       dtype=self._dtypes.get(field, np.float64))
+
+    def _reserve(self, nrows: int):
+        """Grow row capacity to at least nrows, doubling it.
+        """
+        capacity = len(self._times)
+        if nrows <= capacity:
+            return
+        capacity = max(nrows, 2 * capacity, 64)
+        times = np.empty(capacity, dtype=np.int64)
+        times[:self._nrows] = self._times[:self._nrows]
+        self._times = times
+        ncols = len(self.symbols)
+        for field in self.fields:
+            arr = self._new_array(capacity, ncols, field)
+            if field in self._values:
+                arr[:self._nrows] = self._values[field][:self._nrows]
+            self._values[field] = arr
+            if self.fill == 'ffill':
+                observed = np.zeros((capacity, ncols), dtype=bool)
+                if field in self._observed:
+                    observed[:self._nrows] = \
+                        self._observed[field][:self._nrows]
+                self._observed[field] = observed
+
+    def _add_columns(self, symbols: list):
+        ncols = len(self.symbols) + len(symbols)
+        capacity = len(self._times)
+        for field in self.fields:
+            arr = self._new_array(capacity, ncols, field)
+            if field in self._values:
+                arr[:, :len(self.symbols)] = self._values[field]
+            self._values[field] = arr
+            if self.fill == 'ffill':
+                observed = np.zeros((capacity, ncols), dtype=bool)
+                if field in self._observed:
+                    observed[:, :len(self.symbols)] = self._observed[field]
+                self._observed[field] = observed
+        for sym in symbols:
+            self._columns[sym] = len(self.symbols)
+            self.symbols.append(sym)
+
+    def _relayout(self, union: np.ndarray):
+        """Move rows to their positions on the union time axis.
+        """
+        old_rows = union.searchsorted(self._times[:self._nrows])
+        nrows = self._nrows
+        self._reserve(len(union))
+        ncols = len(self.symbols)
+        capacity = len(self._times)
+        for field in self.fields:
+            arr = self._new_array(capacity, ncols, field)
+            arr[old_rows] = self._values[field][:nrows]
+            self._values[field] = arr
+            if self.fill == 'ffill':
+                observed = np.zeros((capacity, ncols), dtype=bool)
+                observed[old_rows] = self._observed[field][:nrows]
+                self._observed[field] = observed
+        self._times[:len(union)] = union
+        self._nrows = len(union)
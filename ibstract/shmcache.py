@@ -0,0 +1,458 @@
+"""
+Host-local cache of historical bars in shared memory.
+
+Processes on a host using a SharedBarCache of the same name share one copy
+of the bars of each (SecType, Symbol, DataType, BarSize). The first process
+requesting data fills the cache by get_hist_data(), and the others attach
+to the same read-only column arrays, so memory does not grow with the
+number of processes:
+
+    cache = SharedBarCache('ibstract')
+    blk = await cache.get_hist_data(req, broker, store=store)
+
+Each cached series is a shared memory segment holding its time axis, index
+codes and columns, so a block is rebuilt around the segment without
+copying. A small shared index, guarded by a file lock, records the time
+range each segment covers and which processes have it attached. A segment
+replaced by a wider range is unlinked when the last process holding its
+arrays drops them, or exits.
+
+Requires Python 3.8+ for multiprocessing.shared_memory, and fcntl, which
+Windows lacks.
+"""
+import logging
+import os
+import json
+import struct
+import tempfile
+import threading
+import weakref
+import asyncio
+from collections import deque
+from datetime import datetime
+import numpy as np
+import pandas as pd
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .marketdata import MarketDataBlock, HistDataReq
+from .marketdata import get_hist_data, hist_data_req_start_end
+from .marketdata import hist_data_req_xchg_tz
+
+
+_logger = logging.getLogger('ibstract.shmcache')
+__all__ = ['SharedBarCache']
+
+
+ALIGN = 64
+
+
+def _open_shm(name: str, create: bool=False, size: int=0):
+    """
+    Open a shared memory segment not tracked by the resource tracker, which
+    would unlink it when this process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size,
+                                          track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlink_shm(name: str):
+    try:
+        shm = _open_shm(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    if not hasattr(shm, '_track'):  # Python < 3.13 unregisters on unlink()
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _ns(dt: datetime) -> int:
+    return pd.Timestamp(dt).value
+
+
+def _codes_dtype(n: int):
+    """Dtype pandas keeps MultiIndex codes of n labels in.
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class SharedBarCache:
+    """
+    Shared memory cache of bars for the processes of a host.
+
+    :param name: Cache name. Processes using the same name share the cache.
+    :param index_size: Bytes of the shared index segment.
+    :param poll_interval: Seconds between checks while another process is
+                          filling a requested series.
+    """
+    def __init__(self, name: str='ibstract', index_size: int=1 << 20,
+                 poll_interval: float=0.2):
+        if shared_memory is None:
+            raise ImportError('SharedBarCache requires Python 3.8+.')
+        if fcntl is None:
+            raise ImportError('SharedBarCache requires fcntl, not available '
+                              'on this platform.')
+        self.name = name
+        self.index_size = index_size
+        self.poll_interval = poll_interval
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(
+            tempfile.gettempdir(), '{}.shmcache.lock'.format(name)), 'a+')
+        self._index_shm = None
+        self._bases = weakref.WeakValueDictionary()  # segment: base array
+        self._detached = deque()  # segments whose arrays were collected
+        self._fills = {}  # key: future of the fill by a coroutine of ours
+
+    @staticmethod
+    def _key(sectype: str, symbol: str, datatype: str, barsize: str) -> str:
+        return '{}:{}:{}:{}'.format(sectype, symbol, datatype, barsize)
+
+    def _transact(self, func):
+        """
+        Run func(index) with the shared index locked, and save the index
+        afterwards. Processes no longer alive are pruned first.
+        """
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                self._prune(index)
+                while self._detached:
+                    self._release(index, self._detached.popleft())
+                ret = func(index)
+                self._write_index(index)
+                return ret
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self) -> dict:
+        if self._index_shm is None:
+            try:
+                self._index_shm = _open_shm(self.name + '_index')
+            except FileNotFoundError:
+                self._index_shm = _open_shm(self.name + '_index', create=True,
+                                            size=self.index_size)
+                self._index_shm.buf[:4] = struct.pack('<I', 0)
+        buf = self._index_shm.buf
+        size = struct.unpack_from('<I', buf)[0]
+        if size == 0:
+            return {'seq': 0, 'entries': {}, 'segments': {}, 'filling': {}}
+        return json.loads(bytes(buf[4:4 + size]).decode())
+
+    def _write_index(self, index: dict):
+        data = json.dumps(index).encode()
+        if len(data) + 4 > self._index_shm.size:
+            raise ValueError('SharedBarCache index exceeds {} bytes.'.format(
+                self._index_shm.size))
+        self._index_shm.buf[4:4 + len(data)] = data
+        self._index_shm.buf[:4] = struct.pack('<I', len(data))
+
+    @staticmethod
+    def _prune(index: dict):
+        for segment in list(index['segments']):
+            refs = index['segments'][segment]['refs']
+            for pid in [pid for pid in refs if not _pid_alive(int(pid))]:
+                del refs[pid]
+            SharedBarCache._unlink_if_unused(index, segment)
+        for key, pid in list(index['filling'].items()):
+            if not _pid_alive(pid):
+                del index['filling'][key]
+
+    @staticmethod
+    def _unlink_if_unused(index: dict, segment: str):
+        seg = index['segments'][segment]
+        if not seg['live'] and not seg['refs']:
+            _unlink_shm(segment)
+            del index['segments'][segment]
+
+    def entries(self) -> list:
+        """
+        Cached series as [(key, start, end, number of bars, number of
+        processes attached)]. key is 'SecType:Symbol:DataType:BarSize'.
+        """
+        def entries(index):
+            return [(key, pd.Timestamp(e['start'], tz='UTC'),
+                     pd.Timestamp(e['end'], tz='UTC'), e['n'],
+                     len(index['segments'][e['segment']]['refs']))
+                    for key, e in sorted(index['entries'].items())]
+        return self._transact(entries)
+
+    def get(self, sectype: str, symbol: str, datatype: str, barsize: str,
+            start: datetime, end: datetime) -> MarketDataBlock:
+        """
+        Return a block of the cached bars between start and end, both
+        included, or None if the cached range does not cover them. Bar
+        columns are read-only views of shared memory, held attached until
+        they are garbage collected.
+        """
+        key = self._key(sectype, symbol, datatype, barsize)
+        start_ns, end_ns = _ns(start), _ns(end)
+
+        def lookup(index):
+            entry = index['entries'].get(key)
+            if entry is None or entry['start'] > start_ns or \
+               entry['end'] < end_ns:
+                return None
+            segment = entry['segment']
+            base = self._bases.get(segment)
+            if base is None:
+                refs = index['segments'][segment]['refs']
+                refs[str(self._pid)] = refs.get(str(self._pid), 0) + 1
+            return segment, base
+
+        found = self._transact(lookup)
+        if found is None:
+            return None
+        return self._attach(*found).slice(start, end)
+
+    def _attach(self, segment: str, base: np.ndarray) -> MarketDataBlock:
+        if base is None:
+            shm = _open_shm(segment)
+            base = np.ndarray((shm.size,), np.uint8, buffer=shm.buf)
+            base.flags.writeable = False
+            weakref.finalize(base, self._detach, segment, shm)
+            self._bases[segment] = base
+        header_len = struct.unpack_from('<Q', base)[0]
+        header = json.loads(bytes(base[8:8 + header_len]).decode())
+        n = header['n']
+
+        def view(dtype, offset):
+            dtype = np.dtype(dtype)
+            return base[offset:offset + n * dtype.itemsize].view(dtype)
+
+        zeros = view(np.int8, header['zeros'])
+        times = pd.DatetimeIndex(pd.arrays.DatetimeArray(
+            view(np.int64, header['times']).view('M8[ns]'),
+            dtype=pd.DatetimeTZDtype(tz=header['tz'])))
+        index = pd.MultiIndex(
+            levels=[[label] for label in header['labels']] + [times],
+            codes=[zeros] * 3 + [view(*header['codes'])],
+            names=MarketDataBlock.data_index, verify_integrity=False)
+        blk = MarketDataBlock(None)
+        blk.df = pd.DataFrame({col: view(dtype, offset)
+                               for col, dtype, offset in header['cols']},
+                              index=index, copy=False)
+        return blk
+
+    def _detach(self, segment: str, shm):
+        """
+        Called when the arrays of an attached segment are collected. The
+        reference is released by the next index transaction, at once if
+        the index is not locked by this process, e.g. collected amid one.
+        """
+        shm.close()
+        self._detached.append(segment)
+        if self._lock.acquire(blocking=False):
+            self._lock.release()
+            try:
+                self._transact(lambda index: None)
+            except Exception as e:
+                _logger.warning('Detaching %s failed: %r', segment, e)
+
+    def _release(self, index: dict, segment: str):
+        seg = index['segments'].get(segment)
+        if seg is None:
+            return
+        refs = seg['refs']
+        count = refs.get(str(self._pid), 0) - 1
+        if count > 0:
+            refs[str(self._pid)] = count
+        else:
+            refs.pop(str(self._pid), None)
+        self._unlink_if_unused(index, segment)
+
+    def put(self, sectype: str, blk: MarketDataBlock, start: datetime,
+            end: datetime):
+        """
+        Cache the bars of blk, covering the range from start to end. blk
+        must hold a single Symbol, DataType and BarSize. If the cached
+        range of the series overlaps, the cached and new bars are combined
+        and the range extended, otherwise the new range replaces it.
+        """
+        index = blk.df.index
+        labels = []
+        for level in range(MarketDataBlock.dtlevel):
+            level_labels = index.levels[level][np.unique(index.codes[level])]
+            if len(level_labels) != 1:
+                raise ValueError('Block must have one {}, got {}.'.format(
+                    index.names[level], list(level_labels)))
+            labels.append(level_labels[0])
+        key = self._key(sectype, *labels)
+        start_ns, end_ns = _ns(start), _ns(end)
+        cached = self._transact(lambda idx: idx['entries'].get(key))
+        if cached is not None and cached['start'] <= end_ns and \
+           start_ns <= cached['end']:
+            blk_cached = self.get(sectype, *labels,
+                                  pd.Timestamp(cached['start'], tz='UTC'),
+                                  pd.Timestamp(cached['end'], tz='UTC'))
+            if blk_cached is not None:
+                blk_new = MarketDataBlock(None)
+                blk_new.df = blk_cached.df
+                blk_new.combine(blk)
+                blk = blk_new
+                start_ns = min(start_ns, cached['start'])
+                end_ns = max(end_ns, cached['end'])
+        segment, n = self._write_segment(sectype, blk, labels)
+
+        def publish(index):
+            old = index['entries'].get(key)
+            index['entries'][key] = {'segment': segment, 'start': start_ns,
+                                     'end': end_ns, 'n': n}
+            index['segments'][segment] = {'live': True, 'refs': {}}
+            if old is not None:
+                index['segments'][old['segment']]['live'] = False
+                self._unlink_if_unused(index, old['segment'])
+        self._transact(publish)
+
+    def _write_segment(self, sectype: str, blk: MarketDataBlock,
+                       labels: list) -> tuple:
+        df = blk.df
+        n = len(df)
+        times = df.index.get_level_values(MarketDataBlock.dtlevel)
+        arrays = [('times', times.asi8),
+                  ('codes', np.arange(n, dtype=_codes_dtype(n))),
+                  ('zeros', np.zeros(n, dtype=np.int8))]
+        arrays += [(col, df[col].values) for col in df.columns]
+        header = {'n': n, 'tz': str(blk.tz), 'labels': labels, 'cols': []}
+        offset = ALIGN * 64  # room for the header
+        layout = []
+        for name, values in arrays:
+            layout.append((name, values, offset))
+            offset += -(-values.nbytes // ALIGN) * ALIGN
+            if name == 'codes':
+                header['codes'] = [values.dtype.str, layout[-1][2]]
+            elif name in ('times', 'zeros'):
+                header[name] = layout[-1][2]
+            else:
+                header['cols'].append([name, values.dtype.str, layout[-1][2]])
+        header_bytes = json.dumps(header).encode()
+        if len(header_bytes) + 8 > ALIGN * 64:
+            raise ValueError('Too many columns to cache.')
+
+        segment = self._transact(self._next_segment)
+        shm = _open_shm(segment, create=True, size=max(offset, 1))
+        try:
+            buf = np.ndarray((shm.size,), np.uint8, buffer=shm.buf)
+            buf[:8] = np.frombuffer(struct.pack('<Q', len(header_bytes)),
+                                    np.uint8)
+            buf[8:8 + len(header_bytes)] = np.frombuffer(header_bytes,
+                                                         np.uint8)
+            for _, values, offset in layout:
+                buf[offset:offset + values.nbytes] = \
+                    np.ascontiguousarray(values).view(np.uint8)
+            del buf
+        finally:
+            shm.close()
+        return segment, n
+
+    def _next_segment(self, index: dict) -> str:
+        index['seq'] += 1
+        return '{}_{}'.format(self.name, index['seq'])
+
+    async def get_hist_data(self, req: HistDataReq, broker: object,
+                            store: object=None, wait: float=600.,
+                            **kwargs) -> MarketDataBlock:
+        """
+        Return bars of req from the cache, or else get them by
+        ibstract.get_hist_data(req, broker, store=store, **kwargs) and
+        cache them. While another process or coroutine fills the same
+        series, wait up to wait seconds for it instead of requesting the
+        data too. Data got with failed ranges, see HistDataIncomplete, is
+        not cached.
+        """
+        if store is None and kwargs.get('mysql') is None:
+            xchg_tz = await broker.hist_data_req_timezone(req)
+        else:
+            xchg_tz = await hist_data_req_xchg_tz(req, broker, store)
+        start, end, _ = hist_data_req_start_end(req, xchg_tz)
+        key_args = (req.SecType, req.Symbol, req.DataType, req.BarSize)
+        key = self._key(*key_args)
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + wait
+        fill = None
+        while True:
+            blk = self.get(*key_args, start, end)
+            if blk is not None:
+                return self._in_tz(blk, xchg_tz)
+            running = self._fills.get(key)
+            if running is not None:
+                # Claims are per process, so wait for our own filler.
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                await asyncio.wait([running], timeout=timeout)
+                continue
+
+            def claim(index):
+                if index['filling'].get(key, self._pid) != self._pid:
+                    return False
+                index['filling'][key] = self._pid
+                return True
+            if self._transact(claim) or loop.time() > deadline:
+                fill = self._fills[key] = loop.create_future()
+                break
+            await asyncio.sleep(self.poll_interval)
+
+        def unclaim(index):
+            if index['filling'].get(key) == self._pid:
+                del index['filling'][key]
+        try:
+            blk = await get_hist_data(req, broker, store=store, **kwargs)
+            if len(blk):
+                self.put(req.SecType, blk, start, end)
+        finally:
+            if fill is not None:
+                # Release the claim once our fill is done.
+                self._transact(unclaim)
+                del self._fills[key]
+                fill.set_result(None)
+        blk_cached = self.get(*key_args, start, end)
+        if blk_cached is None:
+            return blk
+        return self._in_tz(blk_cached, xchg_tz)
+
+    @staticmethod
+    def _in_tz(blk: MarketDataBlock, tz) -> MarketDataBlock:
+        # Bars are cached in the exchange time zone, so this rarely copies.
+        if str(blk.tz) != str(tz):
+            blk.tz_convert(tz)
+        return blk
+
+    def destroy(self):
+        """Unlink all segments of the cache and its index, attached or not.
+        """
+        def destroy(index):
+            for segment in index['segments']:
+                _unlink_shm(segment)
+            index.update(entries={}, segments={}, filling={})
+        self._transact(destroy)
+        with self._lock:
+            self._index_shm.close()
+            self._index_shm = None
+            _unlink_shm(self.name + '_index')
@@ -0,0 +1,412 @@
+"""
+Storage backends caching historical market data.
+- MySQLStore: MySQL database through aiomysql, in the original or the compact
+  schema (ibstract.compactdb).
+- SQLiteStore: Embedded SQLite database file in WAL mode through aiosqlite,
+  needing no database server.
+- MirroredStore: A primary store whose inserts are also written to mirror
+  stores, e.g. ibstract.analytics.DuckDBStore.
+"""
+import logging
+import abc
+import asyncio
+import sqlite3
+from datetime import datetime
+import pytz
+import numpy as np
+import pandas as pd
+import pymysql
+from aiomysql.sa import create_engine as aio_create_engine
+from sqlalchemy import Table, Column, MetaData
+from sqlalchemy import String, Float, DateTime
+from sqlalchemy.dialects.mysql import INTEGER as mysqlINTEGER
+from sqlalchemy.dialects.mysql import VARCHAR as mysqlVARCHAR
+from sqlalchemy.sql import and_, bindparam
+
+from .utils import SEC_TYPES
+from .compactdb import query_compact, insert_compact
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+_logger = logging.getLogger('ibstract.storage')
+__all__ = ['HistDataStore', 'MySQLStore', 'SQLiteStore', 'MirroredStore']
+
+
+BAR_COLUMNS = ['opening', 'high', 'low', 'closing', 'volume', 'barcount',
+               'average']
+
+
+class HistDataStore(abc.ABC):
+    """
+    Common interface for historical data storage backends.
+
+    Data is exchanged as pandas.DataFrame with columns Symbol, DataType,
+    BarSize, TickerTime and bar columns. TickerTime is in UTC, and may be
+    naive in query results.
+    """
+    # Exceptions worth retrying an operation for.
+    transient_errors = ()
+
+    @abc.abstractmethod
+    async def query(self, sectype: str, symbol: str, datatype: str,
+                    barsize: str, start: datetime,
+                    end: datetime) -> pd.DataFrame:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def insert(self, sectype: str, df: pd.DataFrame):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def close(self):
+        raise NotImplementedError
+
+    async def query_contract_tz(self, sectype: str, symbol: str,
+                                exchange: str, currency: str) -> str:
+        """
+        Return the stored exchange time zone name of a contract, or None.
+        Stores without contract metadata always return None.
+        """
+        return None
+
+    async def insert_contract_tz(self, sectype: str, symbol: str,
+                                 exchange: str, currency: str, tz: str):
+        """Store the exchange time zone name of a contract.
+        """
+        pass
+
+
+def _gen_sa_contracts_table(metadata=None):
+    """Generate SQLAlchemy Table object of contract metadata.
+    """
+    if metadata is None:
+        metadata = MetaData()
+    return Table(
+        'Contracts', metadata,
+        Column('SecType', String(20), primary_key=True),
+        Column('Symbol', String(20), primary_key=True),
+        Column('Exchange', String(20), primary_key=True),
+        Column('Currency', String(10), primary_key=True),
+        Column('TimeZone', String(40), nullable=False),
+    )
+
+
+# SQLite DDL of contract metadata, for SQLite based stores.
+SQLITE_CONTRACTS_DDL = (
+    'CREATE TABLE IF NOT EXISTS Contracts ('
+    'SecType TEXT NOT NULL, Symbol TEXT NOT NULL, Exchange TEXT NOT NULL, '
+    'Currency TEXT NOT NULL, TimeZone TEXT NOT NULL, '
+    'PRIMARY KEY (SecType, Symbol, Exchange, Currency))')
+
+
+async def sqlite_query_contract_tz(conn: object, sectype: str, symbol: str,
+                                   exchange: str, currency: str) -> str:
+    async with conn.execute(
+            'SELECT TimeZone FROM Contracts WHERE SecType=? AND Symbol=? '
+            'AND Exchange=? AND Currency=?',
+            (sectype, symbol, exchange, currency)) as cur:
+        row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def sqlite_insert_contract_tz(conn: object, sectype: str, symbol: str,
+                                    exchange: str, currency: str, tz: str):
+    await conn.execute(
+        'INSERT OR REPLACE INTO Contracts (SecType, Symbol, Exchange, '
+        'Currency, TimeZone) VALUES (?, ?, ?, ?, ?)',
+        (sectype, symbol, exchange, currency, tz))
+    await conn.commit()
+
+
+def _gen_sa_table(sectype, metadata=None):
+    """Generate SQLAlchemy Table object by sectype.
+    """
+    if metadata is None:
+        metadata = MetaData()
+    table = Table(
+        sectype, metadata,
+        Column('Symbol', String(20), primary_key=True),
+        Column('DataType', String(20), primary_key=True),
+        # Case-sensitive, not to confuse '1M' month bars with '1m'.
+        Column('BarSize', mysqlVARCHAR(10, binary=True), primary_key=True),
+        Column('TickerTime', DateTime(), primary_key=True),
+        Column('opening', Float(10, 2)),
+        Column('high', Float(10, 2)),
+        Column('low', Float(10, 2)),
+        Column('closing', Float(10, 2)),
+        Column('volume', mysqlINTEGER(unsigned=True)),
+        Column('barcount', mysqlINTEGER(unsigned=True)),
+        Column('average', Float(10, 2))
+    )
+    return table
+
+
+# Registry of Table objects by sectype, and cache of compiled SQL strings,
+# shared by all MySQLStore objects. Building and compiling statements anew
+# for each query costs more CPU on the event loop than the query itself.
+_sa_metadata = MetaData()
+_sa_tables = {}
+_sa_compiled = {}
+
+
+def sa_table(sectype: str) -> Table:
+    """Return the cached SQLAlchemy Table object of sectype.
+    """
+    try:
+        return _sa_tables[sectype]
+    except KeyError:
+        table = _sa_tables[sectype] = _gen_sa_table(sectype, _sa_metadata)
+        return table
+
+
+def _gen_select_stmt(sectype: str):
+    table = sa_table(sectype)
+    return table.select().where(
+        and_(
+            table.c.Symbol == bindparam('Symbol'),
+            table.c.DataType == bindparam('DataType'),
+            table.c.BarSize == bindparam('BarSize'),
+            table.c.TickerTime.between(bindparam('start'), bindparam('end'))
+        )
+    )
+
+
+def _gen_insert_stmt(sectype: str, columns: tuple):
+    table = sa_table(sectype)
+    return table.insert().prefix_with('IGNORE').values(
+        {col: bindparam(col) for col in columns})
+
+
+def _compiled_sql(key: tuple, dialect: object, gen_stmt, *args) -> str:
+    """
+    Return SQL string of statement gen_stmt(*args) compiled for dialect,
+    compiling only on the first call for key and dialect.
+    """
+    try:
+        return _sa_compiled[key, dialect]
+    except KeyError:
+        sql = str(gen_stmt(*args).compile(dialect=dialect))
+        _sa_compiled[key, dialect] = sql
+        return sql
+
+
+class MySQLStore(HistDataStore):
+    """
+    MySQL storage through an aiomysql.sa engine. Tables are created by
+    ibstract.init_db(). If compact is True, the compact schema of
+    ibstract.compactdb is used.
+    """
+    transient_errors = (pymysql.err.OperationalError,
+                        pymysql.err.InterfaceError)
+
+    def __init__(self, engine: object, compact: bool=False,
+                 own_engine: bool=False):
+        self.engine = engine
+        self.compact = compact
+        self._own_engine = own_engine
+
+    @classmethod
+    async def create(cls, mysql: dict):
+        """
+        Create a store with its own engine.
+        :param mysql: {'host': str, 'user': str, 'password': str, 'db': str,
+                       'loop': asyncio.BaseEventLoop, 'compact': bool}
+        """
+        engine = await aio_create_engine(
+            host=mysql['host'], user=mysql['user'],
+            password=mysql['password'], db=mysql['db'],
+            loop=mysql.get('loop'))
+        return cls(engine, compact=mysql.get('compact', False),
+                   own_engine=True)
+
+    async def query(self, sectype, symbol, datatype, barsize, start, end):
+        if self.compact:
+            return await query_compact(
+                self.engine, sectype, symbol, datatype, barsize,
+                int(start.timestamp()), int(end.timestamp()))
+        sql = _compiled_sql(
+            ('select', sectype), self.engine.dialect, _gen_select_stmt,
+            sectype)
+        async with self.engine.acquire() as conn:
+            result = await conn.execute(sql, {
+                'Symbol': symbol, 'DataType': datatype, 'BarSize': barsize,
+                'start': start.astimezone(pytz.UTC),
+                'end': end.astimezone(pytz.UTC)})
+            rows = await result.fetchall()
+        return pd.DataFrame([tuple(r) for r in rows],
+                            columns=sa_table(sectype).columns.keys())
+
+    async def insert(self, sectype, df):
+        if df.empty:
+            return
+        if self.compact:
+            return await insert_compact(self.engine, sectype, df)
+        records = df.to_dict('records')
+        for r in records:
+            r['TickerTime'] = r['TickerTime'].to_pydatetime()
+        columns = tuple(df.columns)
+        sql = _compiled_sql(
+            ('insert', sectype, columns), self.engine.dialect,
+            _gen_insert_stmt, sectype, columns)
+        async with self.engine.acquire() as conn:
+            # pymysql batches executemany() of INSERT ... VALUES to
+            # multiple-row INSERT statements.
+            await conn.execute(sql, records)
+            # github.com/aio-libs/aiomysql/issues/70
+            await conn.execute('commit')
+
+    async def query_contract_tz(self, sectype, symbol, exchange, currency):
+        async with self.engine.acquire() as conn:
+            result = await conn.execute(
+                'SELECT TimeZone FROM Contracts WHERE SecType=%s AND '
+                'Symbol=%s AND Exchange=%s AND Currency=%s',
+                (sectype, symbol, exchange, currency))
+            row = await result.fetchone()
+        return row[0] if row else None
+
+    async def insert_contract_tz(self, sectype, symbol, exchange, currency,
+                                 tz):
+        async with self.engine.acquire() as conn:
+            await conn.execute(
+                'REPLACE INTO Contracts (SecType, Symbol, Exchange, '
+                'Currency, TimeZone) VALUES (%s, %s, %s, %s, %s)',
+                (sectype, symbol, exchange, currency, tz))
+            await conn.execute('commit')
+
+    async def close(self):
+        if self._own_engine:
+            self.engine.close()
+            await self.engine.wait_closed()
+
+
+class SQLiteStore(HistDataStore):
+    """
+    Embedded SQLite storage in WAL mode, one table per sectype, with
+    TickerTime stored as UTC epoch seconds. Requires aiosqlite.
+
+    Usage:
+        store = await SQLiteStore.open('ibstract.db')
+        blk = await get_hist_data(req, broker, store=store)
+        await store.close()
+    """
+    transient_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path: str):
+        if aiosqlite is None:
+            raise ImportError('SQLiteStore requires aiosqlite.')
+        self.path = path
+        self.conn = None
+
+    @classmethod
+    async def open(cls, path: str):
+        """Open or create a database file, and create tables if not exist.
+        """
+        store = cls(path)
+        store.conn = await aiosqlite.connect(path)
+        await store.conn.execute('PRAGMA journal_mode=WAL')
+        await store.conn.execute('PRAGMA synchronous=NORMAL')
+        for sectype in SEC_TYPES:
+            await store.conn.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" ('
+                'Symbol TEXT NOT NULL, DataType TEXT NOT NULL, '
+                'BarSize TEXT NOT NULL, TickerTime INTEGER NOT NULL, '
+                'opening REAL, high REAL, low REAL, closing REAL, '
+                'volume INTEGER, barcount INTEGER, average REAL, '
+                'PRIMARY KEY (Symbol, DataType, BarSize, TickerTime)'
+                ') WITHOUT ROWID'.format(sectype))
+        await store.conn.execute(SQLITE_CONTRACTS_DDL)
+        await store.conn.commit()
+        return store
+
+    async def query_contract_tz(self, sectype, symbol, exchange, currency):
+        return await sqlite_query_contract_tz(
+            self.conn, sectype, symbol, exchange, currency)
+
+    async def insert_contract_tz(self, sectype, symbol, exchange, currency,
+                                 tz):
+        await sqlite_insert_contract_tz(
+            self.conn, sectype, symbol, exchange, currency, tz)
+
+    async def query(self, sectype, symbol, datatype, barsize, start, end):
+        sql = ('SELECT TickerTime, {} FROM "{}" WHERE Symbol=? AND '
+               'DataType=? AND BarSize=? AND TickerTime BETWEEN ? AND ? '
+               'ORDER BY TickerTime').format(', '.join(BAR_COLUMNS), sectype)
+        # Clamp to datetime range of pandas.Timestamp.
+        start_epoch = max(int(start.timestamp()), -2**33)
+        end_epoch = min(int(end.timestamp()), 2**33)
+        async with self.conn.execute(sql, (
+                symbol, datatype, barsize, start_epoch, end_epoch)) as cur:
+            rows = await cur.fetchall()
+        df = pd.DataFrame(rows, columns=['TickerTime'] + BAR_COLUMNS)
+        df['TickerTime'] = pd.to_datetime(
+            df['TickerTime'].astype(np.int64), unit='s', utc=True)
+        df.insert(0, 'BarSize', barsize)
+        df.insert(0, 'DataType', datatype)
+        df.insert(0, 'Symbol', symbol)
+        return df
+
+    async def insert(self, sectype, df):
+        if df.empty:
+            return
+        cols = ['Symbol', 'DataType', 'BarSize'] + [
+            col for col in BAR_COLUMNS if col in df.columns]
+        rows = df[cols].copy()
+        rows.insert(3, 'TickerTime',
+                    pd.DatetimeIndex(df['TickerTime']).asi8 // 10**9)
+        sql = 'INSERT OR IGNORE INTO "{}" ({}) VALUES ({})'.format(
+            sectype, ', '.join(rows.columns), ', '.join('?' * rows.shape[1]))
+        await self.conn.executemany(
+            sql, rows.astype(object).values.tolist())
+        await self.conn.commit()
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+
+class MirroredStore(HistDataStore):
+    """
+    Queries go to the primary store. Inserts go to the primary store, then
+    concurrently to all mirrors, so mirrors hold everything cached through
+    this store.
+    """
+    def __init__(self, primary: HistDataStore, *mirrors: HistDataStore):
+        self.primary = primary
+        self.mirrors = mirrors
+        self.transient_errors = primary.transient_errors
+
+    async def query(self, sectype, symbol, datatype, barsize, start, end):
+        return await self.primary.query(
+            sectype, symbol, datatype, barsize, start, end)
+
+    async def insert(self, sectype, df):
+        await self.primary.insert(sectype, df)
+        await asyncio.gather(*(m.insert(sectype, df) for m in self.mirrors))
+
+    async def query_contract_tz(self, sectype, symbol, exchange, currency):
+        return await self.primary.query_contract_tz(
+            sectype, symbol, exchange, currency)
+
+    async def insert_contract_tz(self, sectype, symbol, exchange, currency,
+                                 tz):
+        for store in (self.primary,) + self.mirrors:
+            await store.insert_contract_tz(
+                sectype, symbol, exchange, currency, tz)
+
+    async def close(self):
+        for store in (self.primary,) + self.mirrors:
+            await store.close()
+
+
+def as_hist_data_store(engine: object, compact: bool=False) -> HistDataStore:
+    """
+    Return engine if it is a HistDataStore, or wrap an aiomysql.sa engine in
+    a MySQLStore.
+    """
+    if isinstance(engine, HistDataStore):
+        return engine
+    return MySQLStore(engine, compact=compact)
@@ -0,0 +1,228 @@
+"""
+Real-time tick ingestion.
+- Buffering streaming ticks in compact typed arrays.
+- Building bars from tick batches with vectorized numpy reductions.
+"""
+import logging
+import numpy as np
+import pandas as pd
+
+from .ibglobals import IB_TICK_TYPES
+from .utils import timedur_standardize, timedur_to_timedelta
+from .marketdata import MarketDataBlock
+
+
+_logger = logging.getLogger('ibstract.ticks')
+__all__ = ['TICK_DTYPE', 'TickBuffer', 'TickIngestor', 'ticks_to_bars']
+
+
+# One tick: epoch nanoseconds, IB tick type id, price, size.
+TICK_DTYPE = np.dtype([('time', 'i8'), ('ticktype', 'i2'),
+                       ('price', 'f8'), ('size', 'f8')])
+
+# Price tick type building bars for each data type.
+TICK_DATATYPES = {
+    'TRADES': int(IB_TICK_TYPES.index[IB_TICK_TYPES.Name == 'LAST_PRICE'][0]),
+    'BID': int(IB_TICK_TYPES.index[IB_TICK_TYPES.Name == 'BID_PRICE'][0]),
+    'ASK': int(IB_TICK_TYPES.index[IB_TICK_TYPES.Name == 'ASK_PRICE'][0]),
+}
+
+
+def _barsize_ns(barsize: str) -> int:
+    barsize = timedur_standardize(barsize)
+    if barsize[-1] not in ('s', 'm', 'h'):
+        raise ValueError('Tick bars support BarSize in s/m/h only.')
+    return int(timedur_to_timedelta(barsize).total_seconds()) * 10**9
+
+
+class TickBuffer:
+    """
+    Preallocated buffer of ticks in a numpy structured array of TICK_DTYPE.
+    The array grows by doubling, so appending is amortized O(1).
+    """
+    def __init__(self, capacity: int=65536):
+        self._data = np.empty(capacity, dtype=TICK_DTYPE)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def ticks(self) -> np.ndarray:
+        """View of the buffered ticks, without copying."""
+        return self._data[:self._n]
+
+    def _reserve(self, n: int):
+        if self._n + n > len(self._data):
+            capacity = max(2 * len(self._data), self._n + n)
+            data = np.empty(capacity, dtype=TICK_DTYPE)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+
+    def append(self, time: int, ticktype: int, price: float, size: float):
+        """Append a single tick. time is in epoch nanoseconds."""
+        if self._n == len(self._data):
+            self._reserve(1)
+        self._data[self._n] = (time, ticktype, price, size)
+        self._n += 1
+
+    def extend(self, ticks: np.ndarray):
+        """Append an array of ticks of TICK_DTYPE."""
+        n = len(ticks)
+        self._reserve(n)
+        self._data[self._n:self._n+n] = ticks
+        self._n += n
+
+    def sort(self):
+        """Sort buffered ticks by time in place, if out of order."""
+        ticks = self.ticks
+        if (np.diff(ticks['time']) < 0).any():
+            ticks[:] = ticks[np.argsort(ticks['time'], kind='mergesort')]
+
+    def drain(self, keep_from: int=None) -> np.ndarray:
+        """
+        Return a copy of buffered ticks and empty the buffer. If keep_from is
+        given, ticks from that position on are returned to the buffer start.
+        """
+        if keep_from is None:
+            keep_from = self._n
+        out = self._data[:keep_from].copy()
+        rest = self._n - keep_from
+        self._data[:rest] = self._data[keep_from:self._n]
+        self._n = rest
+        return out
+
+
+def ticks_to_bars(ticks: np.ndarray, symbol: str, barsize: str,
+                  datatype: str='TRADES', tz: str=None) -> MarketDataBlock:
+    """
+    Build OHLC bars from an array of TICK_DTYPE in one vectorized pass.
+    Bars are aligned to multiples of barsize since epoch. 'average' is the
+    volume-weighted price, or the mean price of bars without volume.
+    """
+    ticks = ticks[(ticks['ticktype'] == TICK_DATATYPES[datatype])
+                  & (ticks['price'] > 0)]
+    if len(ticks) == 0:
+        return MarketDataBlock(None)
+    if (np.diff(ticks['time']) < 0).any():
+        ticks = ticks[np.argsort(ticks['time'], kind='mergesort')]
+
+    bar_ns = _barsize_ns(barsize)
+    bucket = ticks['time'] // bar_ns
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(ticks)]
+    price = ticks['price']
+    size = np.nan_to_num(ticks['size'])
+    volume = np.add.reduceat(size, starts)
+    barcount = ends - starts
+    vwap = np.add.reduceat(price * size, starts) / np.where(volume, volume, 1)
+    mean = np.add.reduceat(price, starts) / barcount
+    df = pd.DataFrame({
+        'TickerTime': pd.to_datetime(bucket[starts] * bar_ns),
+        'opening': price[starts],
+        'high': np.maximum.reduceat(price, starts),
+        'low': np.minimum.reduceat(price, starts),
+        'closing': price[ends - 1],
+        'volume': volume,
+        'barcount': barcount,
+        'average': np.where(volume > 0, vwap, mean),
+    })
+    blk = MarketDataBlock(df, symbol=symbol, datatype=datatype,
+                          barsize=barsize, tz='UTC')
+    if tz is not None:
+        blk.tz_convert(tz)
+    return blk
+
+
+class TickIngestor:
+    """
+    Ingest streaming ticks per symbol, and convert them to bars in batches.
+
+    Ticks are buffered per symbol. Once a buffer reaches batch_size ticks,
+    all completed bars are built in one vectorized pass, and ticks of the
+    still open bar are kept in the buffer. Built bars are passed to
+    on_bars(blk), or combined to self.blk if on_bars is None.
+    """
+    def __init__(self, barsize: str='1m', datatype: str='TRADES',
+                 batch_size: int=10000, on_bars=None, tz: str=None):
+        if datatype not in TICK_DATATYPES:
+            raise TypeError('Invalid tick DataType: %s' % datatype)
+        self.barsize = timedur_standardize(barsize)
+        self._bar_ns = _barsize_ns(self.barsize)
+        self.datatype = datatype
+        self.batch_size = batch_size
+        self.on_bars = on_bars
+        self.tz = tz
+        self.buffers = {}
+        self._flush_at = {}
+        self.blk = MarketDataBlock(None)
+        self._tickers = {}
+
+    def add_tick(self, symbol: str, time: int, ticktype: int, price: float,
+                 size: float):
+        """Add a single tick. time is in epoch nanoseconds."""
+        buf = self.buffers.get(symbol)
+        if buf is None:
+            buf = self.buffers[symbol] = TickBuffer()
+        buf.append(time, ticktype, price, size)
+        if len(buf) >= self._flush_at.get(symbol, self.batch_size):
+            self.flush(symbol)
+
+    def add_ticks(self, symbol: str, ticks: np.ndarray):
+        """Add an array of ticks of TICK_DTYPE."""
+        buf = self.buffers.get(symbol)
+        if buf is None:
+            buf = self.buffers[symbol] = TickBuffer()
+        buf.extend(ticks)
+        if len(buf) >= self._flush_at.get(symbol, self.batch_size):
+            self.flush(symbol)
+
+    def on_tick_data(self, symbol: str, tick_data_list: list):
+        """Add a list of ib_insync TickData received from IB."""
+        if not tick_data_list:
+            return
+        ticks = np.array(
+            [(int(t.time.timestamp() * 1e9), t.tickType, t.price, t.size)
+             for t in tick_data_list], dtype=TICK_DTYPE)
+        self.add_ticks(symbol.upper(), ticks)
+
+    def flush(self, symbol: str=None, final: bool=False):
+        """
+        Build bars from buffered ticks of symbol, or of all symbols if symbol
+        is None. Ticks in the last open bar are kept unless final is True.
+        """
+        symbols = list(self.buffers) if symbol is None else [symbol]
+        for sym in symbols:
+            buf = self.buffers.get(sym)
+            if not buf:
+                continue
+            keep_from = None
+            if not final:
+                buf.sort()
+                times = buf.ticks['time']
+                last_bar_start = times[-1] // self._bar_ns * self._bar_ns
+                keep_from = int(np.searchsorted(times, last_bar_start))
+            ticks = buf.drain(keep_from)
+            self._flush_at[sym] = len(buf) + self.batch_size
+            blk = ticks_to_bars(ticks, sym, self.barsize, self.datatype,
+                                tz=self.tz)
+            if blk.df.empty:
+                continue
+            _logger.debug('%s: %d ticks -> %d bars', sym, len(ticks), len(blk))
+            if self.on_bars is not None:
+                self.on_bars(blk)
+            else:
+                self.blk.combine(blk)
+
+    def subscribe(self, broker: object, req: object):
+        """Subscribe streaming ticks from broker for the contract of req."""
+        ticker = broker.req_ticks(req, self.on_tick_data)
+        self._tickers[req.Symbol] = ticker
+        return ticker
+
+    def unsubscribe(self, broker: object, symbol: str=None):
+        """Cancel tick subscriptions, and build bars of all buffered ticks."""
+        symbols = list(self._tickers) if symbol is None else [symbol]
+        for sym in symbols:
+            broker.cancel_ticks(self._tickers.pop(sym))
+        self.flush(symbol, final=True)
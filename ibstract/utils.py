@@ -7,7 +7,7 @@ import os
 import re
 import bisect
 import pytz
-from datetime import datetime
+from datetime import datetime, time
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 from functools import partial
@@ -17,6 +17,10 @@ NYSE_CAL = pd.to_datetime(
     pd.read_csv(os.path.join(
         os.path.dirname(os.path.abspath(__file__)), 'nyse_dates.csv'))['NYSE'])
 
+# Regular trading session in exchange local time. So far NYSE hours are used
+# for all exchanges, without early closes.
+REGULAR_SESSION = (time(9, 30), time(16, 0))
+
 SEC_TYPES = ('Stock', 'Option', 'Future', 'Forex', 'Index', 'CFD', 'Commodity',
              'Bond', 'FuturesOption', 'MutualFund', 'Warrant')
 HIST_DATA_TYPES = (
@@ -284,3 +288,19 @@ def trading_days(
         # Slicing from trading day calendar.
         trading_days = NYSE_CAL[end_idx-n_trading_days:end_idx]
     return trading_days
+
+
+def expected_bar_times(day: datetime, barsize: str, tz: pytz.tzinfo,
+                       session: tuple=REGULAR_SESSION) -> pd.DatetimeIndex:
+    """
+    Start times of intraday bars of barsize expected in the regular trading
+    session of day. Bars are aligned to the clock from midnight, as IB bars
+    including data outside regular trading hours, so the first bar may start
+    before the session opens.
+    """
+    bar = timedur_to_timedelta(barsize)
+    midnight = datetime.combine(day, time.min)
+    first = midnight + (
+        datetime.combine(day, session[0]) - midnight) // bar * bar
+    n_bars = -(-(datetime.combine(day, session[1]) - first) // bar)
+    return pd.date_range(first, periods=n_bars, freq=bar).tz_localize(tz)
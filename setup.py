@@ -51,8 +51,14 @@ setup(
     packages=['ibstract'],
     include_package_data=True,
     python_requires='>=3.6.0',
-    install_requires=['aiomysql>=0.0.9', 'ib_insync>=0.8.5', 'pandas>=0.20.1',
-                      'SQLAlchemy>=1.1.9', 'tzlocal>=1.4'],
+    install_requires=['aiomysql>=0.0.20', 'ib_insync>=0.9.62',
+                      'pandas>=0.24.0', 'SQLAlchemy>=1.1.9', 'tzlocal>=1.4'],
+    extras_require={'sqlite': ['aiosqlite>=0.3.0'],
+                    'analytics': ['duckdb>=0.8.0'],
+                    'arrow': ['pyarrow>=10.0']},
+    entry_points={'console_scripts': [
+        'ibstract-backfill = ibstract.backfill:main',
+        'ibstract-gateway = ibstract.gateway:main']},
     keywords=('ibapi asyncio interactive brokers async algorithmic'
               'quantitative trading finance')
 )
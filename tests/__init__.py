@@ -1,7 +1,19 @@
 from .test_brokers import *
 from .test_marketdata import *
+from .test_ticks import *
+from .test_storage import *
+from .test_chunkdb import *
+from .test_analytics import *
+from .test_monitor import *
+from .test_backfill import *
+from .test_panel import *
+from .test_arrowipc import *
+from .test_shmcache import *
+from .test_gateway import *
 
 
 __all__ = []
-for _m in [test_brokers, test_marketdata]:
+for _m in [test_brokers, test_marketdata, test_ticks, test_storage,
+           test_chunkdb, test_analytics, test_monitor, test_backfill,
+           test_panel, test_arrowipc, test_shmcache, test_gateway]:
     __all__ += _m.__all__
@@ -0,0 +1,69 @@
+"""
+Test cases for the embedded analytics backend.
+"""
+
+import unittest
+import asyncio
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import DuckDBStore, MirroredStore
+from ibstract import insert_hist_data
+from ibstract.analytics import duckdb
+from .testdata import testdata_duckdb_store
+
+
+__all__ = ['DuckDBStoreTests']
+
+
+@unittest.skipIf(duckdb is None, 'duckdb is not installed.')
+class DuckDBStoreTests(unittest.TestCase):
+    """
+    Test cases for DuckDBStore scans and resampling.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _insert(self, store):
+        async def run():
+            for df in testdata_duckdb_store['insert']:
+                await insert_hist_data(store, 'Stock', MarketDataBlock(df))
+        self.loop.run_until_complete(run())
+
+    def test_scan(self):
+        scan_parms, df_exp = testdata_duckdb_store['scan']
+        primary, duck = DuckDBStore(), DuckDBStore()
+        self._insert(MirroredStore(primary, duck))
+        for store in (primary, duck):
+            blk = self.loop.run_until_complete(store.scan(*scan_parms))
+            assert_frame_equal(blk.df, MarketDataBlock(df_exp).df)
+        self.loop.run_until_complete(primary.close())
+        self.loop.run_until_complete(duck.close())
+
+    def test_resample(self):
+        parms, tz = testdata_duckdb_store['resample']
+        duck = DuckDBStore()
+        self._insert(duck)
+        blk = self.loop.run_until_complete(duck.resample(*parms, tz=tz))
+        self.loop.run_until_complete(duck.close())
+
+        # Reference daily bars by pandas.
+        df = pd.concat(testdata_duckdb_store['insert'][:2])
+        df['TickerTime'] = pd.DatetimeIndex(
+            pd.to_datetime(df.TickerTime, utc=True)).tz_convert(tz)
+        df['Day'] = df.TickerTime.dt.floor('D')
+        df['amount'] = df.average * df.volume
+        grp = df.sort_values('TickerTime').groupby(['Symbol', 'Day'])
+        df_exp = grp.agg({'opening': 'first', 'high': 'max', 'low': 'min',
+                          'closing': 'last', 'volume': 'sum',
+                          'barcount': 'sum', 'amount': 'sum'})
+        df_exp['average'] = df_exp.pop('amount') / df_exp.volume
+        df_exp = df_exp.reset_index().rename(columns={'Day': 'TickerTime'})
+        blk_exp = MarketDataBlock(df_exp, datatype='TRADES', barsize='1d')
+        assert_frame_equal(blk.df, blk_exp.df, check_like=True)
+        self.assertTrue(np.all(blk.df.index.get_level_values(1) == 'TRADES'))
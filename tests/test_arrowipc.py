@@ -0,0 +1,74 @@
+"""
+Test cases for Arrow export and IPC of data blocks.
+"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import write_ipc_stream, read_ipc_stream, iter_ipc_stream
+from ibstract import write_ipc_file, read_ipc_file
+from ibstract.marketdata import pa, ARROW_SCHEMA
+from .testdata import testdata_arrow_ipc
+
+
+__all__ = ['ArrowIPCTests']
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed.')
+class ArrowIPCTests(unittest.TestCase):
+    """
+    Test cases for MarketDataBlock Arrow conversion, IPC streams and files.
+    """
+    def setUp(self):
+        self.blks = [MarketDataBlock(df)
+                     for df in testdata_arrow_ipc['blocks']]
+        self.blk = MarketDataBlock(None)
+        for blk in self.blks:
+            blk.tz_convert(testdata_arrow_ipc['tz'])
+            self.blk.combine(blk)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_to_from_arrow(self):
+        table = self.blk.to_arrow()
+        self.assertTrue(table.schema.equals(ARROW_SCHEMA))
+        self.assertEqual(table.schema.metadata[b'tz'], b'US/Eastern')
+        self.assertTrue(np.shares_memory(
+            table.column('closing').chunk(0).to_numpy(),
+            self.blk.df['closing'].values))
+        blk = MarketDataBlock.from_arrow(table)
+        assert_frame_equal(blk.df, self.blk.df)
+        self.assertEqual(str(blk.tz), 'US/Eastern')
+        # Missing bar columns are -1.
+        blk = MarketDataBlock(testdata_arrow_ipc['partial_columns'])
+        blk = MarketDataBlock.from_arrow(blk.to_arrow(), tz='UTC')
+        self.assertEqual(list(blk.df.columns), ARROW_SCHEMA.names[4:])
+        self.assertTrue((blk.df['opening'] == -1).all())
+        self.assertEqual(len(MarketDataBlock.from_arrow(
+            MarketDataBlock(None).to_arrow())), 0)
+
+    def test_ipc_stream(self):
+        path = os.path.join(self.tmpdir.name, 'bars.arrows')
+        write_ipc_stream(self.blks, path)
+        assert_frame_equal(read_ipc_stream(path).df, self.blk.df)
+        blks = list(iter_ipc_stream(path))
+        self.assertEqual([len(blk) for blk in blks],
+                         [len(blk) for blk in self.blks])
+        for blk, blk_exp in zip(blks, self.blks):
+            assert_frame_equal(blk.df, blk_exp.df)
+
+    def test_ipc_file(self):
+        path = os.path.join(self.tmpdir.name, 'bars.arrow')
+        write_ipc_file(self.blk, path)
+        blk = read_ipc_file(path, memory_map=False)
+        assert_frame_equal(blk.df, self.blk.df)
+        blk = read_ipc_file(path)
+        assert_frame_equal(blk.df, self.blk.df)
+        # Bar columns are views of the mapped file.
+        self.assertFalse(blk.df['closing'].values.flags.writeable)
@@ -0,0 +1,212 @@
+"""
+Test cases for the resumable universe backfill.
+"""
+
+import os
+import json
+import time
+import tempfile
+import unittest
+import asyncio
+import multiprocessing
+import pytz
+import pandas as pd
+
+from ibstract import MarketDataBlock
+from ibstract import SQLiteStore
+from ibstract import BackfillJob, read_universe
+from ibstract import BackfillCoordinator, PacingBudget
+from ibstract import query_hist_data
+from ibstract import IB
+from ibstract.marketdata import hist_data_req_start_end
+from ibstract.storage import aiosqlite
+from .testdata import testdata_backfill
+
+
+__all__ = ['BackfillJobTests', 'BackfillCoordinatorTests']
+
+
+class FakeBroker:
+    """Broker serving constant daily bars, failing for symbols in fail."""
+    def __init__(self, fail: set=()):
+        self.fail = set(fail)
+        self.reqs = []
+
+    async def hist_data_req_timezone(self, req):
+        return pytz.timezone('US/Eastern')
+
+    async def req_hist_data_async(self, *req_list):
+        blk_list = []
+        for req in req_list:
+            self.reqs.append(req)
+            if req.Symbol in self.fail:
+                raise ConnectionError('No data for ' + req.Symbol)
+            xchg_tz = await self.hist_data_req_timezone(req)
+            _, _, trd_days = hist_data_req_start_end(req, xchg_tz)
+            df = pd.DataFrame({'TickerTime': pd.DatetimeIndex(trd_days),
+                               'closing': 100., 'volume': 1000})
+            blk_list.append(MarketDataBlock(
+                df, symbol=req.Symbol, datatype=req.DataType,
+                barsize=req.BarSize, tz=xchg_tz))
+        return blk_list
+
+
+class OpenFakeWorker:
+    """open_worker of a FakeBroker and a SQLiteStore."""
+    def __init__(self, path: str, fail: set=()):
+        self.path = path
+        self.fail = fail
+
+    async def __call__(self, worker_id):
+        return FakeBroker(self.fail), await SQLiteStore.open(self.path)
+
+
+def _acquire(pacing):
+    assert pacing.try_acquire() == 0
+
+
+class BackfillJobTests(unittest.TestCase):
+    """
+    Test cases for planning, checkpointing and resuming backfills.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.universe = os.path.join(self.tmpdir.name, 'universe.txt')
+        with open(self.universe, 'w') as f:
+            f.write(testdata_backfill['universe'])
+        self.checkpoint = os.path.join(self.tmpdir.name, 'backfill.ckpt')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _job(self, barsizes):
+        data = testdata_backfill
+        return BackfillJob(read_universe(self.universe), barsizes,
+                           data['start'], data['end'], self.checkpoint,
+                           concurrency=2)
+
+    def test_plan(self):
+        data = testdata_backfill
+        chunks = self._job(data['barsizes']).plan()
+        self.assertEqual(len(chunks), data['n_chunks'])
+        self.assertEqual(len(set(chunk.key for chunk in chunks)),
+                         len(chunks))
+        self.assertEqual([tuple(chunk) for chunk in chunks[:3]],
+                         data['first_chunks'])
+
+    @unittest.skipIf(aiosqlite is None, 'aiosqlite is not installed.')
+    def test_run_resume(self):
+        async def run(broker):
+            store = await SQLiteStore.open(
+                os.path.join(self.tmpdir.name, 'ibstract_test.db'))
+            job = self._job(['1d'])
+            stats = await job.run(broker, store)
+            blk = await query_hist_data(store, 'Stock', 'BAD', 'TRADES', '1d')
+            await store.close()
+            return job, stats, blk
+
+        loop = asyncio.new_event_loop()
+        job, stats, blk = loop.run_until_complete(run(FakeBroker({'BAD'})))
+        self.assertEqual((stats['chunks'], stats['done'], stats['failed']),
+                         (3, 2, 1))
+        self.assertEqual(job.failed[0][0].req.Symbol, 'BAD')
+        with open(self.checkpoint) as f:
+            self.assertEqual(len([json.loads(line) for line in f]), 2)
+
+        # Only the failed chunk is run again.
+        broker = FakeBroker()
+        job, stats, blk = loop.run_until_complete(run(broker))
+        loop.close()
+        self.assertEqual((stats['chunks'], stats['done'], stats['failed']),
+                         (1, 1, 0))
+        self.assertEqual(set(req.Symbol for req in broker.reqs), {'BAD'})
+        self.assertEqual(stats['requests'], len(broker.reqs))
+        self.assertEqual(len(job.completed()), 3)
+        self.assertFalse(blk.df.empty)
+
+
+class BackfillCoordinatorTests(unittest.TestCase):
+    """
+    Test cases for running backfills by worker processes.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.universe = os.path.join(self.tmpdir.name, 'universe.txt')
+        with open(self.universe, 'w') as f:
+            f.write(testdata_backfill['universe'])
+        self.checkpoint = os.path.join(self.tmpdir.name, 'backfill.ckpt')
+        self.db = os.path.join(self.tmpdir.name, 'ibstract_test.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_pacing_budget(self):
+        pacing = PacingBudget(max_requests=2, period=0.5, context='fork')
+        self.assertEqual(pacing.try_acquire(), 0)
+        # The budget is shared by child processes.
+        proc = multiprocessing.get_context('fork').Process(
+            target=_acquire, args=(pacing,))
+        proc.start()
+        proc.join()
+        self.assertEqual(proc.exitcode, 0)
+        self.assertGreater(pacing.try_acquire(), 0)
+        t = time.monotonic()
+        asyncio.new_event_loop().run_until_complete(pacing.acquire_async())
+        self.assertGreater(time.monotonic() - t, 0.2)
+
+    @unittest.skipIf(aiosqlite is None, 'aiosqlite is not installed.')
+    def test_run_resume(self):
+        data = testdata_backfill
+        job = BackfillJob(read_universe(self.universe), ['1d'],
+                          data['start'], data['end'], self.checkpoint,
+                          pacing=PacingBudget(2, 0.1, context='fork'))
+        coordinator = BackfillCoordinator(
+            job, OpenFakeWorker(self.db, {'BAD'}), n_workers=2,
+            context='fork')
+        self.assertEqual([[sym for sym, *_ in universe]
+                          for universe in coordinator.partition()],
+                         [['GS', 'FB'], ['BAD']])
+        stats = coordinator.run()
+        self.assertEqual((stats['chunks'], stats['done'], stats['failed'],
+                          stats['workers'], stats['failed_workers']),
+                         (3, 2, 1, 2, 0))
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(coordinator.failed[0][0].req.Symbol, 'BAD')
+        self.assertEqual(len(job.completed()), 2)
+
+        # Only the failed chunk is run again.
+        coordinator = BackfillCoordinator(job, OpenFakeWorker(self.db),
+                                          n_workers=2, context='fork')
+        stats = coordinator.run()
+        self.assertEqual((stats['chunks'], stats['done'], stats['failed']),
+                         (1, 1, 0))
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(len(job.completed()), 3)
+
+        async def query():
+            store = await SQLiteStore.open(self.db)
+            blks = [await query_hist_data(store, 'Stock', sym, 'TRADES',
+                                          '1d') for sym in ('GS', 'FB')]
+            await store.close()
+            return blks
+
+        for blk in asyncio.new_event_loop().run_until_complete(query()):
+            self.assertFalse(blk.df.empty)
+
+    def test_pacing_context(self):
+        job = BackfillJob(read_universe(self.universe), ['1d'],
+                          testdata_backfill['start'], testdata_backfill['end'],
+                          self.checkpoint,
+                          pacing=PacingBudget(2, 0.1, context='fork'))
+        with self.assertRaises(ValueError):
+            BackfillCoordinator(job, OpenFakeWorker(self.db), context='spawn')
+
+    def test_n_workers_cap(self):
+        job = BackfillJob(read_universe(self.universe), ['1d'],
+                          testdata_backfill['start'], testdata_backfill['end'],
+                          self.checkpoint)
+        with self.assertLogs('ibstract.backfill', 'WARNING'):
+            coordinator = BackfillCoordinator(
+                job, OpenFakeWorker(self.db),
+                n_workers=len(IB.clientid_baskets) + 1)
+        self.assertEqual(coordinator.n_workers, len(IB.clientid_baskets))
@@ -0,0 +1,96 @@
+"""
+Test cases for the chunked archive storage backend.
+"""
+
+import os
+import tempfile
+import unittest
+import asyncio
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import ChunkStore
+from ibstract import query_hist_data
+from ibstract import insert_hist_data
+from ibstract import encode_chunk, decode_chunk
+from ibstract.storage import aiosqlite
+from .testdata import testdata_sqlite_store
+from .testdata import testdata_chunk_concurrent_insert
+
+
+__all__ = ['ChunkStoreTests']
+
+
+@unittest.skipIf(aiosqlite is None, 'aiosqlite is not installed.')
+class ChunkStoreTests(unittest.TestCase):
+    """
+    Test cases for per-day compressed chunk storage.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'ibstract_chunks.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_encode_decode_chunk(self):
+        epochs = np.arange(1504872000, 1504872000 + 23400, 5)
+        n = len(epochs)
+        rng = np.random.RandomState(0)
+        df = pd.DataFrame({
+            'closing': np.round(220 + rng.normal(0, 1, n), 2),
+            'volume': rng.randint(0, 10000, n),
+            'average': 220 + rng.normal(0, 1, n),
+        })
+        df.loc[3, 'average'] = np.nan
+        chunk = encode_chunk(epochs, df)
+        epochs_dec, df_dec = decode_chunk(chunk)
+        np.testing.assert_array_equal(epochs_dec, epochs)
+        assert_frame_equal(df_dec, df)
+        self.assertLess(len(chunk), df.memory_usage().sum() // 2)
+
+    def test_insert_query_hist_data(self):
+        async def run(blk_list, query_parms):
+            store = await ChunkStore.open(self.path)
+            for blk in blk_list:
+                await insert_hist_data(store, query_parms[0], blk)
+            blk_all = await query_hist_data(store, *query_parms[:4])
+            blk = await query_hist_data(store, *query_parms)
+            async with store.conn.execute(
+                    'SELECT COUNT(*) FROM StockChunks') as cur:
+                n_chunks = (await cur.fetchone())[0]
+            await store.close()
+            return blk_all, blk, n_chunks
+
+        data = testdata_sqlite_store
+        blk_list = [MarketDataBlock(df) for df in data['insert'][:2]]
+        query_parms = data['query'][1]
+        loop = asyncio.new_event_loop()
+        blk_all, blk, n_chunks = loop.run_until_complete(
+            run(blk_list, query_parms))
+        loop.close()
+        blk_source = MarketDataBlock(data['insert'][2])
+        assert_frame_equal(blk_all.df, blk_source.df)
+        assert_frame_equal(blk.df, blk_source.df.loc(axis=0)[
+            :, :, :, query_parms[-2]:query_parms[-1]])
+        n_days = pd.to_datetime(
+            data['insert'][2].TickerTime, utc=True).dt.date.nunique()
+        self.assertEqual(n_chunks, n_days)
+
+    def test_concurrent_insert(self):
+        async def run(blk_list):
+            store = await ChunkStore.open(self.path)
+            await asyncio.gather(*(insert_hist_data(store, 'Stock', blk)
+                                   for blk in blk_list))
+            blk = await query_hist_data(store, 'Stock', 'GS', 'TRADES', '1m')
+            await store.close()
+            return blk
+
+        blk_list = [MarketDataBlock(df)
+                    for df in testdata_chunk_concurrent_insert]
+        loop = asyncio.new_event_loop()
+        blk = loop.run_until_complete(run(blk_list))
+        loop.close()
+        self.assertEqual(len(blk), sum(len(b) for b in blk_list))
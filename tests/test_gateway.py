@@ -0,0 +1,122 @@
+"""
+Test cases for the local market data gateway.
+"""
+
+import os
+import tempfile
+import unittest
+import asyncio
+import ib_insync
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import GatewayServer, GatewayClient
+from ibstract import get_hist_data
+from ibstract import PacingBudget
+from ibstract.gateway import _blocks_to_wire, _blocks_from_wire
+from .test_backfill import FakeBroker
+from .testdata import testdata_gateway
+
+
+__all__ = ['GatewayTests']
+
+
+class SlowBroker(FakeBroker):
+    """FakeBroker taking a while for each download."""
+    async def req_hist_data_async(self, *req_list):
+        await asyncio.sleep(0.05)
+        return await super().req_hist_data_async(*req_list)
+
+    async def hist_data_req_contract_details(self, req):
+        return [ib_insync.ContractDetails(
+            contract=ib_insync.Stock(req.Symbol, req.Exchange, req.Currency),
+            timeZoneId='EST')]
+
+
+class GatewayTests(unittest.TestCase):
+    """
+    Test cases for serving requests to gateway clients.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmpdir.name, 'gateway.sock')
+        self.broker = SlowBroker(fail={'BAD'})
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = GatewayServer(self.broker, address=self.address)
+        self.loop.run_until_complete(self.server.start())
+        self.client = GatewayClient(self.address)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.tmpdir.cleanup()
+
+    def test_wire_format(self):
+        blk = MarketDataBlock(testdata_gateway['blk'], compact=True)
+        headers, arrays = _blocks_to_wire([blk, MarketDataBlock(None)])
+        payload = bytearray(b''.join(arr.tobytes() for arr in arrays))
+        blk_wire, blk_empty = _blocks_from_wire(headers, payload)
+        assert_frame_equal(blk_wire.df, blk.df)
+        self.assertEqual(blk_wire.tz, blk.tz)
+        self.assertTrue(blk_empty.df.empty)
+
+    def test_get_hist_data(self):
+        reqs = testdata_gateway['reqs']
+
+        async def run():
+            # Identical requests are coalesced.
+            blks = await asyncio.gather(*(
+                self.client.get_hist_data(req) for req in reqs + reqs))
+            n_downloads = len(self.broker.reqs)
+            blks_direct = [await get_hist_data(req, FakeBroker())
+                           for req in reqs]
+            # The client is a broker.
+            blk_via_client = await get_hist_data(reqs[0], self.client)
+            return blks, n_downloads, blks_direct, blk_via_client
+
+        blks, n_downloads, blks_direct, blk_via_client = \
+            self.loop.run_until_complete(run())
+        self.assertEqual(n_downloads, len(reqs))
+        for blk, blk_direct in zip(blks, blks_direct + blks_direct):
+            assert_frame_equal(blk.df, blk_direct.df)
+        assert_frame_equal(blk_via_client.df, blks_direct[0].df)
+
+    def test_errors(self):
+        req = testdata_gateway['req_fail']
+        with self.assertRaises(ConnectionError):
+            self.loop.run_until_complete(self.client.get_hist_data(req))
+        self.assertFalse(self.client.is_transient_error(ValueError()))
+        # The server is still serving after a failed request.
+        blk = self.loop.run_until_complete(
+            self.client.get_hist_data(testdata_gateway['reqs'][0]))
+        self.assertEqual(len(blk), 20)
+
+    def test_contract_details(self):
+        req = testdata_gateway['reqs'][0]
+        details = self.loop.run_until_complete(
+            self.client.hist_data_req_contract_details(req))
+        details_direct = self.loop.run_until_complete(
+            self.broker.hist_data_req_contract_details(req))
+        self.assertIsInstance(details[0], ib_insync.ContractDetails)
+        self.assertIsInstance(details[0].contract, ib_insync.Contract)
+        self.assertEqual(ib_insync.util.tree(details),
+                         ib_insync.util.tree(details_direct))
+
+    def test_pacing(self):
+        reqs = testdata_gateway['reqs']
+        pacing = PacingBudget(len(reqs), 600.)
+        server = GatewayServer(self.broker, pacing=pacing,
+                               address=self.address + '.paced')
+        client = GatewayClient(server.address)
+        self.loop.run_until_complete(server.start())
+        try:
+            self.loop.run_until_complete(asyncio.gather(*(
+                client.get_hist_data(req) for req in reqs)))
+        finally:
+            client.disconnect()
+            self.loop.run_until_complete(server.close())
+        # The downloads of the clients took the whole budget.
+        self.assertGreater(pacing.try_acquire(), 0)
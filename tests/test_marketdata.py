@@ -5,6 +5,8 @@ Test cases for data downloading, storing, access and management.
 import warnings
 import logging
 import unittest
+import pickle
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 import asyncio
@@ -14,13 +16,17 @@ from sqlalchemy import create_engine
 from sqlalchemy.sql import select
 
 from ibstract import MarketDataBlock
+from ibstract import HistDataReq
 from ibstract import init_db
 from ibstract import query_hist_data
 from ibstract import insert_hist_data
+from ibstract import HistDataWriter
 from ibstract import download_insert_hist_data
 from ibstract import hist_data_req_start_end
 from ibstract import query_hist_data_split_req
 from ibstract import get_hist_data
+from ibstract import iter_hist_data
+from ibstract import set_transform_executor
 from .testdata import testdata_market_data_block_merge
 from .testdata import testdata_db_info
 from .testdata import testdata_insert_hist_data
@@ -29,9 +35,12 @@ from .testdata import testdata_download_insert_hist_data
 from .testdata import testdata_req_start_end
 from .testdata import testdata_query_hist_data_split_req
 from .testdata import testdata_get_hist_data
+from .testdata import testdata_block_slice
+from .testdata import testdata_block_compact
+from .testdata import testdata_hist_data_req
 
 
-__all__ = ['MarketDataBlockTests', 'HistDataTests']
+__all__ = ['MarketDataBlockTests', 'HistDataReqTests', 'HistDataTests']
 
 
 warnings.filterwarnings("ignore")
@@ -70,6 +79,104 @@ class MarketDataBlockTests(unittest.TestCase):
             self.assertEqual(list(blk_direct.df.index.names),
                              blk.__class__.data_index)
 
+    def test_market_data_block_combine_async(self):
+        testdata = testdata_market_data_block_merge
+        blk_list = [MarketDataBlock(pd.DataFrame(data[0]), datatype='TRADES',
+                                    tz='US/Pacific') for data in testdata[1:]]
+        blk_direct = MarketDataBlock(
+            pd.DataFrame(testdata[-1][1]), datatype='TRADES', tz='US/Pacific')
+
+        async def combine_all():
+            blk = MarketDataBlock(pd.DataFrame(testdata[0]),
+                                  datatype='TRADES', tz='US/Pacific')
+            for blk_in in blk_list:
+                await blk.combine_async(blk_in)
+            return blk
+
+        loop = asyncio.new_event_loop()
+        for executor in ('inline', 'thread', 'process'):
+            set_transform_executor(executor, max_workers=1)
+            blk = loop.run_until_complete(combine_all())
+            assert_frame_equal(blk.df, blk_direct.df)
+        set_transform_executor(None)
+        loop.close()
+
+    def test_market_data_block_slice(self):
+        testdata = testdata_block_slice
+        blk = MarketDataBlock(testdata['df'])
+        times = blk.df.index.get_level_values('TickerTime')
+        symbols = blk.df.index.get_level_values('Symbol')
+        for start, end, symb, nrows in testdata['slices']:
+            mask = np.ones(len(blk.df), dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times <= end
+            if symb is not None:
+                mask &= symbols.isin([symb] if isinstance(symb, str)
+                                     else symb)
+            blk_slice = blk.slice(start, end, symb)
+            self.assertEqual(len(blk_slice), nrows)
+            assert_frame_equal(blk_slice.df, blk.df[mask])
+        # A single run of rows shares the column arrays.
+        start, end, symb, _ = testdata['slices'][2]
+        blk_slice = blk.slice(start, end, symb)
+        self.assertTrue(np.shares_memory(blk_slice.df['closing'].values,
+                                         blk.df['closing'].values))
+
+    def test_market_data_block_compact(self):
+        testdata = testdata_block_compact
+        blk = MarketDataBlock(testdata['df'])
+        blk_compact = MarketDataBlock(testdata['df'], compact=True)
+        self.assertEqual(blk_compact.df.dtypes.astype(str).to_dict(),
+                         testdata['dtypes'])
+        assert_frame_equal(blk_compact.df, blk.df, check_dtype=False,
+                           atol=0.005)
+        usage, usage_compact = blk.memory_usage(), blk_compact.memory_usage()
+        self.assertEqual(list(usage.index), list(blk.df.index.names) +
+                         list(blk.df.columns))
+        self.assertLess(usage_compact.sum(), usage.sum())
+        self.assertEqual(usage_compact['closing'], len(blk) * 4)
+        # Updates keep compact dtypes.
+        blk_compact.update(testdata['update'])
+        self.assertEqual(blk_compact.df['closing'].dtype, np.float32)
+        self.assertEqual(blk_compact.df['volume'].dtype, np.int32)
+        # Slicing a symbol out drops unused labels when compacted.
+        blk_ms = blk_compact.slice(symbols=['MS'])
+        blk_ms.compact_dtypes()
+        self.assertEqual(list(blk_ms.df.index.levels[0]), ['MS'])
+
+
+class HistDataReqTests(unittest.TestCase):
+    """
+    Test cases for HistDataReq keys and bulk construction.
+    """
+    def test_hist_data_req_key(self):
+        data = testdata_hist_data_req
+        req, *same = data['same']
+        for req_same in same:
+            self.assertEqual(req_same, req)
+            self.assertEqual(hash(req_same), hash(req))
+            self.assertIs(req_same.Symbol, req.Symbol)
+        self.assertEqual(len(set(data['same'] + [data['other']])), 2)
+        self.assertNotEqual(req, data['other'])
+        self.assertEqual(HistDataReq(*req.key), req)
+        self.assertEqual(pickle.loads(pickle.dumps(req)), req)
+        with self.assertRaises(AttributeError):
+            req.Symbol = 'MS'
+
+    def test_hist_data_req_from_frame(self):
+        data = testdata_hist_data_req
+        reqs = HistDataReq.from_frame(data['frame'], **data['defaults'])
+        self.assertEqual(reqs[:2], data['reqs'])
+        self.assertIs(reqs[0].BarSize, reqs[1].BarSize)
+        req_now = reqs[2]
+        self.assertEqual(req_now.key[:4], data['req_now'])
+        self.assertIsNotNone(req_now.TimeEnd.tzinfo)
+        for df in data['invalid']:
+            with self.assertRaises(TypeError):
+                HistDataReq.from_frame(df, barsize='1d', timedur='5d')
+
 
 class HistDataTests(unittest.TestCase):
     """
@@ -86,12 +193,7 @@ class HistDataTests(unittest.TestCase):
         # delete all exsiting tables and create new tables
         engine = create_engine(self.db_conn, echo=False)
         metadata = MetaData(engine, reflect=True)
-        sec_type_list = ['Index', 'Stock', 'Option', 'Future', 'Commodity',
-                         'FuturesOption', 'Forex', 'Bond', 'MutualFund',
-                         'CFD', 'Warrant']
-        for sectype in sec_type_list:
-            if sectype in metadata.tables.keys():
-                metadata.tables[sectype].drop()
+        metadata.drop_all()
         engine.dispose()
 
     def test_init_db(self):
@@ -106,6 +208,21 @@ class HistDataTests(unittest.TestCase):
             self.assertIn(sectype, metadata.tables.keys())
         engine.dispose()
 
+    def test_init_db_binary_barsize(self):
+        # A table of the old schema, comparing BarSize case-insensitively.
+        self._clear_db()
+        engine = create_engine(self.db_conn, echo=False)
+        engine.execute('CREATE TABLE Stock (BarSize VARCHAR(10) NOT NULL, '
+                       'PRIMARY KEY (BarSize))')
+        engine.execute("INSERT INTO Stock VALUES ('1m')")
+        init_db(self.db_info)
+        engine.execute("INSERT INTO Stock VALUES ('1M')")
+        rows = engine.execute(
+            "SELECT BarSize FROM Stock WHERE BarSize = '1M'").fetchall()
+        self.assertEqual([tuple(row) for row in rows], [('1M',)])
+        engine.dispose()
+        self._clear_db()
+
     def test_insert_hist_data(self):
         self._clear_db()
         init_db(self.db_info)
@@ -144,6 +261,44 @@ class HistDataTests(unittest.TestCase):
         _logger.debug(df.iloc[0])
         assert_frame_equal(df, df_source)
 
+    def test_hist_data_writer(self):
+        self._clear_db()
+        init_db(self.db_info)
+
+        # Queue two time-overlapped MarketDataBlocks for background insertion
+        async def run(loop, data):
+            engine = await aiosa.create_engine(
+                user=self.db_info['user'], db=self.db_info['db'],
+                host=self.db_info['host'], password=self.db_info['password'],
+                loop=loop, echo=False)
+            writer = HistDataWriter(engine, maxsize=1)
+            await writer.put('Stock', data[0])
+            await writer.put('Stock', data[1])
+            await writer.close()
+            engine.close()
+            await engine.wait_closed()
+            return writer
+
+        blk0 = MarketDataBlock(testdata_insert_hist_data[0])
+        blk1 = MarketDataBlock(testdata_insert_hist_data[1])
+        loop = asyncio.get_event_loop()
+        writer = loop.run_until_complete(run(loop, [blk0, blk1]))
+        self.assertEqual(writer.failed, [])
+        self.assertEqual(len(writer), 0)
+
+        # Verify insertion
+        df_source = testdata_insert_hist_data[2].copy()
+        engine = create_engine(self.db_conn)
+        conn = engine.connect()
+        metadata = MetaData(engine, reflect=True)
+        table = metadata.tables['Stock']
+        result = conn.execute(select([table]))
+        df = pd.DataFrame(result.fetchall())
+        df.columns = result.keys()
+        df.TickerTime = pd.DatetimeIndex(df.TickerTime).tz_localize('UTC')
+        df_source.TickerTime = df_source.TickerTime.apply(pd.Timestamp)
+        assert_frame_equal(df, df_source)
+
     def test_query_hist_data(self):
         async def run(loop, query_parms, blk):
             engine = await aiosa.create_engine(
@@ -167,6 +322,28 @@ class HistDataTests(unittest.TestCase):
         assert_frame_equal(blk.df, blk_source.df.loc(axis=0)[
             :, :, :, query_parms[-2]:query_parms[-1]])
 
+    def test_query_hist_data_compact(self):
+        async def run(loop, query_parms, blk):
+            engine = await aiosa.create_engine(
+                user=self.db_info['user'], db=self.db_info['db'],
+                host=self.db_info['host'], password=self.db_info['password'],
+                loop=loop)
+            # Insert and Query compact tables
+            await insert_hist_data(engine, query_parms[0], blk, compact=True)
+            blk = await query_hist_data(engine, *query_parms, compact=True)
+            engine.close()
+            await engine.wait_closed()
+            return blk
+
+        self._clear_db()
+        init_db(self.db_info, compact=True)
+        blk_source = MarketDataBlock(testdata_query_hist_data[0])
+        query_parms = testdata_query_hist_data[1]
+        loop = asyncio.get_event_loop()
+        blk = loop.run_until_complete(run(loop, query_parms, blk_source))
+        assert_frame_equal(blk.df, blk_source.df.loc(axis=0)[
+            :, :, :, query_parms[-2]:query_parms[-1]])
+
     def test_download_insert_hist_data(self):
         async def run(loop, req, broker, insert_limit):
             engine = await aiosa.create_engine(
@@ -279,6 +456,39 @@ class HistDataTests(unittest.TestCase):
                 run(loop, data['req'], blk_db, broker))
             assert_frame_equal(blk_ret.df, blk_exp.df)
 
+    def test_iter_hist_data(self):
+        async def run(loop, req, blk_db, broker):
+            # Populate database
+            engine = await aiosa.create_engine(
+                user=self.db_info['user'], db=self.db_info['db'],
+                host=self.db_info['host'], password=self.db_info['password'],
+                loop=loop, echo=False)
+            await insert_hist_data(engine, 'Stock', blk_db)
+            engine.close()
+            await engine.wait_closed()
+            # Stream hist data chunks
+            blk_list = []
+            async for blk in iter_hist_data(
+                    req, broker, mysql={**self.db_info, 'loop': loop}):
+                blk_list.append(blk)
+            return blk_list
+
+        from time import sleep
+        for data in testdata_get_hist_data:
+            sleep(1.5)  # Avoid IB pacing violation
+            self._clear_db()
+            init_db(self.db_info)
+            blk_db = MarketDataBlock(data['df_db'])
+            broker = data['broker'][0](*data['broker'][1])
+            blk_exp = MarketDataBlock(data['blk_exp.df'])
+            blk_exp.tz = data['xchg_tz']
+            loop = asyncio.get_event_loop()
+            blk_list = loop.run_until_complete(
+                run(loop, data['req'], blk_db, broker))
+            df = pd.concat([blk.df for blk in blk_list])
+            self.assertTrue(df.index.is_monotonic_increasing)
+            assert_frame_equal(df, blk_exp.df)
+
 
 class RealTimeDataStreamingTests(unittest.TestCase):
     """
@@ -0,0 +1,45 @@
+"""
+Test cases for event loop stall detection.
+"""
+
+import time
+import unittest
+import asyncio
+
+from ibstract import StallMonitor
+
+
+__all__ = ['StallMonitorTests']
+
+
+def _block_loop(seconds):
+    time.sleep(seconds)
+
+
+class StallMonitorTests(unittest.TestCase):
+    """
+    Test cases for StallMonitor.
+    """
+    def test_stall_monitor(self):
+        async def run(monitor):
+            monitor.start()
+            await asyncio.sleep(0.05)
+            _block_loop(0.3)
+            await asyncio.sleep(0.05)
+            _block_loop(0.2)
+            await asyncio.sleep(0.05)
+            monitor.stop()
+
+        monitor = StallMonitor(threshold=0.1, package='tests')
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(run(monitor))
+        loop.close()
+        report = monitor.report()
+        self.assertEqual(len(report), 1)
+        source, count, total, longest = report[0]
+        self.assertEqual(
+            source, 'tests.test_monitor.run > tests.test_monitor._block_loop')
+        self.assertEqual(count, 2)
+        self.assertGreaterEqual(longest, 0.25)
+        self.assertGreaterEqual(total, 0.45)
+        self.assertGreaterEqual(monitor.max_lag, longest)
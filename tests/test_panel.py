@@ -0,0 +1,69 @@
+"""
+Test cases for the wide panel view of bars.
+"""
+
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import MarketDataPanel
+from .testdata import testdata_panel
+
+
+__all__ = ['MarketDataPanelTests']
+
+
+class MarketDataPanelTests(unittest.TestCase):
+    """
+    Test cases for MarketDataPanel building and extending.
+    """
+    def setUp(self):
+        self.blk = MarketDataBlock(testdata_panel['df'])
+
+    def _expected(self, field: str, fill=None) -> pd.DataFrame:
+        df = self.blk.df[field].replace(-1, np.nan).astype(np.float64)
+        df = df.droplevel(['DataType', 'BarSize']).unstack('Symbol')
+        df.index.name = None
+        if fill == 'ffill':
+            df = df.ffill()
+        elif fill is not None:
+            df = df.fillna(fill)
+        return df
+
+    def test_from_block(self):
+        for fill in (None, 'ffill', 0.):
+            panel = MarketDataPanel.from_block(self.blk, fill=fill)
+            self.assertEqual(panel.shape, (50, 3))
+            for field in ('closing', 'volume'):
+                assert_frame_equal(panel.frame(field), self._expected(
+                    field, fill), check_names=False)
+        with self.assertRaises(ValueError):
+            blk = MarketDataBlock(testdata_panel['df'])
+            blk.update(testdata_panel['df_other_barsize'])
+            MarketDataPanel.from_block(blk)
+
+    def test_extend(self):
+        split = testdata_panel['split']
+        mid_start, mid_end = testdata_panel['mid']
+        df = self.blk.df
+        times = df.index.get_level_values('TickerTime')
+        symbols = df.index.get_level_values('Symbol')
+        in_mid = (times >= mid_start) & (times <= mid_end) & (symbols == 'FB')
+        for fill in (None, 'ffill'):
+            panel = MarketDataPanel(['closing'], fill=fill)
+            for rows in (~in_mid & (times < split), ~in_mid & (times >= split),
+                         in_mid):
+                blk = MarketDataBlock(None)
+                blk.df = df[rows]
+                panel.extend(blk)
+            assert_frame_equal(panel.frame('closing'),
+                               self._expected('closing', fill),
+                               check_names=False)
+
+    def test_compact_dtypes(self):
+        blk = MarketDataBlock(testdata_panel['df'], compact=True)
+        panel = MarketDataPanel.from_block(blk, fields=['closing', 'volume'])
+        self.assertEqual(panel.values('closing').dtype, np.float32)
+        self.assertEqual(panel.values('volume').dtype, np.float64)
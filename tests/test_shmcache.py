@@ -0,0 +1,114 @@
+"""
+Test cases for the shared memory bar cache.
+"""
+
+import os
+import gc
+import unittest
+import asyncio
+import multiprocessing
+import numpy as np
+from pandas.testing import assert_frame_equal
+
+from ibstract import SharedBarCache
+from ibstract.shmcache import shared_memory
+from ibstract.marketdata import hist_data_req_start_end
+from .test_backfill import FakeBroker
+from .test_gateway import SlowBroker
+from .testdata import testdata_shmcache
+
+
+__all__ = ['SharedBarCacheTests']
+
+
+def _child_attach(name: str, req, exit_attached: bool):
+    """Attach to a cached series in a child process, and return the sum of
+    its closing prices and the number of processes attached."""
+    import pytz
+    cache = SharedBarCache(name)
+    start, end, _ = hist_data_req_start_end(req, pytz.timezone('US/Eastern'))
+    blk = cache.get(req.SecType, req.Symbol, req.DataType, req.BarSize,
+                    start, end)
+    ret = (float(blk.df['closing'].sum()), cache.entries()[0][4])
+    if exit_attached:
+        os._exit(0)
+    return ret
+
+
+@unittest.skipIf(shared_memory is None, 'Python 3.8+ is required.')
+class SharedBarCacheTests(unittest.TestCase):
+    """
+    Test cases for filling, attaching and releasing the shared cache.
+    """
+    def setUp(self):
+        self.name = 'ibstract_test_{}'.format(os.getpid())
+        self.cache = SharedBarCache(self.name, poll_interval=0.01)
+        self.broker = FakeBroker()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.cache.destroy()
+        self.loop.close()
+
+    def _get(self, req):
+        return self.loop.run_until_complete(
+            self.cache.get_hist_data(req, self.broker))
+
+    def test_get_hist_data(self):
+        data = testdata_shmcache
+        blk = self._get(data['req'])
+        self.assertEqual(len(blk), data['nbars'][0])
+        self.assertEqual(len(self.broker.reqs), 1)
+        self.assertFalse(blk.df['closing'].values.flags.writeable)
+        # Covered requests attach to the same arrays without downloading.
+        blk_again = self._get(data['req'])
+        blk_inside = self._get(data['req_inside'])
+        self.assertEqual(len(self.broker.reqs), 1)
+        assert_frame_equal(blk_again.df, blk.df)
+        self.assertEqual(len(blk_inside), data['nbars'][1])
+        self.assertTrue(np.shares_memory(blk_again.df['closing'].values,
+                                         blk.df['closing'].values))
+        (key, _, _, nbars, nprocs), = self.cache.entries()
+        self.assertEqual((key, nbars, nprocs),
+                         ('Stock:GS:TRADES:1d', data['nbars'][0], 1))
+        # A wider request replaces the segment. The old one is unlinked
+        # when its arrays are released.
+        blk_wider = self._get(data['req_wider'])
+        self.assertEqual(len(blk_wider), data['nbars'][2])
+        self.assertEqual(self.cache.entries()[0][3], data['nbars'][2])
+        old_segment = self.name + '_1'
+        shared_memory.SharedMemory(old_segment).close()
+        del blk, blk_again, blk_inside
+        gc.collect()
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(old_segment)
+
+    def test_concurrent_fills(self):
+        data = testdata_shmcache
+        broker = SlowBroker()
+
+        async def run():
+            return await asyncio.gather(
+                self.cache.get_hist_data(data['req'], broker),
+                self.cache.get_hist_data(data['req_inside'], broker))
+
+        blk, blk_inside = self.loop.run_until_complete(run())
+        # The contained request waits for the fill by the other coroutine.
+        self.assertEqual(len(broker.reqs), 1)
+        self.assertEqual((len(blk), len(blk_inside)), data['nbars'][:2])
+        self.assertEqual(self.cache.entries()[0][0], 'Stock:GS:TRADES:1d')
+
+    def test_processes(self):
+        req = testdata_shmcache['req']
+        blk = self._get(req)
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(1) as pool:
+            closing_sum, nprocs = pool.apply(
+                _child_attach, (self.name, req, False))
+        self.assertEqual(closing_sum, blk.df['closing'].sum())
+        self.assertEqual(nprocs, 2)
+        # References of a process exiting attached are pruned.
+        proc = ctx.Process(target=_child_attach, args=(self.name, req, True))
+        proc.start()
+        proc.join()
+        self.assertEqual(self.cache.entries()[0][4], 1)
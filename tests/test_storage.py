@@ -0,0 +1,246 @@
+"""
+Test cases for historical data storage backends.
+"""
+
+import os
+import tempfile
+import unittest
+import asyncio
+import pytz
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import SQLiteStore
+from ibstract import query_hist_data
+from ibstract import insert_hist_data
+from ibstract import HistDataWriter
+from ibstract import query_hist_data_split_req
+from ibstract import get_hist_data, HistDataIncomplete
+from ibstract.marketdata import hist_data_req_start_end
+from ibstract.storage import aiosqlite
+from .testdata import testdata_sqlite_store
+from .testdata import testdata_tail_sync
+from .testdata import testdata_partial_days
+from .testdata import testdata_split_req_steps
+from .testdata import testdata_partial_failure
+from .testdata import testdata_no_broker
+
+
+__all__ = ['SQLiteStoreTests']
+
+
+class FlakyBroker:
+    """
+    Broker serving bars of a DataFrame. Requests ending on fail_once fail
+    transiently on the first try, and those ending on fail_always fail.
+    """
+    def __init__(self, df, fail_once, fail_always):
+        self.df = df
+        self.fail_once = fail_once
+        self.fail_always = fail_always
+        self.reqs = []
+        self.n_tz_reqs = 0
+
+    async def hist_data_req_timezone(self, req):
+        self.n_tz_reqs += 1
+        return pytz.timezone('US/Eastern')
+
+    async def req_hist_data_async(self, *req_list):
+        blk_list = []
+        for req in req_list:
+            self.reqs.append(req)
+            end_date = req.TimeEnd.date()
+            if end_date == self.fail_always:
+                raise ValueError('No security definition found.')
+            if end_date == self.fail_once:
+                self.fail_once = None
+                raise ConnectionError('Connection reset.')
+            xchg_tz = await self.hist_data_req_timezone(req)
+            start, end, _ = hist_data_req_start_end(req, xchg_tz)
+            t = pd.to_datetime(self.df.TickerTime, utc=True)
+            blk = MarketDataBlock(self.df.loc[(t >= start) & (t <= end)])
+            blk.tz_convert(xchg_tz)
+            blk_list.append(blk)
+        return blk_list
+
+
+@unittest.skipIf(aiosqlite is None, 'aiosqlite is not installed.')
+class SQLiteStoreTests(unittest.TestCase):
+    """
+    Test cases for the embedded SQLite storage backend.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'ibstract_test.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_insert_query_hist_data(self):
+        async def run(blk_list, query_parms):
+            store = await SQLiteStore.open(self.path)
+            for blk in blk_list:
+                await insert_hist_data(store, query_parms[0], blk)
+            blk_all = await query_hist_data(store, *query_parms[:4])
+            blk = await query_hist_data(store, *query_parms)
+            await store.close()
+            return blk_all, blk
+
+        data = testdata_sqlite_store
+        blk_list = [MarketDataBlock(df) for df in data['insert'][:2]]
+        query_parms = data['query'][1]
+        loop = asyncio.new_event_loop()
+        blk_all, blk = loop.run_until_complete(run(blk_list, query_parms))
+        loop.close()
+        blk_source = MarketDataBlock(data['insert'][2])
+        assert_frame_equal(blk_all.df, blk_source.df)
+        assert_frame_equal(blk.df, blk_source.df.loc(axis=0)[
+            :, :, :, query_parms[-2]:query_parms[-1]])
+
+    def test_hist_data_writer(self):
+        async def run(blk_list, query_parms):
+            store = await SQLiteStore.open(self.path)
+            writer = HistDataWriter(store, maxsize=1)
+            for blk in blk_list:
+                await writer.put(query_parms[0], blk)
+            await writer.close()
+            blk = await query_hist_data(store, *query_parms[:4])
+            await store.close()
+            return writer, blk
+
+        data = testdata_sqlite_store
+        blk_list = [MarketDataBlock(df) for df in data['insert'][:2]]
+        loop = asyncio.new_event_loop()
+        writer, blk = loop.run_until_complete(
+            run(blk_list, data['query'][1]))
+        loop.close()
+        self.assertEqual(writer.failed, [])
+        assert_frame_equal(blk.df, MarketDataBlock(data['insert'][2]).df)
+
+    def test_query_hist_data_split_req_tail_sync(self):
+        async def run(blk, req, xchg_tz):
+            store = await SQLiteStore.open(self.path)
+            await insert_hist_data(store, req.SecType, blk)
+            results = await query_hist_data_split_req(
+                req, xchg_tz, store, tail_sync=True)
+            await store.close()
+            return results
+
+        for data in testdata_tail_sync:
+            os.remove(self.path) if os.path.exists(self.path) else None
+            xchg_tz = data['req'].TimeEnd.tzinfo
+            loop = asyncio.new_event_loop()
+            dl_reqs, insert_limit, _, _, _ = loop.run_until_complete(
+                run(MarketDataBlock(data['df_db']), data['req'], xchg_tz))
+            loop.close()
+            self.assertEqual(dl_reqs, data['dl_reqs'])
+            self.assertEqual(insert_limit, data['insert_limit'])
+
+    def test_query_hist_data_split_req_min_fill(self):
+        async def run(blk, req, xchg_tz, min_fill):
+            store = await SQLiteStore.open(self.path)
+            await insert_hist_data(store, req.SecType, blk)
+            results = await query_hist_data_split_req(
+                req, xchg_tz, store, min_fill=min_fill)
+            await store.close()
+            return results
+
+        for data in testdata_partial_days:
+            os.remove(self.path) if os.path.exists(self.path) else None
+            xchg_tz = data['req'].TimeEnd.tzinfo
+            loop = asyncio.new_event_loop()
+            dl_reqs, insert_limit, _, _, _ = loop.run_until_complete(
+                run(MarketDataBlock(data['df_db']), data['req'], xchg_tz,
+                    data['min_fill']))
+            loop.close()
+            self.assertEqual(dl_reqs, data['dl_reqs'])
+            self.assertEqual(insert_limit, data['insert_limit'])
+
+    def test_query_hist_data_split_req_steps(self):
+        async def run(req, xchg_tz, df_db):
+            store = await SQLiteStore.open(self.path)
+            if df_db is not None:
+                await insert_hist_data(store, req.SecType,
+                                       MarketDataBlock(df_db))
+            results = await query_hist_data_split_req(req, xchg_tz, store)
+            await store.close()
+            return results
+
+        for data in testdata_split_req_steps:
+            os.remove(self.path) if os.path.exists(self.path) else None
+            xchg_tz = data['req'].TimeEnd.tzinfo
+            loop = asyncio.new_event_loop()
+            dl_reqs, insert_limit, _, _, _ = loop.run_until_complete(
+                run(data['req'], xchg_tz, data.get('df_db')))
+            loop.close()
+            self.assertEqual(dl_reqs, data['dl_reqs'])
+            self.assertEqual(insert_limit, data['insert_limit'])
+
+    def test_get_hist_data_partial_failure(self):
+        data = testdata_partial_failure
+        broker = FlakyBroker(data['df_broker'], data['fail_once'],
+                             data['fail_always'])
+
+        async def run():
+            store = await SQLiteStore.open(self.path)
+            await insert_hist_data(store, data['req'].SecType,
+                                   MarketDataBlock(data['df_db']))
+            try:
+                await get_hist_data(data['req'], broker, store=store,
+                                    retry_delay=0.01)
+            except HistDataIncomplete as e:
+                exc = e
+            blk_db = await query_hist_data(
+                store, data['req'].SecType, 'GS', 'TRADES', '1h')
+            await store.close()
+            return exc, blk_db
+
+        loop = asyncio.new_event_loop()
+        exc, blk_db = loop.run_until_complete(run())
+        loop.close()
+        self.assertEqual(len(broker.reqs), data['n_requests'])
+        self.assertEqual([f.start for f in exc.failed],
+                         [data['failed_start']])
+        self.assertIsInstance(exc.failed[0].error, ValueError)
+        blk_exp = MarketDataBlock(data['blk_exp.df'])
+        blk_exp.tz_convert(pytz.timezone('US/Eastern'))
+        assert_frame_equal(exc.blk.df, blk_exp.df)
+        # Successful downloads are stored.
+        blk_db.tz_convert(pytz.timezone('US/Eastern'))
+        assert_frame_equal(blk_db.df, blk_exp.df)
+
+    def test_get_hist_data_no_broker(self):
+        data = testdata_no_broker
+        broker = FlakyBroker(data['df_db'], None, None)
+
+        async def run():
+            store = await SQLiteStore.open(self.path)
+            await insert_hist_data(store, 'Stock',
+                                   MarketDataBlock(data['df_db']))
+            await get_hist_data(data['req_covered'], broker, store=store)
+            await get_hist_data(data['req_covered'], broker, store=store)
+            await store.close()
+            # Time zone from the stored contract metadata.
+            store = await SQLiteStore.open(self.path)
+            blk = await get_hist_data(data['req_covered'], None, store=store)
+            try:
+                await get_hist_data(data['req_gaps'], None, store=store)
+            except HistDataIncomplete as e:
+                exc = e
+            await store.close()
+            return blk, exc
+
+        loop = asyncio.new_event_loop()
+        blk, exc = loop.run_until_complete(run())
+        loop.close()
+        self.assertEqual((broker.n_tz_reqs, len(broker.reqs)), (1, 0))
+        blk_exp = MarketDataBlock(data['blk_exp.df'])
+        blk_exp.tz_convert(pytz.timezone('US/Eastern'))
+        assert_frame_equal(blk.df, blk_exp.df)
+        self.assertEqual([f.start for f in exc.failed],
+                         data['failed_starts'])
+        self.assertIsInstance(exc.failed[0].error, ConnectionError)
+        blk_exp = MarketDataBlock(data['df_db'])
+        blk_exp.tz_convert(pytz.timezone('US/Eastern'))
+        assert_frame_equal(exc.blk.df, blk_exp.df)
@@ -0,0 +1,65 @@
+"""
+Test cases for real-time tick ingestion.
+"""
+
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from ibstract import MarketDataBlock
+from ibstract import TICK_DTYPE, TickBuffer, TickIngestor, ticks_to_bars
+from .testdata import testdata_ticks_to_bars
+
+
+__all__ = ['TickTests']
+
+
+def _ticks_array(df):
+    ticks = np.empty(len(df), dtype=TICK_DTYPE)
+    ticks['time'] = pd.DatetimeIndex(df.time).asi8
+    ticks['ticktype'] = df.ticktype
+    ticks['price'] = df.price
+    ticks['size'] = df['size']
+    return ticks
+
+
+class TickTests(unittest.TestCase):
+    """
+    Test cases for TickBuffer, ticks_to_bars and TickIngestor.
+    """
+    def test_tick_buffer(self):
+        ticks = _ticks_array(testdata_ticks_to_bars['ticks'])
+        buf = TickBuffer(capacity=2)
+        for t in ticks[:3]:
+            buf.append(*t)
+        buf.extend(ticks[3:])
+        self.assertEqual(len(buf), len(ticks))
+        np.testing.assert_array_equal(buf.ticks, ticks)
+        np.testing.assert_array_equal(buf.drain(5), ticks[:5])
+        np.testing.assert_array_equal(buf.ticks, ticks[5:])
+        np.testing.assert_array_equal(buf.drain(), ticks[5:])
+        self.assertEqual(len(buf), 0)
+
+    def test_ticks_to_bars(self):
+        data = testdata_ticks_to_bars
+        ticks = _ticks_array(data['ticks'])
+        blk_exp = MarketDataBlock(data['bars'])
+        blk_exp.tz = 'US/Eastern'
+        blk = ticks_to_bars(ticks, 'GS', '1 min', tz='US/Eastern')
+        assert_frame_equal(blk.df, blk_exp.df)
+        # Out of order ticks give the same bars.
+        blk = ticks_to_bars(ticks[::-1], 'GS', '1 min', tz='US/Eastern')
+        assert_frame_equal(blk.df, blk_exp.df)
+
+    def test_tick_ingestor(self):
+        data = testdata_ticks_to_bars
+        ticks = _ticks_array(data['ticks'])
+        blk_exp = MarketDataBlock(data['bars'])
+        ingestor = TickIngestor('1m', batch_size=3)
+        for t in ticks:
+            ingestor.add_tick('GS', *t)
+        # Ticks of the open bar stay buffered until the final flush.
+        self.assertEqual(len(ingestor.blk), 1)
+        ingestor.flush(final=True)
+        assert_frame_equal(ingestor.blk.df, blk_exp.df)
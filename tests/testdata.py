@@ -23,6 +23,23 @@ __all__ = [
     'testdata_req_start_end',
     'testdata_query_hist_data_split_req',
     'testdata_get_hist_data',
+    'testdata_ticks_to_bars',
+    'testdata_sqlite_store',
+    'testdata_tail_sync',
+    'testdata_partial_days',
+    'testdata_split_req_steps',
+    'testdata_partial_failure',
+    'testdata_no_broker',
+    'testdata_duckdb_store',
+    'testdata_backfill',
+    'testdata_block_slice',
+    'testdata_block_compact',
+    'testdata_panel',
+    'testdata_arrow_ipc',
+    'testdata_shmcache',
+    'testdata_gateway',
+    'testdata_hist_data_req',
+    'testdata_chunk_concurrent_insert',
 ]
 
 
@@ -379,3 +396,305 @@ testdata_req_start_end = [  # (req, start_dt, end_dt)
     (HistDataReq('Stock', 'GS', '1m', '18h', dtest(2017, 9, 12, 14, 15)),
      dtest(2017, 9, 12, 0, 0), dtest(2017, 9, 12, 14, 15)),
 ]
+
+
+# --- test_ticks.TickTests ---
+gs_ticks_csv = StringIO("""
+time,ticktype,price,size
+2017-09-12 13:30:00.100+00:00,4,221.50,100
+2017-09-12 13:30:00.200+00:00,1,221.40,300
+2017-09-12 13:30:20.000+00:00,4,221.90,200
+2017-09-12 13:30:59.900+00:00,4,221.20,100
+2017-09-12 13:31:05.000+00:00,4,221.30,400
+2017-09-12 13:31:30.000+00:00,2,221.60,500
+2017-09-12 13:33:00.000+00:00,4,221.80,100
+2017-09-12 13:33:10.000+00:00,4,221.70,300
+""")
+gs_ticks = pd.read_csv(gs_ticks_csv)
+
+testdata_ticks_to_bars = {
+    'ticks': gs_ticks,
+    'bars': pd.DataFrame({
+        'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '1m',
+        'TickerTime': ['2017-09-12 13:30:00+00:00',
+                       '2017-09-12 13:31:00+00:00',
+                       '2017-09-12 13:33:00+00:00'],
+        'opening': [221.5, 221.3, 221.8],
+        'high': [221.9, 221.3, 221.8],
+        'low': [221.2, 221.3, 221.7],
+        'closing': [221.2, 221.3, 221.7],
+        'volume': [400, 400, 400],
+        'barcount': [3, 1, 2],
+        'average': [(221.5+2*221.9+221.2)/4, 221.3, (221.8+3*221.7)/4],
+    }),
+}
+
+
+# --- test_storage.SQLiteStoreTests ---
+testdata_sqlite_store = {
+    'insert': testdata_insert_hist_data,
+    'query': testdata_query_hist_data,
+}
+
+gs1d = pd.DataFrame({
+    'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '1d',
+    'TickerTime': ['2017-09-05 04:00:00+00:00', '2017-09-06 04:00:00+00:00',
+                   '2017-09-07 04:00:00+00:00'],
+    'opening': [224.5, 218.97, 219.0], 'high': [225.0, 220.0, 219.5],
+    'low': [218.0, 218.5, 214.5], 'closing': [218.9, 219.2, 215.4],
+    'volume': [41000, 29000, 35000], 'barcount': [21000, 15000, 18000],
+    'average': [219.9, 219.3, 216.5],
+})
+testdata_tail_sync = [
+    {   # Daily bars: only the days since the last stored bar.
+        'req': HistDataReq('Stock', 'GS', '1d', '1M', dtest(2017, 9, 13)),
+        'df_db': gs1d,
+        'dl_reqs': [
+            HistDataReq('Stock', 'GS', '1d', '4d', dtest(2017, 9, 13)),
+        ],
+        'insert_limit': [
+            (dtest(2017, 9, 7), dtest(2017, 9, 13)),
+        ],
+    },
+    {   # Intraday bars: the rest of the partially stored last day.
+        'req': HistDataReq('Stock', 'GS', '1h', '3d', dtest(2017, 9, 13)),
+        'df_db': gs1h_full.loc[
+            (gs1h_full.TickerTime > '2017-09-08')
+            & (gs1h_full.TickerTime < '2017-09-12 15:00:00+00:00')],
+        'dl_reqs': [
+            HistDataReq('Stock', 'GS', '1h', '50399s',
+                        estmax(dtest(2017, 9, 12))),
+        ],
+        'insert_limit': [
+            (dtest(2017, 9, 12, 10), estmax(dtest(2017, 9, 12))),
+        ],
+    },
+    {   # Intraday bars: the last stored day is complete.
+        'req': HistDataReq('Stock', 'GS', '1h', '3d', dtest(2017, 9, 13)),
+        'df_db': gs1h_full.loc[
+            (gs1h_full.TickerTime > '2017-09-08')
+            & (gs1h_full.TickerTime < '2017-09-12 20:00:00+00:00')],
+        'dl_reqs': [],
+        'insert_limit': [],
+    },
+]
+
+gs1h_gap = gs1h_full.loc[
+    (gs1h_full.TickerTime > '2017-09-08')
+    & ~gs1h_full.TickerTime.between('2017-09-11 15:00:00+00:00',
+                                     '2017-09-11 17:00:00+00:00')]
+testdata_partial_days = [
+    {   # 4 of 7 regular session bars stored on 2017-09-11.
+        'req': HistDataReq('Stock', 'GS', '1h', '3d', dtest(2017, 9, 13)),
+        'df_db': gs1h_gap,
+        'min_fill': 0.5,
+        'dl_reqs': [],
+        'insert_limit': [],
+    },
+    {   # The missing 11:00-14:00 bars are downloaded.
+        'req': HistDataReq('Stock', 'GS', '1h', '3d', dtest(2017, 9, 13)),
+        'df_db': gs1h_gap,
+        'min_fill': 0.9,
+        'dl_reqs': [
+            HistDataReq('Stock', 'GS', '1h', '10800s',
+                        dtest(2017, 9, 11, 14)),
+        ],
+        'insert_limit': [
+            (dtest(2017, 9, 11, 11), dtest(2017, 9, 11, 14)),
+        ],
+    },
+]
+
+testdata_split_req_steps = [
+    {   # 5m bars: at most 1W of trading days per request.
+        'req': HistDataReq('Stock', 'GS', '5m', '8d', dtest(2017, 9, 13)),
+        'dl_reqs': [
+            HistDataReq('Stock', 'GS', '5m', '4d', estmax(dtest(2017, 9, 6))),
+            HistDataReq('Stock', 'GS', '5m', '4d',
+                        estmax(dtest(2017, 9, 12))),
+        ],
+        'insert_limit': [
+            (dtest(2017, 8, 31), estmax(dtest(2017, 9, 6))),
+            (dtest(2017, 9, 7), estmax(dtest(2017, 9, 12))),
+        ],
+    },
+    {   # 1s bars: 30m per request within the requested range.
+        'req': HistDataReq('Stock', 'GS', '1s', '45m',
+                           dtest(2017, 9, 12, 10, 15)),
+        'dl_reqs': [
+            HistDataReq('Stock', 'GS', '1s', '1800s',
+                        dtest(2017, 9, 12, 10)),
+            HistDataReq('Stock', 'GS', '1s', '900s',
+                        dtest(2017, 9, 12, 10, 15)),
+        ],
+        'insert_limit': [
+            (dtest(2017, 9, 12, 9, 30), dtest(2017, 9, 12, 10)),
+            (dtest(2017, 9, 12, 10), dtest(2017, 9, 12, 10, 15)),
+        ],
+    },
+    {   # 1s bars: only the range after the bars stored for the day.
+        'req': HistDataReq('Stock', 'GS', '1s', '1h',
+                           dtest(2017, 9, 12, 11)),
+        'df_db': pd.DataFrame({
+            'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '1s',
+            'TickerTime': pd.date_range(dtest(2017, 9, 12, 10),
+                                        periods=601, freq='s'),
+            'closing': 220., 'volume': 100}),
+        'dl_reqs': [
+            HistDataReq('Stock', 'GS', '1s', '1800s',
+                        dtest(2017, 9, 12, 10, 40, 1)),
+            HistDataReq('Stock', 'GS', '1s', '1199s',
+                        dtest(2017, 9, 12, 11)),
+        ],
+        'insert_limit': [
+            (dtest(2017, 9, 12, 10, 10, 1), dtest(2017, 9, 12, 10, 40, 1)),
+            (dtest(2017, 9, 12, 10, 40, 1), dtest(2017, 9, 12, 11)),
+        ],
+    },
+]
+
+testdata_partial_failure = {
+    'req': HistDataReq('Stock', 'GS', '1h', '2W', dtest(2017, 9, 13)),
+    'df_db': gs1h,
+    'df_broker': gs1h_full,
+    # Downloads ending on these dates fail transiently once, or always.
+    'fail_once': dtest(2017, 9, 1).date(),
+    'fail_always': dtest(2017, 9, 12).date(),
+    'n_requests': 3,
+    'failed_start': dtest(2017, 9, 11),
+    'blk_exp.df': gs1h_full.loc[gs1h_full.TickerTime < '2017-09-09'],
+}
+
+testdata_no_broker = {
+    'df_db': gs1h,
+    'req_covered': HistDataReq('Stock', 'GS', '1h', '2d', dtest(2017, 9, 8)),
+    'blk_exp.df': gs1h.loc[
+        (gs1h.TickerTime > '2017-09-06') & (gs1h.TickerTime < '2017-09-08')],
+    'req_gaps': HistDataReq('Stock', 'GS', '1h', '2W', dtest(2017, 9, 13)),
+    'failed_starts': [dtest(2017, 8, 30), dtest(2017, 9, 11)],
+}
+
+
+# --- test_analytics.DuckDBStoreTests ---
+ms1h = gs1h.assign(Symbol='MS')
+testdata_duckdb_store = {
+    'insert': [gs1h, ms1h, gs1h],
+    'scan': (('Stock', ['GS', 'MS'], 'TRADES', '1 hour',
+              dtutc(2017, 9, 1), dtutc(2017, 9, 10)), pd.concat([gs1h, ms1h])),
+    'resample': (('Stock', None, 'TRADES', '1h', '1 day',
+                  dtutc(2017, 9, 1), dtutc(2017, 9, 10)), east),
+}
+
+
+# --- test_backfill.BackfillJobTests ---
+testdata_backfill = {
+    'universe': 'GS\nBAD,Stock\n# comment\n\nFB,Stock,SMART,USD\n',
+    'barsizes': ['1 day', '1 hour'],
+    'start': '2017-01-01',
+    'end': '2017-03-01',
+    'n_chunks': 9,
+    'first_chunks': [
+        ('Stock:GS:SMART:TRADES:1d:20170301',
+         HistDataReq('Stock', 'GS', '1d', '39d', dtest(2017, 3, 1))),
+        ('Stock:GS:SMART:TRADES:1h:20170201',
+         HistDataReq('Stock', 'GS', '1h', '20d', dtest(2017, 2, 1))),
+        ('Stock:GS:SMART:TRADES:1h:20170301',
+         HistDataReq('Stock', 'GS', '1h', '19d', dtest(2017, 3, 1))),
+    ],
+}
+
+
+# --- test_marketdata.MarketDataBlockTests ---
+testdata_block_slice = {
+    'df': pd.concat([gs1h, ms1h, gs1h.assign(BarSize='1d')]),
+    # (start, end, symbols, expected number of rows)
+    'slices': [
+        (dtutc(2017, 9, 5, 13), dtutc(2017, 9, 5, 17), ['GS'], 10),
+        (dtutc(2017, 9, 5, 13), dtutc(2017, 9, 5, 17), None, 15),
+        (dtest(2017, 9, 6, 9), dtest(2017, 9, 6, 12), 'MS', 4),
+        (None, dtutc(2017, 9, 5, 20), ['MS'], 9),
+        (dtutc(2017, 9, 8), None, ['GS', 'MS'], 39),
+        (dtutc(2016, 1, 1), dtutc(2016, 1, 2), None, 0),
+        (None, None, ['FB'], 0),
+        (None, None, None, 150),
+    ],
+}
+testdata_block_compact = {
+    'df': gs1h.assign(volume=gs1h['volume'] * 100,
+                      average=gs1h['average'] + 1e6),
+    'dtypes': {'opening': 'float32', 'high': 'float32', 'low': 'float32',
+               'closing': 'float32', 'volume': 'int32', 'barcount': 'int16',
+               'average': 'float64'},
+    'update': gs1h.assign(Symbol='MS', volume=-1),
+}
+
+
+# --- test_panel.MarketDataPanelTests ---
+testdata_panel = {
+    'df': pd.concat([gs1h, ms1h.iloc[::3], gs1h.assign(Symbol='FB')[20:]]),
+    'df_other_barsize': gs1h.assign(BarSize='1d'),
+    # Extend by bars after split, and then by the bars held out in mid.
+    'split': dtutc(2017, 9, 7),
+    'mid': (dtutc(2017, 9, 5, 18), dtutc(2017, 9, 6, 15)),
+}
+
+
+# --- test_arrowipc.ArrowIPCTests ---
+testdata_arrow_ipc = {
+    'blocks': [gs1h, ms1h, gs1h.assign(BarSize='1d', Symbol='FB')],
+    'tz': 'US/Eastern',
+    'partial_columns': gs1h[['Symbol', 'DataType', 'BarSize', 'TickerTime',
+                             'closing', 'volume']],
+}
+
+
+# --- test_shmcache.SharedBarCacheTests ---
+testdata_shmcache = {
+    'req': HistDataReq('Stock', 'GS', '1d', '20d', dtest(2017, 3, 1)),
+    'req_inside': HistDataReq('Stock', 'GS', '1d', '5d', dtest(2017, 2, 15)),
+    'req_wider': HistDataReq('Stock', 'GS', '1d', '40d', dtest(2017, 3, 1)),
+    'nbars': (20, 6, 40),
+}
+
+
+# --- test_gateway.GatewayTests ---
+testdata_gateway = {
+    'reqs': [HistDataReq('Stock', 'GS', '1d', '20d', dtest(2017, 3, 1)),
+             HistDataReq('Stock', 'MS', '1d', '5d', dtest(2017, 2, 15))],
+    'req_fail': HistDataReq('Stock', 'BAD', '1d', '5d', dtest(2017, 2, 15)),
+    'blk': gs1h,
+}
+
+
+# --- test_marketdata.HistDataReqTests ---
+testdata_hist_data_req = {
+    'same': [HistDataReq('Stock', 'GS', '1 hour', '5 d', dtest(2017, 9, 16)),
+             HistDataReq('stock', 'gs', '1h', '5days', dtest(2017, 9, 16)),
+             HistDataReq('STOCK', 'Gs', '1hr', '5d',
+                         dtest(2017, 9, 16).astimezone(pytz.utc))],
+    'other': HistDataReq('Stock', 'GS', '1 hour', '5 d', dtest(2017, 9, 15)),
+    'frame': pd.DataFrame({
+        'SecType': ['stock', 'Stock', 'cfd'],
+        'Symbol': ['gs', 'MS', 'IBUS500'],
+        'BarSize': ['1 hour', '1h', '1 day'],
+        'TimeEnd': [dtest(2017, 9, 16), dtest(2017, 9, 16), pd.NaT]}),
+    'defaults': {'timedur': '5 d', 'exchange': 'smart'},
+    'reqs': [HistDataReq('Stock', 'GS', '1h', '5d', dtest(2017, 9, 16)),
+             HistDataReq('Stock', 'MS', '1h', '5d', dtest(2017, 9, 16))],
+    'req_now': ('CFD', 'IBUS500', '1d', '5d'),
+    'invalid': [pd.DataFrame({'SecType': ['Stock', 'Share'],
+                              'Symbol': ['GS', 'MS']}),
+                pd.DataFrame({'SecType': ['Stock', 'Stock'],
+                              'Symbol': ['GS', None]})],
+}
+
+
+# --- test_chunkdb.ChunkStoreTests ---
+# Extended-hours minute bars of two days in US/Eastern, both in the UTC day
+# 2017-01-05.
+testdata_chunk_concurrent_insert = [
+    pd.DataFrame({'Symbol': 'GS', 'DataType': 'TRADES', 'BarSize': '1m',
+                  'TickerTime': pd.date_range(dtest(2017, 1, day, 4),
+                                              periods=960, freq='min'),
+                  'closing': 220., 'volume': 100})
+    for day in (4, 5)]